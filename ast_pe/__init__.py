@@ -1,3 +1,6 @@
 # -*- encoding: utf-8 -*-
 
-from ast_pe.specializer import specialized_fn
+__version__ = '0.1'
+
+from ast_pe.specializer import specialized_fn, specialized_fn_async, \
+        specialized_method, specialize_on, specialize_hot
@@ -0,0 +1,149 @@
+# -*- encoding: utf-8 -*-
+
+import time
+import inspect
+import marshal
+import threading
+import traceback
+import multiprocessing
+import cPickle as pickle
+
+from ast_pe.specializer import specialized_code, code_bindings, \
+        eval_specialized_code, STATIC_ALIAS_PREFIX
+from ast_pe.utils import fn_to_ast
+from ast_pe.namespace import Namespace, captured_globals
+from ast_pe.mutation import is_immutable
+
+
+class BatchResult(dict):
+    ''' Mapping of static values to specialized functions.
+    timings is a dict of static values to specialization time in seconds,
+    and errors is a dict of static values to exceptions, raised when
+    specializing for them (they are not in the mapping).
+    If some of static values can not be hashed, all of them are replaced
+    by their indices in the list of values as keys.
+    '''
+    def __init__(self):
+        self.timings = {}
+        self.errors = {}
+        super(BatchResult, self).__init__()
+
+
+def specialize_many(fn, globals_, locals_, names, values, processes=None):
+    ''' Specialize fn on arguments with given names (a single name
+    or a list of names, as in specialize_on) for each item of values
+    (a value, or a tuple of values for a list of names), in a pool
+    of processes (by default one per cpu). Return BatchResult.
+    Workers are forked after fn AST is parsed, so they share it,
+    and they get fn and values via fork too, so only specialized code
+    and bindings are pickled. Bindings of static arguments are replaced
+    with the objects, given here, so that specialized functions use them,
+    and not their copies. Functions, whose other bindings can not be pickled,
+    or can be mutated (they can be copies of parts of static arguments),
+    are specialized again in this process.
+    '''
+    single_name = isinstance(names, basestring)
+    names = [names] if single_name else list(names)
+    values = list(values)
+    static_kwargs_list = [
+            dict(zip(names, [value] if single_name else value))
+            for value in values]
+    result = BatchResult()
+    arg_names = inspect.getargspec(fn).args
+    fn_to_ast(fn) # parse before forking
+    global _batch
+    with _batch_lock:
+        _batch = fn, globals_, locals_, static_kwargs_list
+        try:
+            if processes == 1 or len(values) <= 1:
+                outputs = map(_specialize_item, xrange(len(values)))
+            else:
+                pool = multiprocessing.Pool(processes)
+                try:
+                    outputs = pool.map(_specialize_item, xrange(len(values)))
+                finally:
+                    pool.terminate()
+        finally:
+            _batch = None
+    for value, static_kwargs, (data, seconds, error) in zip(
+            _result_keys(values), static_kwargs_list, outputs):
+        result.timings[value] = seconds
+        if error is not None:
+            result.errors[value] = pickle.loads(error)
+            continue
+        bindings = None
+        if data is not None:
+            code_data, bindings = pickle.loads(data)
+            bindings = _own_bindings(bindings, static_kwargs, arg_names)
+        if bindings is not None:
+            code_object = marshal.loads(code_data)
+            fn_globals = captured_globals(
+                    code_object, Namespace(bindings, locals_, globals_))
+        else:
+            started = time.time()
+            code_object, fn_globals = specialized_code(
+                    fn, globals_, locals_, **static_kwargs)
+            result.timings[value] += time.time() - started
+        result[value] = eval_specialized_code(code_object, fn_globals)
+    return result
+
+
+def _result_keys(values):
+    ''' Return keys of BatchResult for values: values themselves,
+    or their indices if some of them can not be hashed
+    '''
+    try:
+        for value in values:
+            hash(value)
+    except TypeError:
+        return range(len(values))
+    return values
+
+
+def _own_bindings(bindings, static_kwargs, arg_names):
+    ''' Return bindings, unpickled from a worker, with static arguments
+    (and their aliases, see specializer) replaced by the objects
+    of this process, or None if other bindings can be mutated
+    '''
+    own_bindings = {}
+    for name, value in bindings.iteritems():
+        arg_name = name
+        if name.startswith(STATIC_ALIAS_PREFIX):
+            arg_name = name[len(STATIC_ALIAS_PREFIX):]
+        if arg_name in static_kwargs and arg_name in arg_names:
+            own_bindings[name] = static_kwargs[arg_name]
+        elif is_immutable(value):
+            own_bindings[name] = value
+        else:
+            return None
+    return own_bindings
+
+
+# arguments of specialize_many, that forked workers see
+_batch = None
+_batch_lock = threading.Lock()
+
+
+def _specialize_item(index):
+    ''' Return tuple of pickled (marshalled code, bindings) or None
+    if bindings can not be pickled, time taken, and pickled exception
+    or None
+    '''
+    fn, globals_, locals_, static_kwargs_list = _batch
+    started = time.time()
+    try:
+        code_object, fn_globals = specialized_code(
+                fn, globals_, locals_, **static_kwargs_list[index])
+    except Exception as e:
+        try:
+            error = pickle.dumps(e, 2)
+        except Exception:
+            error = pickle.dumps(RuntimeError(traceback.format_exc()), 2)
+        return None, time.time() - started, error
+    seconds = time.time() - started
+    try:
+        data = pickle.dumps((marshal.dumps(code_object),
+            code_bindings(code_object, fn_globals, globals_, locals_)), 2)
+    except Exception:
+        data = None
+    return data, seconds, None
@@ -0,0 +1,86 @@
+# -*- encoding: utf-8 -*-
+
+import dis
+import types
+
+
+LOAD_GLOBAL = dis.opmap['LOAD_GLOBAL']
+LOAD_CONST = dis.opmap['LOAD_CONST']
+EXTENDED_ARG = dis.opmap['EXTENDED_ARG']
+GLOBAL_CHANGES = (dis.opmap['STORE_GLOBAL'], dis.opmap['DELETE_GLOBAL'])
+
+
+def const_globals(code_object, values):
+    ''' Return a copy of code_object, where global variables are loaded
+    with LOAD_CONST instead of LOAD_GLOBAL, if they are in values dict
+    (values are appended to co_consts). Code objects nested in code_object
+    are processed too. Globals that are assigned or deleted anywhere
+    in code_object are left alone.
+    Resulting code object can not be marshalled, unless all values can be.
+    '''
+    changed_names = set()
+    for code in _code_objects(code_object):
+        changed_names.update(code.co_names[arg]
+                for op, arg in _instructions(code) if op in GLOBAL_CHANGES)
+    values = dict((name, value) for name, value in values.iteritems()
+            if name not in changed_names)
+    if not values:
+        return code_object
+    return _replaced(code_object, values)
+
+
+def _replaced(code_object, values):
+    consts = [_replaced(const, values)
+            if isinstance(const, types.CodeType) else const
+            for const in code_object.co_consts]
+    code = bytearray(code_object.co_code)
+    const_indices = {}
+    offset = 0
+    for op, arg in _instructions(code_object):
+        if op == EXTENDED_ARG:
+            # arguments of instructions can change size,
+            # it is too rare to care
+            return code_object
+        elif op == LOAD_GLOBAL and code_object.co_names[arg] in values:
+            name = code_object.co_names[arg]
+            index = const_indices.get(name)
+            if index is None:
+                index = const_indices[name] = len(consts)
+                consts.append(values[name])
+            if index <= 0xffff:
+                # both instructions have 2 byte arguments,
+                # so offsets of other instructions do not change
+                code[offset:offset + 3] = bytearray(
+                        [LOAD_CONST, index & 0xff, index >> 8])
+        offset += 1 if op < dis.HAVE_ARGUMENT else 3
+    c = code_object
+    return types.CodeType(c.co_argcount, c.co_nlocals, c.co_stacksize,
+            c.co_flags, str(code), tuple(consts), c.co_names,
+            c.co_varnames, c.co_filename, c.co_name, c.co_firstlineno,
+            c.co_lnotab, c.co_freevars, c.co_cellvars)
+
+
+def _code_objects(code_object):
+    ''' Yield code_object and all code objects nested in it
+    '''
+    yield code_object
+    for const in code_object.co_consts:
+        if isinstance(const, types.CodeType):
+            for code in _code_objects(const):
+                yield code
+
+
+def _instructions(code_object):
+    ''' Yield (opcode, argument) pairs of code_object, argument is None
+    for instructions without it
+    '''
+    code = bytearray(code_object.co_code)
+    offset = 0
+    while offset < len(code):
+        op = code[offset]
+        if op < dis.HAVE_ARGUMENT:
+            yield op, None
+            offset += 1
+        else:
+            yield op, code[offset + 1] | (code[offset + 2] << 8)
+            offset += 3
@@ -0,0 +1,57 @@
+# -*- encoding: utf-8 -*-
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    ''' Bounded thread-safe mapping, that evicts least recently used items
+    when it grows larger than maxsize (maxsize=None means no limit).
+    Keys must be hashable - TypeError is raised otherwise, just as for dict.
+    '''
+    _missing = object()
+
+    def __init__(self, maxsize=128):
+        assert maxsize is None or maxsize > 0
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        ''' Return value for key, marking it as recently used,
+        or default if it is not present.
+        '''
+        with self._lock:
+            value = self._data.pop(key, self._missing)
+            if value is self._missing:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data[key] = value
+            return value
+
+    def put(self, key, value):
+        ''' Store value for key, unless some other thread already did it.
+        Return the value that ends up in the cache.
+        '''
+        with self._lock:
+            existing = self._data.pop(key, self._missing)
+            if existing is not self._missing:
+                value = existing
+            self._data[key] = value
+            if self.maxsize is not None:
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
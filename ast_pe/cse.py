@@ -0,0 +1,351 @@
+# -*- encoding: utf-8 -*-
+
+import ast
+
+from ast_pe.var_simplifier import SCOPE_TYPES, assignable_names, \
+        param_names, has_dynamic_scope
+
+
+# statements, that are assumed to have side effects, whatever they contain
+SIDE_EFFECT_TYPES = (ast.For, ast.With, ast.Print, ast.Exec, ast.Delete,
+        ast.Import, ast.ImportFrom)
+# nodes, that are fields of expressions, but not expressions themselves
+OPERATOR_TYPES = (ast.expr_context, ast.operator, ast.unaryop, ast.cmpop,
+        ast.boolop)
+# expressions, that are evaluated only under some conditions,
+# or in a nested scope
+LAZY_TYPES = SCOPE_TYPES + (ast.ListComp, )
+
+
+def eliminate_common_subexpressions(fn_def, is_pure_call, new_var_name,
+        is_immutable_call=None):
+    ''' Find repeated side-effect free expressions in FunctionDef node
+    fn_def (it is modified in place), and reuse the value computed first,
+    instead of computing it again. The first value is reused if it is
+    assigned to a variable, or it is hoisted into a new temporary,
+    named by new_var_name().
+    An expression is available from the statement that computes it until
+    the names it reads are assigned, or until any statement with side
+    effects (local names can hold mutable objects), and it is reused only
+    in statements without side effects.
+    Expressions are never moved out of conditions and nested blocks,
+    and blocks are visited in order, so no work is added on any path.
+    Values are shared only if evaluating the expression again gives the
+    same object (loads of attributes and items, and calls), or an
+    immutable one: operators can build new mutable objects, so they are
+    reused only if their operands are known to be immutable.
+    is_pure_call(call_node) should return True, if the call has no side
+    effects, and repeated calls return the same object or an immutable
+    value. is_immutable_call(call_node) should return True, if the call
+    is known to return an immutable value.
+    '''
+    if has_dynamic_scope(fn_def):
+        return
+    local_names = assignable_names(fn_def) | param_names(fn_def)
+    eliminator = _Eliminator(local_names, is_pure_call, new_var_name,
+            is_immutable_call or (lambda node: False))
+    # the first pass finds expressions, that are reused, the second one
+    # hoists them and replaces repeated expressions
+    eliminator.visit_block(fn_def.body, {})
+    eliminator.dry_run = False
+    fn_def.body = eliminator.visit_block(fn_def.body, {})
+
+
+class _Available(object):
+    ''' Expression, that is held by variable holder
+    '''
+    def __init__(self, holder, names, origin):
+        self.holder = holder
+        self.names = names # names, that are read by expression
+        self.origin = origin # node, that computed it first
+
+
+class _Eliminator(object):
+    def __init__(self, local_names, is_pure_call, new_var_name,
+            is_immutable_call):
+        self._local_names = local_names
+        self._is_pure_call = is_pure_call
+        self._new_var_name = new_var_name
+        self._is_immutable_call = is_immutable_call
+        self._reused = set() # nodes, whose values are reused
+        self.dry_run = True
+        # nodes -> results of _is_pure, _is_immutable and _effects (they
+        # do not change, when pure expressions are replaced with variables)
+        self._purity_cache = {}
+        self._immutability_cache = {}
+        self._effects_cache = {}
+        self._descriptions = {} # see _describe
+
+    def visit_block(self, node_list, available):
+        ''' Return new node_list, available (a dict of expression keys
+        to _Available) is updated to what is available after the block
+        '''
+        new_nodes = []
+        for node in node_list:
+            hoisted = []
+            fields = _expression_fields(node)
+            # branches are visited later, so only the test matters for if
+            pure = bool(fields) and not self._has_side_effects(
+                    node.test if isinstance(node, ast.If) else node)
+            assigned = None
+            if pure and isinstance(node, ast.Assign) and \
+                    len(node.targets) == 1 and \
+                    isinstance(node.targets[0], ast.Name) and \
+                    node.targets[0].id in self._local_names and \
+                    self._is_candidate(node.value):
+                # assigned variable will hold the value
+                assigned = node.value, self._describe(node.value)
+            for field in fields:
+                value = getattr(node, field)
+                if value is not None:
+                    setattr(node, field, self._visit_expr(value, available,
+                        hoisted, pure, lazy=False, 
+                        assigned=assigned and assigned[0]))
+            if isinstance(node, ast.If):
+                node.body = self.visit_block(node.body, dict(available))
+                node.orelse = self.visit_block(node.orelse, dict(available))
+            elif isinstance(node, (ast.For, ast.While)):
+                loop_available = dict(available)
+                self._invalidate(loop_available, node)
+                node.body = self.visit_block(node.body, dict(loop_available))
+                node.orelse = self.visit_block(node.orelse, loop_available)
+            self._invalidate(available, node)
+            if assigned is not None:
+                value, description = assigned
+                self._make_available(available, value,
+                        node.targets[0].id, description)
+            new_nodes.extend(hoisted)
+            new_nodes.append(node)
+        return new_nodes
+
+    def _visit_expr(self, node, available, hoisted, pure, lazy, assigned):
+        ''' Return node, with available expressions replaced with
+        variables, that hold them. Expressions, that are reused later,
+        are hoisted into assignments, appended to hoisted list.
+        pure is True if the statement has no side effects, lazy
+        is True if node is not always evaluated, and assigned is 
+        the value of the statement, if it is held by assigned variable.
+        '''
+        if isinstance(node, LAZY_TYPES):
+            return node
+        is_candidate = self._is_candidate(node)
+        if is_candidate:
+            description = self._describe(node)
+            a = available.get(description[0])
+            if a is not None and pure:
+                self._reused.add(a.origin)
+                if self.dry_run:
+                    return node
+                return ast.Name(id=a.holder, ctx=ast.Load())
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, ast.AST):
+                setattr(node, field, self._visit_expr(value, available,
+                    hoisted, pure, lazy or _is_lazy_field(node, field),
+                    assigned))
+            elif isinstance(value, list):
+                value[:] = [self._visit_expr(v, available, hoisted, pure,
+                        lazy or _is_lazy_field(node, field, i), assigned)
+                    if isinstance(v, ast.AST) else v
+                    for i, v in enumerate(value)]
+        if is_candidate and pure and not lazy and node is not assigned:
+            if self.dry_run:
+                self._make_available(available, node, None, description)
+            elif node in self._reused:
+                holder = self._new_var_name()
+                hoisted.append(ast.Assign(
+                    targets=[ast.Name(id=holder, ctx=ast.Store())],
+                    value=node))
+                self._make_available(available, node, holder, description)
+                return ast.Name(id=holder, ctx=ast.Load())
+        return node
+
+    def _describe(self, node):
+        ''' Return key of expression node, and a set of names it reads.
+        Descriptions are built from descriptions of child nodes,
+        so that describing all nodes of an expression takes linear time.
+        '''
+        description = self._descriptions.get(node)
+        if description is None:
+            key, names = [type(node).__name__], set()
+            if isinstance(node, ast.Name):
+                names.add(node.id)
+            for _, value in ast.iter_fields(node):
+                if isinstance(value, list):
+                    key.append(tuple(self._child_key(v, names) 
+                        if isinstance(v, ast.AST) else v for v in value))
+                else:
+                    key.append(self._child_key(value, names))
+            description = self._descriptions[node] = tuple(key), names
+        return description
+
+    def _child_key(self, value, names):
+        ''' Return key of value of a field, adding names it reads to names
+        '''
+        if isinstance(value, OPERATOR_TYPES):
+            return type(value).__name__
+        elif isinstance(value, ast.AST):
+            key, value_names = self._describe(value)
+            names.update(value_names)
+            return key
+        return value
+
+    def _make_available(self, available, node, holder, description):
+        ''' Remember, that holder variable (or nothing in the dry run)
+        holds the value of node
+        '''
+        key, names = description
+        if holder not in names:
+            available[key] = _Available(holder or key, names, node)
+
+    def _invalidate(self, available, node):
+        ''' Remove expressions, that node can change, from available
+        '''
+        if not available:
+            return
+        stored, has_side_effects = self._effects(node)
+        if has_side_effects:
+            # even operators on local names can read mutated objects
+            available.clear()
+            return
+        for key, a in available.items():
+            if a.holder in stored or not stored.isdisjoint(a.names):
+                del available[key]
+
+    def _has_side_effects(self, node):
+        ''' Node can change attributes, items, globals, or call functions
+        with side effects
+        '''
+        return self._effects(node)[1]
+
+    def _effects(self, node):
+        ''' Return a set of names, that node can assign, and a boolean -
+        does it have other side effects (see _has_side_effects)
+        '''
+        effects = self._effects_cache.get(node)
+        if effects is None:
+            stored, has_side_effects = set(), False
+            for n in ast.walk(node):
+                if isinstance(n, ast.Name):
+                    if not isinstance(n.ctx, ast.Load):
+                        stored.add(n.id)
+                elif isinstance(n, ast.AugAssign) and \
+                        isinstance(n.target, ast.Name):
+                    stored.add(n.target.id)
+                elif isinstance(n, SIDE_EFFECT_TYPES) or \
+                        isinstance(n, (ast.Yield, ast.Repr)) or \
+                        (isinstance(n, (ast.Attribute, ast.Subscript)) and
+                            not isinstance(n.ctx, ast.Load)) or \
+                        isinstance(n, ast.AugAssign) or \
+                        (isinstance(n, ast.Call) and not self._is_pure(n)):
+                    has_side_effects = True
+            effects = self._effects_cache[node] = \
+                    stored, has_side_effects
+        return effects
+
+    def _is_candidate(self, node):
+        ''' Node is an expression worth reusing, without side effects,
+        whose value can be shared
+        '''
+        if isinstance(node, (ast.BinOp, ast.BoolOp, ast.Compare,
+                ast.UnaryOp)):
+            # operators on literals are folded by the optimizer,
+            # and unary operators on names are as cheap as loads
+            if all(isinstance(n, (ast.Num, ast.Str)) or
+                    (isinstance(node, ast.UnaryOp) and
+                        isinstance(n, ast.Name))
+                    for n in ast.iter_child_nodes(node)
+                    if isinstance(n, ast.expr)):
+                return False
+            # result of an operator can be a new mutable object
+            if not self._is_immutable(node):
+                return False
+        elif isinstance(node, ast.Subscript):
+            # slices are copies
+            if not isinstance(node.slice, ast.Index):
+                return False
+        elif not isinstance(node, (ast.Attribute, ast.Call)):
+            return False
+        return self._is_pure(node)
+
+    def _is_immutable(self, node):
+        ''' Value of expression node is known to be immutable
+        '''
+        is_immutable = self._immutability_cache.get(node)
+        if is_immutable is None:
+            is_immutable = self._immutability_cache[node] = \
+                    self._check_immutable(node)
+        return is_immutable
+
+    def _check_immutable(self, node):
+        if isinstance(node, (ast.Num, ast.Str)):
+            return True
+        elif isinstance(node, ast.Call):
+            return self._is_immutable_call(node)
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return True
+        elif isinstance(node, ast.Compare) and all(isinstance(op,
+                (ast.Is, ast.IsNot, ast.In, ast.NotIn)) for op in node.ops):
+            return True
+        elif isinstance(node, (ast.BinOp, ast.BoolOp, ast.Compare,
+                ast.UnaryOp)):
+            # operators on built-in immutable values give immutable values
+            return all(self._is_immutable(n)
+                    for n in ast.iter_child_nodes(node)
+                    if not isinstance(n, OPERATOR_TYPES))
+        return False
+
+    def _is_pure(self, node):
+        ''' Evaluating node has no side effects, and it can be evaluated
+        again with the same result
+        '''
+        is_pure = self._purity_cache.get(node)
+        if is_pure is None:
+            is_pure = self._purity_cache[node] = self._check_pure(node)
+        return is_pure
+
+    def _check_pure(self, node):
+        if isinstance(node, (ast.Num, ast.Str)):
+            return True
+        elif isinstance(node, ast.Name):
+            return isinstance(node.ctx, ast.Load)
+        elif isinstance(node, (ast.Tuple, ast.Attribute, ast.Subscript)):
+            if not isinstance(node.ctx, ast.Load):
+                return False
+        elif isinstance(node, ast.Call):
+            if node.starargs is not None or node.kwargs is not None or \
+                    not isinstance(node.func, ast.Name) or \
+                    node.func.id in self._local_names or \
+                    not self._is_pure_call(node):
+                return False
+            return all(self._is_pure(n) for n in node.args) and \
+                    all(self._is_pure(k.value) for k in node.keywords)
+        elif not isinstance(node, (ast.BinOp, ast.BoolOp, ast.Compare,
+                ast.UnaryOp, ast.Index, ast.Slice, ast.Ellipsis,
+                ast.ExtSlice)):
+            return False
+        return all(self._is_pure(n) for n in ast.iter_child_nodes(node)
+                if not isinstance(n, OPERATOR_TYPES))
+
+
+def _expression_fields(node):
+    ''' Names of fields of statement node, holding expressions, that are
+    evaluated once when the statement starts
+    '''
+    if isinstance(node, (ast.Assign, ast.AugAssign, ast.Expr, ast.Return)):
+        return ('value', )
+    elif isinstance(node, ast.If):
+        return ('test', )
+    elif isinstance(node, ast.For):
+        return ('iter', )
+    return ()
+
+
+def _is_lazy_field(node, field, index=None):
+    ''' Value of field of expression node is evaluated only in some cases
+    '''
+    return (isinstance(node, ast.BoolOp) and index > 0) or \
+            (isinstance(node, ast.Compare) and field == 'comparators' and
+                index > 0) or \
+            (isinstance(node, ast.IfExp) and field != 'test')
+
+
@@ -0,0 +1,127 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import sys
+import types
+import marshal
+import hashlib
+import inspect
+import tempfile
+import cPickle as pickle
+
+import ast_pe
+from ast_pe.specializer import specialized_code, code_bindings, \
+        eval_specialized_code
+from ast_pe.utils import code_names
+from ast_pe.namespace import Namespace, captured_globals
+
+
+class DiskCache(object):
+    ''' Persistent cache of specialized functions in directory path.
+    Module code object and the bindings it needs (pickled) are stored,
+    keyed by fn source, static arguments, values of globals referenced
+    by fn, library and python versions. Functions that can not be stored
+    (e.g. bindings can not be pickled) are just specialized every time,
+    and broken cache entries are ignored.
+    Note that globals of the functions inlined into fn are not checked.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.hits = self.misses = 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def specialized_fn(self, fn, globals_, locals_, *args, **kwargs):
+        ''' Same as ast_pe.specialized_fn, but load from cache if possible,
+        and store the result in cache
+        '''
+        key = self._get_key(fn, globals_, locals_, args, kwargs)
+        if key is not None:
+            specialized = self._load(key, globals_, locals_)
+            if specialized is not None:
+                self.hits += 1
+                return specialized
+        self.misses += 1
+        code_object, fn_globals = specialized_code(
+                fn, globals_, locals_, *args, **kwargs)
+        if key is not None:
+            self._store(key, code_object, fn_globals, globals_, locals_)
+        return eval_specialized_code(code_object, fn_globals)
+
+    def clear(self):
+        for filename in os.listdir(self.path):
+            if filename.endswith('.pe'):
+                os.remove(os.path.join(self.path, filename))
+
+    def _get_key(self, fn, globals_, locals_, args, kwargs):
+        ''' Return hex digest, or None if some values can not be pickled
+        '''
+        fn = getattr(fn, '__wrapped__', fn)
+        env = Namespace(locals_, globals_)
+        try:
+            referenced = sorted(
+                    (name, _fingerprint(env[name]))
+                    for name in code_names(fn.__code__) if name in env)
+            data = pickle.dumps((
+                inspect.getsource(fn), referenced,
+                [_fingerprint(arg) for arg in args],
+                sorted((k, _fingerprint(v)) for k, v in kwargs.iteritems()),
+                ast_pe.__version__, sys.version), 2)
+        except Exception:
+            return None
+        return hashlib.sha1(data).hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.path, key + '.pe')
+
+    def _load(self, key, globals_, locals_):
+        ''' Return specialized function, or None if it is not in cache
+        or can not be loaded
+        '''
+        try:
+            with open(self._filename(key), 'rb') as f:
+                code_data, bindings = pickle.load(f)
+            code_object = marshal.loads(code_data)
+            fn_globals = captured_globals(
+                    code_object, Namespace(bindings, locals_, globals_))
+            return eval_specialized_code(code_object, fn_globals)
+        except Exception:
+            return None
+
+    def _store(self, key, code_object, fn_globals, globals_, locals_):
+        ''' Store code object and bindings, that can not be found
+        in globals_ and locals_, ignoring bindings that can not be pickled
+        '''
+        bindings = code_bindings(code_object, fn_globals, globals_, locals_)
+        try:
+            data = pickle.dumps((marshal.dumps(code_object), bindings), 2)
+        except Exception:
+            return
+        # write to a temporary file first, so that other processes
+        # never read partially written entry
+        fd, tmp_filename = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmp_filename, self._filename(key))
+        except Exception:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+
+def _fingerprint(value):
+    ''' Return picklable value, that changes when value changes.
+    Functions, classes and modules are identified by their names
+    (and code for python functions), other values are pickled.
+    '''
+    wrapped = getattr(value, '__wrapped__', None)
+    if wrapped is not None:
+        return 'wrapped', _fingerprint(wrapped)
+    elif isinstance(value, types.FunctionType):
+        return 'function', value.__module__, value.__name__, \
+                marshal.dumps(value.__code__)
+    elif isinstance(value, types.ModuleType):
+        return 'module', value.__name__
+    elif isinstance(value, (type, types.ClassType, types.BuiltinFunctionType)):
+        return 'name', getattr(value, '__module__', None), value.__name__
+    return 'value', pickle.dumps(value, 2)
@@ -0,0 +1,178 @@
+# -*- encoding: utf-8 -*-
+
+import re
+import ast
+import operator
+
+from ast_pe.mutation import is_immutable
+
+
+# do not fold to strings, tuples, etc. with more items
+MAX_SIZE = 4096
+# do not fold to integers with more bits
+MAX_INT_BITS = 4096
+
+
+UNARY_OPERATORS = {
+        ast.Not: operator.not_,
+        ast.Invert: operator.invert,
+        ast.UAdd: operator.pos,
+        ast.USub: operator.neg,
+        }
+
+BINARY_OPERATORS = {
+        ast.Add: operator.add,
+        ast.Sub: operator.sub,
+        ast.Mult: operator.mul,
+        ast.Mod: operator.mod,
+        ast.Pow: operator.pow,
+        ast.LShift: operator.lshift,
+        ast.RShift: operator.rshift,
+        ast.BitOr: operator.or_,
+        ast.BitAnd: operator.and_,
+        ast.BitXor: operator.xor,
+        ast.FloorDiv: operator.floordiv,
+        }
+
+# "/" is true division in code compiled with "from __future__ import division"
+DIVISION_OPERATORS = {
+        False: operator.div,
+        True: operator.truediv,
+        }
+
+COMPARE_OPERATORS = {
+        ast.Eq: operator.eq,
+        ast.NotEq: operator.ne,
+        ast.Lt: operator.lt,
+        ast.LtE: operator.le,
+        ast.Gt: operator.gt,
+        ast.GtE: operator.ge,
+        ast.Is: operator.is_,
+        ast.IsNot: operator.is_not,
+        ast.In: lambda a, b: a in b,
+        ast.NotIn: lambda a, b: a not in b,
+        }
+
+# containers, for which membership test does not run any user code,
+# if all their items are immutable
+CONTAINER_TYPES = (tuple, list, frozenset, set, dict)
+SEQUENCE_TYPES = (str, unicode, tuple)
+# containers, indexing of which does not run any user code
+SUBSCRIPT_TYPES = (str, unicode, tuple, list, dict)
+INTEGER_TYPES = (int, long, bool)
+# objects with stable identity, that are safe to compare with "is"
+SINGLETONS = (None, True, False, NotImplemented, Ellipsis)
+
+# string formatting with large or variable field width
+_wide_format_re = re.compile(r'%[-#0 +]*(\d{4,}|\*)')
+
+
+def fold_unary(op, value):
+    ''' Return tuple of boolean (operation can be folded), and result
+    of applying unary operator op (AST node) to value
+    '''
+    if isinstance(op, ast.Not):
+        # known values are not mutated, so their truth value is known
+        return _applied(operator.not_, value)
+    elif is_immutable(value):
+        return _applied(UNARY_OPERATORS[type(op)], value)
+    return False, None
+
+
+def fold_binary(op, left, right, true_division=None):
+    ''' Return tuple of boolean (operation can be folded), and result
+    of applying binary operator op (AST node) to left and right.
+    true_division tells if "/" is true division - if it is None (not known),
+    division is not folded.
+    '''
+    if isinstance(op, ast.Div):
+        if true_division is None:
+            return False, None
+        fn = DIVISION_OPERATORS[true_division]
+    else:
+        fn = BINARY_OPERATORS[type(op)]
+    if is_immutable(left) and is_immutable(right) and \
+            _is_cheap(op, left, right):
+        return _applied(fn, left, right)
+    return False, None
+
+
+def fold_compare(op, left, right):
+    ''' Return tuple of boolean (comparison can be folded), and result
+    of comparing left and right with op (AST node)
+    '''
+    if isinstance(op, (ast.Is, ast.IsNot)):
+        # identity of equal immutable values depends on the compiler
+        can_fold = _has_identity(left) or _has_identity(right) or \
+                not (is_immutable(left) or is_immutable(right))
+    elif isinstance(op, (ast.In, ast.NotIn)):
+        can_fold = _is_value(left) and (
+                (type(right) in (str, unicode) and
+                    type(left) in (str, unicode)) or
+                (type(right) in CONTAINER_TYPES and len(right) <= MAX_SIZE
+                    and all(_is_value(item) for item in right)))
+    else:
+        can_fold = _is_value(left) and _is_value(right)
+    if can_fold:
+        return _applied(COMPARE_OPERATORS[type(op)], left, right)
+    return False, None
+
+
+def fold_subscript(value, index):
+    ''' Return tuple of boolean (indexing can be folded), and value[index]
+    '''
+    if type(value) in SUBSCRIPT_TYPES and _is_value(index):
+        return _applied(operator.getitem, value, index)
+    return False, None
+
+
+def _applied(fn, *args):
+    ''' Return tuple of boolean (fn can be applied to args), and result.
+    Exceptions are left to be raised at run time.
+    '''
+    try:
+        result = fn(*args)
+    except Exception:
+        return False, None
+    if _is_too_large(result):
+        return False, None
+    return True, result
+
+
+def _is_cheap(op, left, right):
+    ''' Check that computing the result of binary operation will not
+    take too much memory or time
+    '''
+    if isinstance(op, ast.Mult):
+        for seq, n in ((left, right), (right, left)):
+            if type(seq) in SEQUENCE_TYPES and type(n) in INTEGER_TYPES:
+                return len(seq) * n <= MAX_SIZE
+    elif isinstance(op, ast.Pow):
+        if type(left) in INTEGER_TYPES and type(right) in INTEGER_TYPES:
+            return abs(left) <= 1 or right <= 0 or \
+                    left.bit_length() * right <= MAX_INT_BITS
+    elif isinstance(op, ast.LShift):
+        if type(left) in INTEGER_TYPES and type(right) in INTEGER_TYPES:
+            return left.bit_length() + right <= MAX_INT_BITS
+    elif isinstance(op, ast.Mod):
+        if type(left) in (str, unicode):
+            return not _wide_format_re.search(left)
+    return True
+
+
+def _is_too_large(value):
+    if type(value) in INTEGER_TYPES:
+        return value.bit_length() > MAX_INT_BITS
+    elif type(value) in SEQUENCE_TYPES:
+        return len(value) > MAX_SIZE
+    return False
+
+
+def _is_value(value):
+    ''' value can be compared without running user code
+    '''
+    return is_immutable(value) or type(value) is type
+
+
+def _has_identity(value):
+    return type(value) is type or any(value is v for v in SINGLETONS)
@@ -29,25 +29,37 @@ class Inliner(ast.NodeTransformer):
         '''
         self.generic_visit(node)
         if node.id in self._locals:
-            if node.id in self._mangled:
-                mangled_id = self._mangled[node.id]
-            else:
-                mangled_id = new_var_name(self)
-                self._mangled[node.id] = mangled_id
-            return ast.Name(id=mangled_id, ctx=node.ctx)
+            return ast.Name(id=self._mangled_name(node.id), ctx=node.ctx)
         else:
             return node
 
+    def visit_arguments(self, node):
+        ''' *args and **kwargs are plain names, not Name nodes
+        '''
+        self.generic_visit(node)
+        if node.vararg:
+            node.vararg = self._mangled_name(node.vararg)
+        if node.kwarg:
+            node.kwarg = self._mangled_name(node.kwarg)
+        return node
+
     def visit_Return(self, node):
-        ''' Substitute return with return variable assignment + break
+        ''' Substitute return with return variable assignment + break.
+        Breaks are removed later, when control flow allows 
+        (see ast_pe.optimizer._lowered_returns).
         '''
         self.generic_visit(node)
         if self._return_var is None:
             self._return_var = new_var_name(self)
+        value = node.value
+        if value is None:
+            value = ast.Name(id='None', ctx=ast.Load())
         return [ast.Assign(
                     targets=[ast.Name(id=self._return_var, ctx=ast.Store())],
-                    value=node.value),
+                    value=value),
                 ast.Break()]
 
-
-
+    def _mangled_name(self, name):
+        if name not in self._mangled:
+            self._mangled[name] = new_var_name(self)
+        return self._mangled[name]
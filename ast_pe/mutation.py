@@ -0,0 +1,267 @@
+# -*- encoding: utf-8 -*-
+
+import ast
+import types
+import inspect
+
+from ast_pe.utils import fn_to_ast, get_locals
+
+
+IMMUTABLE_TYPES = (
+        int, long, float, complex, bool, str, unicode, type(None))
+
+
+def is_immutable(value):
+    ''' Value (and everything it references) can not be mutated
+    '''
+    if type(value) in IMMUTABLE_TYPES:
+        return True
+    elif type(value) in (tuple, frozenset):
+        return all(is_immutable(v) for v in value)
+    return False
+
+
+class MutationAnalyzer(object):
+    ''' Find out which variables can be mutated, before any optimizations
+    are made, so that we never substitute values that can change.
+    Mutation is propagated through aliases: if "a = foo.bar" and "a"
+    is mutated, than "foo" is mutated too.
+    '''
+    def __init__(self, get_node_value_if_known, is_pure_fn, is_inlined_fn):
+        self._get_node_value_if_known = get_node_value_if_known
+        self._is_pure_fn = is_pure_fn
+        self._is_inlined_fn = is_inlined_fn
+        self._fn_cache = {} # fn -> (arg names, locals, mutated names)
+
+    def mutated_names(self, ast_tree, local_names=()):
+        ''' Return a set of names, whose values can be mutated in ast_tree.
+        Values of local_names are not looked up.
+        '''
+        visitor = MutationVisitor(self, local_names)
+        visitor.visit(ast_tree)
+        return visitor.get_mutated()
+
+    def mutated_args(self, fn, call_node):
+        ''' Return a list of argument nodes of call_node, that
+        can be mutated by inlined fn
+        '''
+        _, _, mutated = self._analyze_fn(fn)
+        return [arg_node for arg_name, arg_node
+                in call_arg_nodes(fn, call_node) if arg_name in mutated]
+
+    def mutated_params(self, fn):
+        ''' Return a set of parameter names of inlined fn, that can be mutated
+        '''
+        arg_names, _, mutated = self._analyze_fn(fn)
+        return mutated.intersection(arg_names)
+
+    def mutated_locals(self, fn):
+        ''' Return a set of local names (including parameters) 
+        of inlined fn, that can be mutated
+        '''
+        _, fn_locals, mutated = self._analyze_fn(fn)
+        return mutated & fn_locals
+
+    def mutated_globals(self, fn):
+        ''' Return a set of non-local names, that can be mutated by inlined fn
+        '''
+        _, fn_locals, mutated = self._analyze_fn(fn)
+        return mutated - fn_locals
+
+    def _analyze_fn(self, fn):
+        ''' Analyze body of inlined function. Recursive calls
+        see partial results, so we iterate until they stop growing.
+        '''
+        # methods bound to different objects have the same body
+        key = getattr(fn, '__func__', fn)
+        if key not in self._fn_cache:
+            fn_ast = fn_to_ast(fn).body[0]
+            arg_names = [arg.id for arg in fn_ast.args.args
+                    if isinstance(arg, ast.Name)] + [name for name in
+                            (fn_ast.args.vararg, fn_ast.args.kwarg) if name]
+            fn_locals = get_locals(fn_ast)
+            self._fn_cache[key] = arg_names, fn_locals, set()
+            while True:
+                mutated = self.mutated_names(fn_ast, fn_locals)
+                if mutated == self._fn_cache[key][2]:
+                    break
+                self._fn_cache[key] = arg_names, fn_locals, mutated
+        return self._fn_cache[key]
+
+
+class MutationVisitor(ast.NodeVisitor):
+    ''' Collect mutated names and aliases between names in one tree
+    '''
+    def __init__(self, analyzer, local_names):
+        self._analyzer = analyzer
+        self._local_names = local_names
+        self._mutated = set()
+        self._aliases = {} # name -> set of names it can reference
+        super(MutationVisitor, self).__init__()
+
+    def get_mutated(self):
+        ''' Return mutated names, propagating mutations through aliases
+        '''
+        mutated = set()
+        to_visit = list(self._mutated)
+        while to_visit:
+            name = to_visit.pop()
+            if name not in mutated:
+                mutated.add(name)
+                to_visit.extend(self._aliases.get(name, ()))
+        return mutated
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        is_known, fn = self._get_fn_if_known(node.func)
+        if is_known and self._analyzer._is_inlined_fn(fn) and \
+                call_arg_nodes(fn, node) is not None:
+            for arg_node in self._analyzer.mutated_args(fn, node):
+                self._mark_mutated(arg_node)
+            self._mutated.update(self._analyzer.mutated_globals(fn))
+        elif not (is_known and self._analyzer._is_pure_fn(fn)):
+            # if we don't know it's pure, it can mutate the arguments
+            arg_nodes = node.args + [kw.value for kw in node.keywords]
+            star_nodes = [n for n in (node.starargs, node.kwargs) 
+                    if n is not None]
+            if is_known and self._analyzer._is_inlined_fn(fn):
+                # it can still be inlined, when star arguments are known,
+                # and then only their items are passed
+                self._mutated.update(self._analyzer.mutated_globals(fn))
+                if self._analyzer.mutated_params(fn):
+                    arg_nodes += [n for n in star_nodes
+                            if not self._has_immutable_items(n)]
+            else:
+                arg_nodes += star_nodes
+            for arg_node in arg_nodes:
+                self._mark_mutated(arg_node)
+            # if this a method call, it can also mutate "self"
+            if isinstance(node.func, ast.Attribute):
+                self._mark_mutated(node.func.value)
+
+    def visit_Assign(self, node):
+        self.generic_visit(node)
+        for target in node.targets:
+            self._add_aliases(target, node.value)
+
+    def visit_AugAssign(self, node):
+        self.generic_visit(node)
+        # e.g. "+=" extends lists in place
+        self._mark_mutated(node.target)
+        self._add_aliases(node.target, node.value)
+
+    def visit_For(self, node):
+        self.generic_visit(node)
+        is_known, iterable = self._analyzer._get_node_value_if_known(node.iter)
+        if not (is_known and type(iterable) in (list, tuple, dict, frozenset)
+                and all(is_immutable(v) for v in iterable)):
+            self._add_aliases(node.target, node.iter)
+
+    def visit_With(self, node):
+        self.generic_visit(node)
+        if node.optional_vars is not None:
+            self._add_aliases(node.optional_vars, node.context_expr)
+
+    def visit_Attribute(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.ctx, ast.Load):
+            self._mark_mutated(node.value)
+
+    def visit_Subscript(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.ctx, ast.Load):
+            self._mark_mutated(node.value)
+
+    def _has_immutable_items(self, node):
+        ''' node is a known tuple, list or dict, with immutable items
+        '''
+        is_known, value = self._analyzer._get_node_value_if_known(node)
+        if is_known and isinstance(value, dict):
+            value = value.values()
+        return is_known and type(value) in (tuple, list) and \
+                all(is_immutable(v) for v in value)
+
+    def _get_fn_if_known(self, node):
+        if isinstance(node, ast.Name) and node.id in self._local_names:
+            return False, None
+        return self._analyzer._get_node_value_if_known(node)
+
+    def _mark_mutated(self, node):
+        ''' Mark all names that can reference the value of node as mutated
+        '''
+        self._mutated.update(_referenced_names(node))
+
+    def _add_aliases(self, target, value):
+        ''' Names in target (or the object, whose item or attribute
+        is assigned) can reference values of names in value
+        '''
+        value_names = _referenced_names(value)
+        if value_names:
+            for name in _referenced_names(target):
+                self._aliases.setdefault(name, set()).update(value_names)
+
+
+def call_arg_nodes(fn, call_node):
+    ''' Return a list of (parameter name, argument node) pairs, binding
+    arguments of call_node to parameters of fn, in the order arguments
+    are evaluated. For bound methods, the object (node.func.value)
+    is the first argument. Extra positional and keyword arguments are
+    bound to *args and **kwargs parameters as new tuple and dict nodes.
+    Parameters, that take default values, are not included.
+    Return None if arguments can not be bound statically: the call
+    has *args or **kwargs, they do not match the signature of fn,
+    the object of a bound method has no node, or fn has tuple parameters.
+    '''
+    try:
+        arg_names, vararg, kwarg, defaults = inspect.getargspec(fn)
+    except TypeError:
+        return None
+    if call_node.starargs is not None or call_node.kwargs is not None or \
+            not all(isinstance(name, str) for name in arg_names):
+        return None
+    arg_nodes = list(call_node.args)
+    if isinstance(fn, types.MethodType) and fn.__self__ is not None:
+        if not isinstance(call_node.func, ast.Attribute):
+            return None
+        arg_nodes.insert(0, call_node.func.value)
+    bound = zip(arg_names, arg_nodes)
+    extra_args = arg_nodes[len(arg_names):]
+    if extra_args and vararg is None:
+        return None
+    elif vararg is not None:
+        bound.append((vararg, ast.Tuple(elts=extra_args, ctx=ast.Load())))
+    bound_names = set(name for name, _ in bound)
+    extra_keywords = []
+    for keyword in call_node.keywords:
+        if keyword.arg in bound_names:
+            return None
+        elif keyword.arg in arg_names:
+            if not _is_simple(keyword.value) and \
+                    not all(_is_simple(k.value) for k in extra_keywords):
+                # **kwargs dict is built after all keywords, so this value
+                # would be evaluated before values of extra keywords
+                return None
+            bound.append((keyword.arg, keyword.value))
+            bound_names.add(keyword.arg)
+        elif kwarg is None:
+            return None
+        else:
+            extra_keywords.append(keyword)
+    if kwarg is not None:
+        bound.append((kwarg, ast.Dict(
+            keys=[ast.Str(s=k.arg) for k in extra_keywords],
+            values=[k.value for k in extra_keywords])))
+    required_names = arg_names[:len(arg_names) - len(defaults or ())]
+    if not bound_names.issuperset(required_names):
+        return None
+    return bound
+
+
+def _is_simple(node):
+    ''' Evaluating node can not have side effects
+    '''
+    return isinstance(node, (ast.Name, ast.Num, ast.Str))
+
+
+def _referenced_names(node):
+    return set(n.id for n in ast.walk(node) if isinstance(n, ast.Name))
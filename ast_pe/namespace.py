@@ -0,0 +1,94 @@
+# -*- encoding: utf-8 -*-
+
+from ast_pe.utils import code_names
+
+
+class Namespace(object):
+    ''' Mapping of names to values, layered over parent mappings,
+    that are looked up in the given order, and are never modified.
+    Only changes (assigned and deleted names) are stored in the namespace
+    itself, so it is cheap to create and copy, even when parents
+    are large (e.g. module globals).
+    '''
+    def __init__(self, *parents):
+        self._parents = parents
+        self._own = {}
+        self._deleted = set()
+
+    def __contains__(self, name):
+        if name in self._own:
+            return True
+        elif name in self._deleted:
+            return False
+        return any(name in parent for parent in self._parents)
+
+    def __getitem__(self, name):
+        try:
+            return self._own[name]
+        except KeyError:
+            pass
+        if name not in self._deleted:
+            for parent in self._parents:
+                if name in parent:
+                    return parent[name]
+        raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        self._own[name] = value
+        self._deleted.discard(name)
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        self._own.pop(name, None)
+        self._deleted.add(name)
+
+    def __repr__(self):
+        return '<Namespace own=%r deleted=%r>' % (
+                self._own, sorted(self._deleted))
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def pop(self, name, *default):
+        try:
+            value = self[name]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[name]
+        return value
+
+    def copy(self):
+        ''' Return namespace with the same parents and own copy of changes
+        '''
+        namespace = Namespace(*self._parents)
+        namespace._own = dict(self._own)
+        namespace._deleted = set(self._deleted)
+        return namespace
+
+    def changed_names(self):
+        ''' Return a set of names, assigned or deleted in this namespace
+        (not in parents)
+        '''
+        return set(self._own) | self._deleted
+
+    def same_parents(self, other):
+        return len(self._parents) == len(other._parents) and all(
+                a is b for a, b in zip(self._parents, other._parents))
+
+
+def captured_globals(code_object, namespace):
+    ''' Return a dict of globals to evaluate code_object with:
+    values of the names it references (and __builtins__),
+    looked up in namespace
+    '''
+    fn_globals = {}
+    for name in code_names(code_object) | set(['__builtins__']):
+        if name in namespace:
+            fn_globals[name] = namespace[name]
+    return fn_globals
@@ -2,41 +2,107 @@
 
 import __builtin__
 import ast
-import operator
+import types
+import inspect
+import itertools
 
-from ast_pe.utils import ast_to_string, get_logger, fn_to_ast, new_var_name, \
-        get_locals
+from ast_pe.utils import fn_to_ast, new_var_name, get_locals, copy_ast, \
+        ast_to_source, is_true_division
 from ast_pe.inliner import Inliner
 from ast_pe.var_simplifier import remove_assignments
+from ast_pe.mutation import MutationAnalyzer, is_immutable, call_arg_nodes, \
+        IMMUTABLE_TYPES
+from ast_pe.folding import fold_unary, fold_binary, fold_compare, \
+        fold_subscript
+from ast_pe.namespace import Namespace
+from ast_pe.cse import eliminate_common_subexpressions
+from ast_pe.purity import PurityAnalyzer
+from ast_pe.cache import LRUCache
 
 
-logger = get_logger(__name__, debug=False)
+# immutable results of pure functions, evaluated at specialization time,
+# keyed by function and arguments (see _memo_key), shared by all
+# specializations in the process
+_pure_call_cache = LRUCache(maxsize=4096)
+_missing = object()
 
+# types, whose values are equal only if they are the same
+# (unlike e.g. floats 0.0 and -0.0)
+SIMPLE_KEY_TYPES = frozenset([int, long, str, unicode, bool, type(None)])
 
-def optimized_ast(ast_tree, constants):
-    ''' Try running Optimizer until it finishes without rollback.
-    Return optimized AST and a list of bindings that the AST needs.
+# pure functions, whose results are not memoized: they read attributes,
+# that can change, or depend on identity of arguments, and equal
+# arguments can be different objects
+UNMEMOIZED_FUNCTIONS = (getattr, hasattr, dir, id)
+
+
+def pure_call_cache_info():
+    ''' Return a dict with statistics of the shared cache of pure function
+    results
+    '''
+    return dict(hits=_pure_call_cache.hits,
+            misses=_pure_call_cache.misses,
+            size=len(_pure_call_cache), maxsize=_pure_call_cache.maxsize)
+
+
+def pure_call_cache_clear():
+    _pure_call_cache.clear()
+
+
+def optimized_ast(ast_tree, constants, tracer=None, report=None,
+        frozen_attrs=None, true_division=False):
+    ''' Optimize ast_tree, given a mapping of known constants
+    (it is not modified, and is not copied).
+    Return optimized AST and a dict of new bindings that the AST needs
+    in addition to constants.
+    Constants that can be mutated are found before optimization,
+    so one pass is enough, unless Optimizer still finds a mutation - 
+    than we restart from a fresh copy of ast_tree.
+    :tracer: is an optional ast_pe.tracing.Tracer instance.
+    If :report: dict is given, the number of passes is stored 
+    in report['passes'], and calls, that are not inlined,
+    in report['not_inlined'] (see Optimizer.get_not_inlined).
+    :frozen_attrs: is passed to Optimizer.
+    :true_division: tells if "/" is true division, as in ast_tree compiled
+    by compile_ast (None if it is not known). It is also true division,
+    if ast_tree has "from __future__ import division".
+    Common subexpressions of functions are eliminated after optimization.
     '''
-    optimizer = Optimizer(constants)
+    if _imports_true_division(ast_tree):
+        true_division = True
+    optimizer = Optimizer(constants, tracer=tracer, frozen_attrs=frozen_attrs,
+            true_division=true_division)
+    optimizer.forget_mutated(ast_tree)
+    passes = 0
     while True:
+        passes += 1
         try:
-            new_ast = optimizer.visit(ast_tree)
-        except Optimizer.Rollback:
-            logger.debug('rollback', exc_info=True)
+            new_ast = optimizer.visit(copy_ast(ast_tree))
+        except Optimizer.Rollback as e:
+            if tracer is not None:
+                tracer.rollback(str(e))
             # we gathered more knowledge and want to try again
             continue
         else:
-            all_bindings = constants
-            all_bindings.update(optimizer.get_bindings())
-            return new_ast, all_bindings
-
-
-# FIXME - it operates on AST for now, but should operate on CFG instread,
-# will change it later, should be easyish???
+            break
+    for node in new_ast.body:
+        if isinstance(node, ast.FunctionDef):
+            # after inlining, so that work of separate call sites is shared
+            eliminate_common_subexpressions(node, optimizer._is_reusable_call,
+                    lambda : new_var_name(optimizer),
+                    optimizer._is_immutable_call)
+    if report is not None:
+        report['passes'] = passes
+        report['not_inlined'] = optimizer.get_not_inlined()
+    return new_ast, optimizer.get_bindings()
 
 
 class Optimizer(ast.NodeTransformer):
-    ''' Simplify AST, given information about what variables are known
+    ''' Simplify AST, given information about what variables are known.
+    Knowledge is flow-sensitive: self._constants holds the values known
+    at the statement being visited. Assignments update it, branches of "if"
+    are visited with their own copies that are joined afterwards,
+    and names assigned in loops are forgotten before visiting them.
     '''
     class Rollback(Exception): pass
 
@@ -64,33 +130,149 @@ class Optimizer(ast.NodeTransformer):
             dir, id, oct, sorted,
             )
 
-    def __init__(self, constants):
+    # pure functions, that return new mutable objects or iterators,
+    # so their results can not be shared
+    FRESH_RESULT_FUNCTIONS = (
+            bytearray, dict, enumerate, filter, iter, list, map, object,
+            range, reversed, set, sorted, zip)
+
+    # pure functions, that always return immutable values, so operators
+    # on their results can be shared too
+    IMMUTABLE_RESULT_FUNCTIONS = (
+            bin, bool, callable, chr, cmp, complex, float, format, hasattr,
+            hash, hex, id, int, isinstance, issubclass, len, long, oct, ord,
+            repr, round, str, unichr, unicode)
+
+    # methods of built-in types, that are pure in the same sense
+    PURE_METHODS = {
+            dict: ('get', 'has_key', 'items', 'keys', 'values',
+                'iteritems', 'iterkeys', 'itervalues'),
+            list: ('count', 'index'),
+            tuple: ('count', 'index'),
+            str: ('count', 'endswith', 'find', 'format', 'index', 'isalnum',
+                'isalpha', 'isdigit', 'islower', 'isspace', 'isupper', 'join',
+                'lower', 'lstrip', 'partition', 'replace', 'rfind', 'rsplit',
+                'rstrip', 'split', 'splitlines', 'startswith', 'strip',
+                'upper'),
+            }
+    PURE_METHODS[unicode] = PURE_METHODS[str]
+
+    # infer purity of python functions, that are not marked with
+    # @pure_function, from their source (see ast_pe.purity).
+    # Off by default: inferred pure functions are called at specialization
+    # time, and nothing stops them, if they run for too long
+    INFER_PURITY = False
+
+    # budgets of inlining into one specialized function: calls nested
+    # in more inlined calls, or whose inlining would make inlined code
+    # larger than the number of AST nodes, are left as regular calls.
+    # Inlined code can fold to almost nothing (e.g. recursion on known
+    # arguments), so the size of all inlined bodies before folding
+    # is limited by the same number too
+    MAX_INLINE_DEPTH = 32
+    MAX_INLINED_NODES = 5000
+
+    # types of iterables, that can be unrolled in "for" loops
+    UNROLL_TYPES = (list, tuple, xrange, str, unicode, dict, frozenset)
+    # do not unroll loops with more iterations
+    MAX_UNROLL_ITERATIONS = 100
+    # the same for "while" loops (e.g. interpreter dispatch loops)
+    MAX_WHILE_ITERATIONS = 1000
+
+    def __init__(self, constants, tracer=None, frozen_attrs=None,
+            true_division=None):
         ''' 
-        :constants: a dict names-> values of variables known at compile time
+        :constants: a mapping names-> values of variables known
+        at compile time
+        :tracer: optional ast_pe.tracing.Tracer instance
+        :true_division: tells if "/" is true division in optimized code,
+        None if it is not known (then "/" is not folded). Functions, that
+        use a different division, are not inlined.
+        :frozen_attrs: optional dict of names -> (object, attribute names),
+        for variables that always hold object, whose given attributes
+        never change. Objects are not known (they can be mutated),
+        but reads of frozen attributes are replaced with their values,
+        and methods marked with @inline are inlined.
+        Constants are layered over the given mapping, so copying them
+        for each branch or scope does not copy e.g. all module globals.
         '''
-        self._constants = dict(constants)
+        self._initial_constants = Namespace(constants)
+        self._frozen_attrs = dict(frozen_attrs or {})
+        for name in self._frozen_attrs:
+            self._initial_constants.pop(name, None)
+        # known at the current statement
+        self._constants = self._initial_constants.copy()
+        self._bindings = {} # variables, generated by optimizer
+        self._stored_names = set() # all names, assigned in optimized tree
+        # (including parameters), and names assigned not as parameters
+        self._assigned_names = set()
+        self._mutated_names = set() # names, whose values can be mutated
+        self._fn_depth = 0
+        self._tracer = tracer
+        self._true_division = true_division
         self._var_count = 0
         self._depth = 0
         self._mutated_nodes = set()
+        self._returns_from_loops = {} # inlined fn -> boolean
+        self._inline_costs = {} # inlined fn -> estimated size of its body
+        self._divisions = {} # inlined fn -> does it use "/"
+        self._inline_depth = 0
+        self._inlined_nodes = 0 # size of inlined code
+        self._inlining_work = 0 # size of inlined bodies before folding
+        self._not_inlined = [] # see get_not_inlined
         self._current_block = None # None, or a list of nodes that correspond
         # to currently visited code block
+        self._purity_analyzer = PurityAnalyzer(self._is_known_pure_fn)
+        self._mutation_analyzer = MutationAnalyzer(
+                self._get_node_value_if_known,
+                self._is_pure_fn, self._is_inlined_fn)
         super(Optimizer, self).__init__()
+
+    def forget_mutated(self, ast_tree):
+        ''' Forget values of constants that can be mutated in ast_tree.
+        Names assigned in ast_tree are also remembered here, as they
+        must not be looked up in builtins.
+        '''
+        self._stored_names = get_locals(ast_tree)
+        self._assigned_names = _names_assigned_in(ast_tree)
+        self._mutated_names = self._mutation_analyzer.mutated_names(ast_tree)
+        for name, (obj, attrs) in self._frozen_attrs.items():
+            if name in self._assigned_names:
+                del self._frozen_attrs[name]
+            else:
+                self._frozen_attrs[name] = \
+                        obj, attrs - _attrs_assigned_in(ast_tree, name)
+        for name in self._mutated_names:
+            if name in self._initial_constants and \
+                    not is_immutable(self._initial_constants[name]):
+                del self._initial_constants[name]
+        self._constants = self._initial_constants.copy()
     
     def get_bindings(self):
         ''' Return a dict, populated with newly bound variables 
-        (results of calculations done at compile time), and survived
-        initial constants.
+        (results of calculations done at compile time).
         '''
-        return self._constants
+        return self._bindings
+
+    def get_not_inlined(self):
+        ''' Return a list of calls of functions marked with @inline,
+        that were left as regular calls: dicts with fn name, call source,
+        and reason - "depth" or "size" if inlining budgets
+        (MAX_INLINE_DEPTH or MAX_INLINED_NODES) are exceeded,
+        "arguments" if arguments can not be bound to parameters statically,
+        "loop return" if fn returns from a loop, or "division" if "/" in fn
+        would not be the same division, as in the code it is inlined into.
+        '''
+        return self._not_inlined
 
     def generic_visit(self, node):
         ''' Completly substite parent class "generic_visit", in order to
         be able to insert some code at the line before current expression
         (e.g. when inlining functions).
-        Also do some logging.
+        Also call tracer hooks.
         '''
-        prefix = '--' * self._depth
-        logger.debug('%s visit:\n%s', prefix, ast_to_string(node))
+        if self._tracer is not None:
+            self._tracer.enter_node(node, self._depth)
         self._depth += 1
         # copy-paste from ast.py, added self._current_block handling 
         block_fields = ['body', 'orelse'] # TODO more?
@@ -123,14 +305,159 @@ class Optimizer(ast.NodeTransformer):
                     setattr(node, field, new_node)
         # end of copy-paste
         self._depth -= 1
-        logger.debug('%s result:\n%s', prefix, ast_to_string(node))
+        if self._tracer is not None:
+            self._tracer.exit_node(node, self._depth)
         return node
     
+    def visit_Module(self, node):
+        ''' Start from initial constants - module can be visited again
+        after a rollback
+        '''
+        self._constants = self._initial_constants.copy()
+        self._inlined_nodes = 0
+        self._inlining_work = 0
+        self._not_inlined = []
+        return self.generic_visit(node)
+
     def visit_FunctionDef(self, node):
-        ''' Dead code elimination
+        ''' Visit function body in its own scope, and eliminate dead code.
+        Local variables are unbound when the function starts, except
+        for the parameters of outermost function, that can be known.
+        Nested functions can be called at any time later,
+        so they do not know anything about variables that are assigned.
         '''
-        self.generic_visit(node)
+        fn_locals = get_locals(node)
+        if self._fn_depth == 0:
+            params = set(n.id for n in ast.walk(node.args)
+                    if isinstance(n, ast.Name))
+            unknown_names = fn_locals - params
+        else:
+            unknown_names = fn_locals | self._assigned_names
+        outer_constants = self._constants
+        self._constants = outer_constants.copy()
+        self._kill(unknown_names)
+        self._fn_depth += 1
+        try:
+            self.generic_visit(node)
+        finally:
+            self._fn_depth -= 1
+            self._constants = outer_constants
         node.body = self._eliminate_dead_code(node.body)
+        self._kill([node.name])
+        return node
+
+    def visit_Lambda(self, node):
+        ''' Lambda is a nested function
+        '''
+        return self._visit_in_nested_scope(node, self._assigned_names)
+
+    def visit_GeneratorExp(self, node):
+        ''' Generator expressions are evaluated lazily, 
+        so they are similar to nested functions
+        '''
+        return self._visit_in_nested_scope(node, self._assigned_names)
+
+    def visit_SetComp(self, node):
+        return self._visit_in_nested_scope(node, ())
+
+    def visit_DictComp(self, node):
+        return self._visit_in_nested_scope(node, ())
+
+    def visit_ListComp(self, node):
+        ''' List comprehension variables leak to the enclosing scope
+        '''
+        self._kill(_names_assigned_in(node))
+        return self.generic_visit(node)
+
+    def visit_ClassDef(self, node):
+        ''' Names assigned in class body are class attributes,
+        not variables of the enclosing scope
+        '''
+        outer_constants = self._constants
+        self._constants = outer_constants.copy()
+        try:
+            self.generic_visit(node)
+        finally:
+            self._constants = outer_constants
+        self._kill([node.name])
+        return node
+
+    def visit_Assign(self, node):
+        ''' Remember values assigned to names, if they are known
+        '''
+        self.generic_visit(node)
+        self._kill(_names_assigned_in(node))
+        is_known, value = self._get_node_value_if_known(node.value)
+        if is_known:
+            for target in node.targets:
+                if all(isinstance(n, (ast.Name, ast.Tuple, ast.Store))
+                        for n in ast.walk(target)):
+                    for name, v in (_unpacked(target, value) or {}).items():
+                        self._set_known(name, v)
+            if len(node.targets) == 1 and \
+                    isinstance(node.targets[0], ast.Tuple) and \
+                    isinstance(node.value, ast.Name):
+                node.value = self._unpacked_value_node(node.targets[0], value)
+        return node
+
+    def visit_AugAssign(self, node):
+        ''' Evaluate if target name and value are known,
+        turning augmented assignment into a simple one
+        '''
+        self.generic_visit(node)
+        if isinstance(node.target, ast.Name):
+            is_known, value = self._binop_value_if_known(node.op,
+                    ast.Name(id=node.target.id, ctx=ast.Load()), node.value)
+            self._kill([node.target.id])
+            if is_known:
+                self._set_known(node.target.id, value)
+                return ast.Assign(targets=[node.target],
+                        value=self._folded_node(node, value))
+        return node
+
+    def visit_Delete(self, node):
+        self.generic_visit(node)
+        self._kill(_names_assigned_in(node))
+        return node
+
+    def visit_Import(self, node):
+        self._kill((alias.asname or alias.name).split('.')[0]
+                for alias in node.names)
+        return node
+
+    visit_ImportFrom = visit_Import
+
+    def visit_With(self, node):
+        ''' Exception in body can be suppressed by the context manager,
+        so we do not know which assignments in the body were executed
+        '''
+        self.generic_visit(node)
+        self._kill(_names_assigned_in(node))
+        return node
+
+    def visit_TryExcept(self, node):
+        ''' Handlers can be executed after any statement in the body
+        '''
+        self._kill(_names_assigned_in(node))
+        self.generic_visit(node)
+        self._kill(_names_assigned_in(node))
+        return node
+
+    visit_TryFinally = visit_TryExcept
+
+    def visit_While(self, node):
+        ''' Unroll the loop, if its test is known before each iteration,
+        otherwise forget names, assigned in the loop
+        '''
+        unrolled_nodes = self._unrolled_while(node)
+        if unrolled_nodes is not None:
+            return unrolled_nodes or ast.Pass()
+        self._kill(_names_assigned_in(node))
+        loop_constants = self._constants.copy()
+        node.test = self.visit(node.test)
+        node.body = self._visit(node.body)
+        self._constants = loop_constants
+        node.orelse = self._visit(node.orelse)
         return node
 
     def visit_Name(self, node):
@@ -143,6 +470,34 @@ class Optimizer(ast.NodeTransformer):
                 return literal_node
         return node
 
+    def visit_Attribute(self, node):
+        ''' Replace reads of frozen attributes with their values
+        '''
+        self.generic_visit(node)
+        if isinstance(node.ctx, ast.Load):
+            frozen = self._get_frozen_if_known(node.value)
+            if frozen is not None and node.attr in frozen[1]:
+                is_known, value = self._frozen_attr_if_known(frozen, node.attr)
+                if is_known:
+                    return self._folded_node(node, value)
+        return node
+
+    def visit_Subscript(self, node):
+        ''' Fold indexing of known containers with known keys
+        '''
+        self.generic_visit(node)
+        if isinstance(node.ctx, ast.Load) and \
+                isinstance(node.slice, ast.Index):
+            is_known, value = self._get_node_value_if_known(node.value)
+            if is_known:
+                is_known, index = \
+                        self._get_node_value_if_known(node.slice.value)
+                if is_known:
+                    can_fold, result = fold_subscript(value, index)
+                    if can_fold:
+                        return self._folded_node(node, result)
+        return node
+
     def visit_If(self, node):
         ''' Leave only one branch, if possible
         '''
@@ -156,8 +511,31 @@ class Optimizer(ast.NodeTransformer):
             else:
                 return pass_
         else:
+            constants = self._constants
+            self._constants = constants.copy()
             node.body = self._visit(node.body)
+            body_constants = self._constants
+            self._constants = constants.copy()
             node.orelse = self._visit(node.orelse)
+            self._constants = _joined_constants([
+                (body_constants, _is_terminated(node.body)),
+                (self._constants, _is_terminated(node.orelse))])
+        return node
+
+    def visit_For(self, node):
+        ''' Unroll the loop, if the iterable is known
+        '''
+        node.iter = self.visit(node.iter)
+        is_known, iterable = self._get_iterable_if_known(node.iter)
+        if is_known:
+            unrolled_nodes = self._unrolled_for(node, iterable)
+            if unrolled_nodes is not None:
+                return unrolled_nodes or ast.Pass()
+        self._kill(_names_assigned_in(node))
+        loop_constants = self._constants.copy()
+        node.body = self._visit(node.body)
+        self._constants = loop_constants
+        node.orelse = self._visit(node.orelse)
         return node
 
     def visit_Call(self, node):
@@ -169,16 +547,29 @@ class Optimizer(ast.NodeTransformer):
         is_known, fn = self._get_node_value_if_known(node.func)
         if is_known:
             if self._is_inlined_fn(fn):
-                inlined_nodes, result_node = self._inlined_fn(node)
-                self._current_block.extend(inlined_nodes)
-                return result_node
+                expanded_node = self._expanded_call(node)
+                reason = self._inlining_refusal(fn, expanded_node)
+                if reason is None:
+                    if self._tracer is not None:
+                        self._tracer.inline(node, fn)
+                    inlined_nodes, result_node = \
+                            self._inlined_fn(expanded_node)
+                    self._current_block.extend(inlined_nodes)
+                    return result_node
+                self._refuse_inlining(node, fn, reason)
             elif self._is_pure_fn(fn):
-                return self._fn_result_node_if_safe(fn, node)
+                new_node = self._fn_result_node_if_safe(fn, node)
+                if new_node is node and getattr(fn, '_ast_pe_inline', False):
+                    self._refuse_inlining(node, fn, 'loop return')
+                return new_node
+            elif getattr(fn, '_ast_pe_inline', False):
+                self._refuse_inlining(node, fn, 'loop return')
         else:
-            assert not node.kwargs and not node.starargs # TODO
             # check for mutations from function call:
             # if we don't know it's pure, it can mutate the arguments
-            for arg_node in node.args:
+            arg_nodes = node.args + [kw.value for kw in node.keywords] + \
+                    [n for n in (node.starargs, node.kwargs) if n is not None]
+            for arg_node in arg_nodes:
                 if is_load_name(arg_node):
                     self._mark_mutated_node(arg_node)
                 else:
@@ -200,13 +591,14 @@ class Optimizer(ast.NodeTransformer):
         return node
     
     def visit_UnaryOp(self, node):
-        ''' Hanle "not" - evaluate if possible
+        ''' not, -, +, ~ - evaluate if possible
         '''
         self.generic_visit(node)
-        if isinstance(node.op, ast.Not):
-            is_known, value = self._get_node_value_if_known(node.operand)
-            if is_known:
-                return self._new_binding_node(not value)
+        is_known, value = self._get_node_value_if_known(node.operand)
+        if is_known:
+            is_folded, value = fold_unary(node.op, value)
+            if is_folded:
+                return self._folded_node(node, value)
         return node
 
     def visit_BoolOp(self, node):
@@ -220,14 +612,14 @@ class Optimizer(ast.NodeTransformer):
             if is_known:
                 if isinstance(node.op, ast.And):
                     if not value:
-                        return self._new_binding_node(False)
+                        return self._folded_node(node, False)
                 elif isinstance(node.op, ast.Or):
                     if value:
-                        return self._new_binding_node(value)
+                        return self._folded_node(node, value)
             else:
                 new_value_nodes.append(value_node)
         if not new_value_nodes:
-            return self._new_binding_node(isinstance(node.op, ast.And))
+            return self._folded_node(node, isinstance(node.op, ast.And))
         elif len(new_value_nodes) == 1:
             return new_value_nodes[0]
         else:
@@ -235,64 +627,50 @@ class Optimizer(ast.NodeTransformer):
             return node
     
     def visit_Compare(self, node):
-        ''' ==, >, etc. - evaluate only if all are know
+        ''' ==, >, in, is, etc. - evaluate from left to right while
+        operands are known. Chain is short-circuited on first false
+        comparison, so the rest of operands does not matter.
         '''
-        # TODO - can evaluate if only some are known
         self.generic_visit(node)
-        is_known, value = self._get_node_value_if_known(node.left)
-        if not is_known:
-            return node
-        value_list = [value]
-        for value_node in node.comparators:
-            is_known, value = self._get_node_value_if_known(value_node)
-            if not is_known:
-                return node
-            value_list.append(value)
-        for a, b, op in zip(value_list, value_list[1:], node.ops):
-            result = {
-                    ast.Eq: lambda : a == b,
-                    ast.Lt: lambda : a < b,
-                    ast.Gt: lambda : a > b,
-                    ast.GtE: lambda : a >= b, 
-                    ast.LtE: lambda : a <= b, 
-                    ast.NotEq: lambda : a != b,
-                    }[type(op)]()
-            if not result:
-                return self._new_binding_node(False)
-        return self._new_binding_node(True)
+        is_known, left_value = self._get_node_value_if_known(node.left)
+        while is_known:
+            is_known, right_value = \
+                    self._get_node_value_if_known(node.comparators[0])
+            if is_known:
+                is_known, value = fold_compare(
+                        node.ops[0], left_value, right_value)
+            if is_known:
+                if not value or len(node.ops) == 1:
+                    return self._folded_node(node, value)
+                # first comparison is true, and the rest decides
+                node.left = node.comparators.pop(0)
+                del node.ops[0]
+                left_value = right_value
+        return node
     
     def visit_BinOp(self, node):
         ''' Binary arithmetic - + * / etc.
         Evaluate if everything is known.
         '''
         self.generic_visit(node)
-        operations = {
-                ast.Add: operator.add,
-                ast.Sub: operator.sub,
-                ast.Mult: operator.mul,
-                ast.Div: operator.div, # TODO - detect truediv!
-                ast.Mod: operator.mod,
-                ast.Pow: operator.pow,
-                ast.LShift: operator.lshift,
-                ast.RShift: operator.rshift,
-                ast.BitOr: operator.or_,
-                ast.BitAnd: operator.and_,
-                ast.BitXor: operator.xor,
-                ast.FloorDiv: operator.floordiv,
-                }
-        # FIXME - call l_value.__add__(r_value), etc.
-        # than we can get rid of NUMBER_TYPES check
-        can_apply = lambda is_known, value: is_known and \
-                type(value) in self.NUMBER_TYPES
-        if type(node.op) in operations:
-            is_known, l_value = self._get_node_value_if_known(node.left)
-            if can_apply(is_known, l_value):
-                is_known, r_value = self._get_node_value_if_known(node.right)
-                if can_apply(is_known, r_value):
-                    value = operations[type(node.op)](l_value, r_value)
-                    return self._new_binding_node(value)
+        is_known, value = self._binop_value_if_known(
+                node.op, node.left, node.right)
+        if is_known:
+            return self._folded_node(node, value)
         return node
 
+    def _binop_value_if_known(self, op, left, right):
+        ''' Return tuple of boolean (value is known), and value
+        of binary operation op applied to nodes left and right
+        '''
+        is_known, l_value = self._get_node_value_if_known(left)
+        if is_known:
+            is_known, r_value = self._get_node_value_if_known(right)
+            if is_known:
+                return fold_binary(op, l_value, r_value,
+                        self._true_division)
+        return False, None
+
     def _visit(self, node):
         ''' Similar to generic_visit - node can be a list, or an AST node.
         For list we visit all elements and collect results, also eliminating
@@ -309,6 +687,10 @@ class Optimizer(ast.NodeTransformer):
                         result.extend(r)
                     else:
                         result.append(r)
+                    if _is_terminated(result):
+                        # do not visit unreachable code, as it can change
+                        # what is known
+                        break
                 return self._eliminate_dead_code(result)
             finally:
                 self._current_block = parent_block
@@ -316,14 +698,198 @@ class Optimizer(ast.NodeTransformer):
             return self.visit(node)
 
     def _eliminate_dead_code(self, node_list):
-        ''' Dead code elimination - remove "pass", code after return
+        ''' Dead code elimination - remove "pass", code after return,
+        raise, break and continue (or "if" that ends with them 
+        in both branches)
+        '''
+        new_node_list = []
+        for node in node_list:
+            if not isinstance(node, ast.Pass):
+                new_node_list.append(node)
+            if _is_terminated([node]):
+                break
+        return new_node_list or node_list[:1]
+
+    def _visit_in_nested_scope(self, node, unknown_names):
+        ''' Visit node, that has its own scope, forgetting unknown_names
+        and names that are assigned in node
+        '''
+        outer_constants = self._constants
+        self._constants = outer_constants.copy()
+        self._kill(unknown_names)
+        self._kill(n.id for n in ast.walk(node) if isinstance(n, ast.Name)
+                and not isinstance(n.ctx, ast.Load))
+        try:
+            return self.generic_visit(node)
+        finally:
+            self._constants = outer_constants
+
+    def _set_known(self, name, value):
+        ''' Remember that name holds value, if it can not be mutated
+        '''
+        if name not in self._mutated_names or is_immutable(value):
+            self._constants[name] = value
+
+    def _kill(self, names):
+        ''' Forget values of names
+        '''
+        for name in names:
+            self._constants.pop(name, None)
+
+    def _get_iterable_if_known(self, node):
+        ''' Like _get_node_value_if_known, but also evaluate calls of pure 
+        functions that return iterators - they are never folded, 
+        but are fine for unrolling, as for loop evaluates them once.
+        '''
+        is_known, value = self._get_node_value_if_known(node)
+        if not is_known and isinstance(node, ast.Call):
+            is_known, fn = self._get_node_value_if_known(node.func)
+            if is_known and self._is_pure_fn(fn) and \
+                    not self._is_inlined_fn(fn):
+                return self._fn_result_if_safe(fn, node)
+        return is_known, value
+
+    def _get_dict_if_known(self, node):
+        ''' Return tuple of boolean (value is known), and a new dict,
+        that dict display node evaluates to
+        '''
+        items = []
+        for key_node, value_node in zip(node.keys, node.values):
+            is_key_known, key = self._get_node_value_if_known(key_node)
+            is_known, value = self._get_node_value_if_known(value_node)
+            if not (is_key_known and is_known):
+                return False, None
+            items.append((key, value))
+        try:
+            return True, dict(items)
+        except TypeError: # unhashable key
+            return False, None
+
+    def _unrolled_for(self, node, iterable):
+        ''' Return a list of nodes, that replace the loop over iterable,
+        or None if it can not be unrolled.
+        Loop body is replicated for each element, with loop variable
+        bound to it. Break or continue are handled only if they are the 
+        last statement in the optimized body.
+        '''
+        if not (type(iterable) in self.UNROLL_TYPES or _is_iterator(iterable)):
+            return None
+        if _has_late_binding(node.body):
+            return None
+        values = list(itertools.islice(
+            iterable, self.MAX_UNROLL_ITERATIONS + 1))
+        if len(values) > self.MAX_UNROLL_ITERATIONS:
+            return None
+        target_names = [n.id for n in ast.walk(node.target)
+                if isinstance(n, ast.Name)]
+        if not all(isinstance(n, (ast.Name, ast.Tuple, ast.Store))
+                for n in ast.walk(node.target)):
+            return None
+        if set(target_names).intersection(
+                n.id for n in ast.walk(ast.Module(body=node.body))
+                if isinstance(n, ast.Name) and not isinstance(n.ctx, ast.Load)):
+            # loop variable is reassigned in the body
+            return None
+        state = self._state()
+        unrolled_nodes = []
+        broken = False
+        for value in values:
+            bindings = _unpacked(node.target, value)
+            if bindings is None:
+                self._restore_state(state)
+                return None
+            for name, v in bindings.iteritems():
+                self._set_known(name, v)
+            body = self._visit(copy_ast(node.body))
+            control_nodes = _loop_control_nodes(body)
+            if control_nodes:
+                if control_nodes != [body[-1]]:
+                    # break or continue are conditional
+                    self._restore_state(state)
+                    return None
+                del body[-1]
+            unrolled_nodes.extend(body)
+            if control_nodes and isinstance(control_nodes[0], ast.Break):
+                broken = True
+                break
+        if values:
+            # loop variable keeps the last value after the loop
+            unrolled_nodes.append(ast.Assign(
+                targets=[node.target], 
+                value=self._unpacked_value_node(node.target, value)))
+        if not broken:
+            unrolled_nodes.extend(self._visit(node.orelse))
+        return _without_pass(unrolled_nodes)
+
+    def _unrolled_while(self, node):
+        ''' Return a list of nodes, that replace the loop, or None if
+        it can not be unrolled. Test of the loop must be known before each 
+        iteration, and can not leave any code to run (e.g. inlined calls).
+        At most MAX_WHILE_ITERATIONS are unrolled. Break and continue
+        are handled as in _unrolled_for, and the loop is not unrolled
+        if an iteration can return, but not always (it can be the only
+        way out of the loop). If the loop is not unrolled, everything
+        done while trying is undone.
+        '''
+        if _has_late_binding(node.body):
+            return None
+        state = self._state()
+        unrolled_nodes = []
+        for _ in xrange(self.MAX_WHILE_ITERATIONS + 1):
+            is_known, test_value = self._test_value_if_known(node.test)
+            if not is_known:
+                break
+            if not test_value:
+                unrolled_nodes.extend(self._visit(node.orelse))
+                return _without_pass(unrolled_nodes)
+            body = self._visit(copy_ast(node.body))
+            control_nodes = _loop_control_nodes(body)
+            if control_nodes:
+                if control_nodes != [body[-1]]:
+                    # break or continue are conditional
+                    break
+                del body[-1]
+            elif _has_return(body) and not _is_terminated(body):
+                break
+            unrolled_nodes.extend(body)
+            if (control_nodes and isinstance(control_nodes[0], ast.Break)) \
+                    or _is_terminated(body):
+                return _without_pass(unrolled_nodes)
+        self._restore_state(state)
+        return None
+
+    def _state(self):
+        ''' Return a snapshot of what is known and what is done so far,
+        so that visiting of some code can be undone with _restore_state
         '''
-        for i, node in enumerate(list(node_list)):
-            if isinstance(node, ast.Pass) and len(node_list) > 1:
-                node_list.remove(node)
-            if isinstance(node, ast.Return):
-                return node_list[:i+1]
-        return node_list
+        return (self._constants.copy(), dict(self._bindings),
+                set(self._stored_names), set(self._assigned_names),
+                set(self._mutated_names), dict(self._frozen_attrs),
+                self._var_count, self._inlined_nodes, list(self._not_inlined))
+
+    def _restore_state(self, state):
+        (self._constants, self._bindings, self._stored_names,
+                self._assigned_names, self._mutated_names, self._frozen_attrs,
+                self._var_count, self._inlined_nodes, self._not_inlined) = \
+                        state
+
+    def _test_value_if_known(self, test):
+        ''' Return tuple of boolean (value is known), and the value of 
+        test expression, if it can be evaluated without leaving any code
+        '''
+        parent_block = self._current_block
+        self._current_block = []
+        try:
+            test = self.visit(copy_ast(test))
+            if self._current_block:
+                return False, None
+        finally:
+            self._current_block = parent_block
+        is_known, value = self._get_node_value_if_known(test)
+        if is_known:
+            is_known, value = fold_unary(ast.Not(), value)
+            return is_known, not value
+        return False, None
 
     def _fn_result_node_if_safe(self, fn, node):
         ''' Check that we know all fn args.
@@ -331,6 +897,19 @@ class Optimizer(ast.NodeTransformer):
         It we can not call fn, just return node.
         Assume that fn is pure.
         '''
+        is_known, fn_value = self._fn_result_if_safe(fn, node)
+        if is_known and not _is_iterator(fn_value) and (
+                self._is_known_pure_fn(fn) or is_immutable(fn_value)):
+            return self._folded_node(node, fn_value)
+        # iterators can not be shared between calls, and neither can
+        # mutable results of functions, not marked as pure
+        # (they can create a new object for each call)
+        return node
+
+    def _fn_result_if_safe(self, fn, node):
+        ''' Return tuple of boolean (we could call fn), and fn result,
+        if we know all fn args. Assume that fn is pure.
+        '''
         assert isinstance(node, ast.Call) and self._is_pure_fn(fn)
         args = []
         for arg_node in node.args:
@@ -338,48 +917,179 @@ class Optimizer(ast.NodeTransformer):
             if is_known:
                 args.append(value)
             else:
-                return node
-        # TODO - cases listed in assert
-        assert not node.kwargs and not node.keywords and not node.starargs
+                return False, None
+        kwargs = {}
+        for keyword in node.keywords:
+            is_known, value = self._get_node_value_if_known(keyword.value)
+            if is_known:
+                kwargs[keyword.arg] = value
+            else:
+                return False, None
+        if node.starargs is not None:
+            is_known, value = self._get_node_value_if_known(node.starargs)
+            if not (is_known and type(value) in (tuple, list)):
+                return False, None
+            args.extend(value)
+        if node.kwargs is not None:
+            is_known, value = self._get_node_value_if_known(node.kwargs)
+            if not (is_known and type(value) is dict and
+                    set(kwargs).isdisjoint(value)):
+                # duplicate keywords raise TypeError when called
+                return False, None
+            kwargs.update(value)
+        # functions with inferred purity can read globals, that can change
+        # between specializations, so only known pure ones are memoized
+        key = _memo_key(fn, args, kwargs) \
+                if self._is_known_pure_fn(fn) else None
+        if key is not None:
+            result = _pure_call_cache.get(key, _missing)
+            if result is not _missing:
+                return True, result
         try:
-            fn_value = fn(*args)
+            result = fn(*args, **kwargs)
         except:
             # do not optimize the call away to leave original exception
-            return node
-        else:
-            return self._new_binding_node(fn_value)
+            return False, None
+        if key is not None and is_immutable(result):
+            _pure_call_cache.put(key, result)
+        return True, result
     
+    def _expanded_call(self, node):
+        ''' Return a copy of call node, where *args and **kwargs are
+        replaced with separate arguments, if their values are known
+        (a tuple or list, and a dict with string keys), or node itself.
+        '''
+        if node.starargs is None and node.kwargs is None:
+            return node
+        args, keywords = list(node.args), list(node.keywords)
+        if node.starargs is not None:
+            is_known, value = self._get_node_value_if_known(node.starargs)
+            if not (is_known and type(value) in (tuple, list)):
+                return node
+            args.extend(self._new_binding_node(v) for v in value)
+        if node.kwargs is not None:
+            is_known, value = self._get_node_value_if_known(node.kwargs)
+            if not (is_known and type(value) is dict and
+                    all(isinstance(k, str) for k in value) and
+                    set(k.arg for k in keywords).isdisjoint(value)):
+                return node
+            keywords.extend(
+                    ast.keyword(arg=k, value=self._new_binding_node(v))
+                    for k, v in sorted(value.iteritems()))
+        return ast.Call(func=node.func, args=args, keywords=keywords,
+                starargs=None, kwargs=None)
+
+    def _inlining_refusal(self, fn, node):
+        ''' Return the reason not to inline fn at call node
+        (see get_not_inlined), or None if it can be inlined.
+        Size of inlined code is estimated by the size of fn body,
+        before it is folded, as it is not known yet, and it is counted
+        as work even if it folds away.
+        '''
+        if call_arg_nodes(fn, node) is None:
+            return 'arguments'
+        elif self._inline_depth >= self.MAX_INLINE_DEPTH:
+            return 'depth'
+        key = getattr(fn, '__func__', fn)
+        if is_true_division(fn) != self._true_division:
+            if key not in self._divisions:
+                self._divisions[key] = any(isinstance(n, ast.Div)
+                        for n in ast.walk(fn_to_ast(fn)))
+            if self._divisions[key]:
+                return 'division'
+        if key not in self._inline_costs:
+            self._inline_costs[key] = _count_nodes(fn_to_ast(fn).body[0].body)
+        cost = self._inline_costs[key]
+        if max(self._inlined_nodes, self._inlining_work) + cost > \
+                self.MAX_INLINED_NODES:
+            return 'size'
+
+    def _refuse_inlining(self, node, fn, reason):
+        ''' Leave call node of fn as a regular call, because of reason
+        '''
+        if self._tracer is not None:
+            self._tracer.not_inlined(node, fn, reason)
+        self._not_inlined.append(dict(
+            fn=getattr(fn, '__name__', repr(fn)),
+            call=ast_to_source(node).strip(), reason=reason))
+
     def _inlined_fn(self, node):
         ''' Return a list of nodes, representing inlined function call,
         and a node, repesenting the variable that stores result.
+        Inlined code, with nested inlined calls, is counted towards
+        the size budget of inlining (see _inlining_refusal).
         '''
         is_known, fn = self._get_node_value_if_known(node.func)
         assert is_known
         fn_ast = fn_to_ast(fn).body[0]
+        if not _is_terminated(fn_ast.body):
+            fn_ast.body.append(ast.Return(value=None)) # implicit return
+        mutated_params = self._mutation_analyzer.mutated_params(fn)
         inliner = Inliner(self._var_count, get_locals(fn_ast))
         fn_ast = inliner.visit(fn_ast)
         self._var_count = inliner.get_var_count()
 
         inlined_body = []
-        assert not node.kwargs and not node.starargs # TODO
-        for callee_arg, fn_arg in zip(node.args, fn_ast.args.args):
+        reassigned_names = _names_assigned_in(fn_ast)
+        bound_args = call_arg_nodes(fn, node)
+        # parameters, that are not bound, take default values
+        arg_names, _, _, defaults = inspect.getargspec(fn)
+        bound_names = set(name for name, _ in bound_args)
+        for arg_name, default in zip(
+                arg_names[len(arg_names) - len(defaults or ()):],
+                defaults or ()):
+            if arg_name not in bound_names:
+                bound_args.append(
+                        (arg_name, self._new_binding_node(default)))
+        mangled = inliner.get_bindings()
+        for arg_name, callee_arg in bound_args:
             # setup mangled values before call
             # TODO - if callee_arg is "simple" - literal or name,
             # and is never assigned in inlined_body
             # then do not make an assignment, just use it in inlined_body
+            fn_arg_id = mangled[arg_name]
             inlined_body.append(ast.Assign(
-                targets=[ast.Name(id=fn_arg.id, ctx=ast.Store())],
+                targets=[ast.Name(id=fn_arg_id, ctx=ast.Store())],
                 value=callee_arg))
-            is_known, value = self._get_node_value_if_known(callee_arg)
-            if is_known:
-                # TODO - check that mutations are detected
-                self._constants[fn_arg.id] = value
+            if isinstance(callee_arg, ast.Dict): # **kwargs
+                is_known, value = self._get_dict_if_known(callee_arg)
+            else:
+                is_known, value = self._get_node_value_if_known(callee_arg)
+            if is_known and (arg_name not in mutated_params or 
+                    is_immutable(value)):
+                self._constants[fn_arg_id] = value
+            frozen = self._get_frozen_if_known(callee_arg)
+            if frozen is not None and fn_arg_id not in reassigned_names:
+                obj, attrs = frozen
+                self._frozen_attrs[fn_arg_id] = \
+                        obj, attrs - _attrs_assigned_in(fn_ast, fn_arg_id)
+        mangled_names = set(inliner.get_bindings().values())
+        self._stored_names.update(mangled_names)
+        self._assigned_names.update(mangled_names)
+        self._mutated_names.update(inliner.get_bindings().get(name) for name
+                in self._mutation_analyzer.mutated_locals(fn))
         
-        inlined_code = self._visit(fn_ast.body) # optimize inlined code
+        inlined_nodes = self._inlined_nodes
+        # work is not undone with _restore_state, so that attempts
+        # to unroll loops are limited too
+        self._inlining_work += self._inline_costs[getattr(fn, '__func__', fn)]
+        self._inline_depth += 1
+        try:
+            inlined_code = self._visit(fn_ast.body) # optimize inlined code
+        finally:
+            self._inline_depth -= 1
+
+        # values of inlined variables are not needed after the call,
+        # and the value of return variable is known only if it is
+        # assigned at the end of inlined code
+        self._kill(mangled_names)
+        if _loop_control_nodes(inlined_code) != inlined_code[-1:]:
+            self._kill([inliner.get_return_var()])
 
-        if isinstance(inlined_code[-1], ast.Break): # single return
-            inlined_body.extend(inlined_code[:-1])
-        else: # multiple returns - wrap in "while"
+        lowered_code = _lowered_returns(inlined_code)
+        if lowered_code is not None:
+            inlined_body.extend(lowered_code)
+        else: # wrap in "while", so that "break" works as return
             while_var = new_var_name(self)
             inlined_body.extend([
                     ast.Assign(
@@ -395,9 +1105,15 @@ class Optimizer(ast.NodeTransformer):
                         orelse=[])
                     ])
 
-        all_nodes = inlined_body + \
-                [ast.Name(id=inliner.get_return_var(), ctx=ast.Load())]
+        return_var = inliner.get_return_var()
+        if return_var is None: # function never returns
+            result_node = self._get_literal_node(None)
+        else:
+            result_node = ast.Name(id=return_var, ctx=ast.Load())
+        all_nodes = inlined_body + [result_node]
         remove_assignments(all_nodes)
+        # nested inlined code is already counted, and it is included here
+        self._inlined_nodes = inlined_nodes + _count_nodes(all_nodes)
 
         return all_nodes[:-1], all_nodes[-1]
                 
@@ -406,19 +1122,45 @@ class Optimizer(ast.NodeTransformer):
         ''' fn has no side effects, and its value is determined only by
         its inputs
         '''
+        return self._is_known_pure_fn(fn) or (self.INFER_PURITY and
+                self._purity_analyzer.is_pure_fn(fn))
+
+    def _is_known_pure_fn(self, fn):
+        ''' fn is a pure builtin, or it is marked with @pure_function
+        '''
         if fn in self.PURE_FUNCTIONS:
             return True
-        else:
-            # TODO - implement decorator
-            if getattr(fn, '_ast_pe_is_pure', False):
-                return True
-            # TODO - or analyze fn body
-            return False
+        elif isinstance(fn, types.BuiltinMethodType) and \
+                fn.__name__ in self.PURE_METHODS.get(type(fn.__self__), ()):
+            return True
+        return getattr(fn, '_ast_pe_is_pure', False)
+    
+    def _is_reusable_call(self, node):
+        ''' Call node has no side effects, and its result can be shared
+        instead of calling it again
+        '''
+        is_known, fn = self._get_node_value_if_known(node.func)
+        # results of functions with inferred purity can be new objects
+        return is_known and self._is_known_pure_fn(fn) and \
+                fn not in self.FRESH_RESULT_FUNCTIONS
+
+    def _is_immutable_call(self, node):
+        ''' Call node is known to return an immutable value
+        '''
+        is_known, fn = self._get_node_value_if_known(node.func)
+        return is_known and fn in self.IMMUTABLE_RESULT_FUNCTIONS
     
     def _is_inlined_fn(self, fn):
-        ''' fn should be inlined
+        ''' fn should be inlined: it is marked with @inline, and does not
+        return from loops (as return is replaced with break)
         '''
-        return bool(getattr(fn, '_ast_pe_inline', False))
+        if not getattr(fn, '_ast_pe_inline', False):
+            return False
+        key = getattr(fn, '__func__', fn)
+        if key not in self._returns_from_loops:
+            self._returns_from_loops[key] = _returns_from_loops(
+                    fn_to_ast(fn).body[0])
+        return not self._returns_from_loops[key]
 
     def _get_node_value_if_known(self, node):
         ''' Return tuple of boolean(value is know), and value itself
@@ -428,14 +1170,59 @@ class Optimizer(ast.NodeTransformer):
             name = node.id
             if name in self._constants:
                 return known(self._constants[name])
-            else:
-                # TODO - how to check builtin redefinitions?
-                if hasattr(__builtin__, name):
-                    return known(getattr(__builtin__, name))
+            elif name in self._bindings:
+                return known(self._bindings[name])
+            elif name not in self._stored_names and \
+                    hasattr(__builtin__, name):
+                return known(getattr(__builtin__, name))
+        elif isinstance(node, ast.Attribute) and \
+                isinstance(node.ctx, ast.Load):
+            frozen = self._get_frozen_if_known(node.value)
+            if frozen is not None:
+                return self._frozen_attr_if_known(frozen, node.attr)
+            # methods of built-in types
+            is_known, value = self._get_node_value_if_known(node.value)
+            if is_known and \
+                    node.attr in self.PURE_METHODS.get(type(value), ()):
+                return known(getattr(value, node.attr))
         elif isinstance(node, ast.Num):
             return known(node.n)
         elif isinstance(node, ast.Str):
             return known(node.s)
+        elif isinstance(node, ast.Tuple) and isinstance(node.ctx, ast.Load):
+            values = []
+            for elt in node.elts:
+                is_known, value = self._get_node_value_if_known(elt)
+                if not is_known:
+                    return False, None
+                values.append(value)
+            return known(tuple(values))
+        return False, None
+
+    def _get_frozen_if_known(self, node):
+        ''' Return (object, frozen attribute names), if node is a name
+        that always holds object with frozen attributes, or None
+        '''
+        if is_load_name(node):
+            return self._frozen_attrs.get(node.id)
+
+    def _frozen_attr_if_known(self, frozen, attr):
+        ''' Return tuple of boolean (value is known), and value of attribute
+        attr of object with frozen attributes (returned by
+        _get_frozen_if_known): only frozen attributes and methods
+        marked with @inline are known.
+        '''
+        obj, attrs = frozen
+        if attr in attrs:
+            try:
+                return True, getattr(obj, attr)
+            except Exception:
+                return False, None
+        method = getattr(obj.__class__, attr, None)
+        if isinstance(method, types.MethodType) and \
+                self._is_inlined_fn(method) and \
+                attr not in getattr(obj, '__dict__', {}):
+            return True, getattr(obj, attr)
         return False, None
 
     def _get_literal_node(self, value):
@@ -446,9 +1233,16 @@ class Optimizer(ast.NodeTransformer):
             return ast.Num(value)
         elif type(value) in self.STRING_TYPES:
             return ast.Str(value)
-        elif value is False or value is True:
-            return ast.Name(id='True' if value else 'False', ctx=ast.Load())
+        elif value is False or value is True or value is None:
+            return ast.Name(id=repr(value), ctx=ast.Load())
     
+    def _folded_node(self, node, value):
+        ''' Return a node, representing value, that node evaluates to.
+        '''
+        if self._tracer is not None:
+            self._tracer.fold(node, value)
+        return self._new_binding_node(value)
+
     def _new_binding_node(self, value):
         ''' Generate unique variable name, add it to constants with given value,
         and return the node that loads generated variable.
@@ -458,22 +1252,273 @@ class Optimizer(ast.NodeTransformer):
             return literal_node
         else:
             var_name = new_var_name(self)
-            self._constants[var_name] = value
+            self._bindings[var_name] = value
             return ast.Name(id=var_name, ctx=ast.Load())
 
+    def _unpacked_value_node(self, target, value):
+        ''' Return a node, that loads value assigned to target. Tuples
+        and lists, that are unpacked, are spelled out element by element,
+        which is faster, and lets unused elements be removed later.
+        '''
+        if isinstance(target, ast.Tuple) and \
+                type(value) in (tuple, list) and \
+                len(value) == len(target.elts):
+            return ast.Tuple(ctx=ast.Load(), elts=[
+                self._unpacked_value_node(elt, v)
+                for elt, v in zip(target.elts, value)])
+        return self._new_binding_node(value)
+
     def _mark_mutated_node(self, node):
         ''' Mark that node holding some variable can be mutated, 
         and propagate this information up the dataflow graph
         '''
         assert is_load_name(node)
         self._mutated_nodes.add(node)
-        # TODO - propagate up the dataflow graph
-        if node.id in self._constants:
+        # mutations are propagated up the dataflow graph by MutationAnalyzer,
+        # so normally we should not get here with a mutable constant
+        if node.id in self._constants and \
+                not is_immutable(self._constants[node.id]):
             # obj can be mutated, and we can not assume we know it
             # so we have to rollback here
-            del self._constants[node.id]
+            self._initial_constants.pop(node.id, None)
+            self._mutated_names.add(node.id)
             raise self.Rollback('%s is mutated' % node.id)
 
 
 def is_load_name(node):
     return isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)
+
+
+def _memo_key(fn, args, kwargs):
+    ''' Return a key of the call of fn with args and kwargs, or None
+    if some of them can not be keyed (see _value_key), or fn is one
+    of UNMEMOIZED_FUNCTIONS
+    '''
+    if fn in UNMEMOIZED_FUNCTIONS:
+        return None
+    try:
+        return _value_key(fn), tuple(_value_key(arg) for arg in args), \
+                tuple(sorted((name, _value_key(value))
+                    for name, value in kwargs.iteritems()))
+    except TypeError:
+        return None
+
+
+def _value_key(value):
+    ''' Return a hashable key of value, so that keys are equal only for
+    equal values of the same types (e.g. 1 and 1.0 differ, and floats
+    are compared by repr, so 0.0 and -0.0 differ too). Functions and classes
+    are compared by identity. Raise TypeError for other values.
+    '''
+    value_type = type(value)
+    if value_type in (float, complex):
+        return value_type, repr(value)
+    elif value_type in IMMUTABLE_TYPES:
+        return value_type, value
+    elif value_type is tuple:
+        item_types = set(map(type, value))
+        if len(item_types) == 1 and item_types <= SIMPLE_KEY_TYPES:
+            # large static tables are often like this, and keys of their
+            # items are the same as the items
+            return value_type, item_types.pop(), value
+        return value_type, tuple(_value_key(v) for v in value)
+    elif value_type is frozenset:
+        return value_type, frozenset(_value_key(v) for v in value)
+    elif isinstance(value, types.BuiltinMethodType) and \
+            value.__self__ is not None:
+        # bound methods are equal, when their objects are identical
+        return value_type, value.__name__, _value_key(value.__self__)
+    elif isinstance(value, (types.FunctionType, types.BuiltinFunctionType,
+            type, types.ClassType)):
+        return value_type, value
+    raise TypeError('can not key %r' % value_type)
+
+
+def _imports_true_division(tree):
+    return any(isinstance(node, ast.ImportFrom) and
+            node.module == '__future__' and
+            any(alias.name == 'division' for alias in node.names)
+            for node in getattr(tree, 'body', ()))
+
+
+def _count_nodes(node_list):
+    return sum(1 for node in node_list for _ in ast.walk(node))
+
+
+def _is_iterator(value):
+    ''' Iterators are stateful, and can be iterated only once
+    '''
+    try:
+        return hasattr(value, 'next') and iter(value) is value
+    except Exception:
+        return False
+
+
+def _unpacked(target, value):
+    ''' Return a dict of names in for-loop target, bound to value,
+    or None if value can not be unpacked
+    '''
+    if isinstance(target, ast.Name):
+        return {target.id: value}
+    try:
+        values = tuple(value)
+    except TypeError:
+        return None
+    if len(values) != len(target.elts):
+        return None
+    bindings = {}
+    for elt, v in zip(target.elts, values):
+        elt_bindings = _unpacked(elt, v)
+        if elt_bindings is None:
+            return None
+        bindings.update(elt_bindings)
+    return bindings
+
+
+def _lowered_returns(node_list):
+    ''' Return node_list of inlined function, where returns were replaced
+    with assignment and break (by Inliner), without these breaks: 
+    code after "if" that breaks in one branch is moved to the other branch.
+    Return None if breaks are not in "if" statements, or code would have
+    to be duplicated.
+    '''
+    for i, node in enumerate(node_list):
+        if isinstance(node, ast.Break):
+            return node_list[:i]
+        elif _loop_control_nodes([node]):
+            if not isinstance(node, ast.If):
+                return None
+            rest = node_list[i + 1:]
+            body_terminated = _is_terminated(node.body)
+            orelse_terminated = _is_terminated(node.orelse)
+            if rest and not (body_terminated or orelse_terminated):
+                return None
+            body = _lowered_returns(
+                    node.body + ([] if body_terminated else rest))
+            orelse = _lowered_returns(
+                    node.orelse + ([] if orelse_terminated else rest))
+            if body is None or orelse is None:
+                return None
+            node.body = body or [ast.Pass()]
+            node.orelse = orelse
+            return node_list[:i] + [node]
+    return node_list
+
+
+def _returns_from_loops(fn_ast):
+    ''' Function has return statements inside loops
+    '''
+    loops = [n for n in ast.walk(fn_ast) if isinstance(n, (ast.For, ast.While))]
+    return any(isinstance(n, ast.Return) for loop in loops
+            for n in ast.walk(ast.Module(body=loop.body + loop.orelse)))
+
+
+def _without_pass(node_list):
+    return [n for n in node_list if not isinstance(n, ast.Pass)]
+
+
+def _loop_control_nodes(node_list):
+    ''' Return a list of break and continue nodes, that belong to the loop
+    with body node_list (not to the loops nested in it)
+    '''
+    control_nodes = []
+    for node in node_list:
+        if isinstance(node, (ast.Break, ast.Continue)):
+            control_nodes.append(node)
+        elif isinstance(node, (ast.For, ast.While)):
+            control_nodes.extend(_loop_control_nodes(node.orelse))
+        elif isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            pass
+        else:
+            for field in ('body', 'orelse', 'handlers', 'finalbody'):
+                control_nodes.extend(
+                        _loop_control_nodes(getattr(node, field, [])))
+    return control_nodes
+
+
+def _has_return(node_list):
+    ''' Some node in node_list (not in nested functions and classes)
+    is a return
+    '''
+    to_visit = list(node_list)
+    while to_visit:
+        node = to_visit.pop()
+        if isinstance(node, ast.Return):
+            return True
+        elif not isinstance(node, (ast.FunctionDef, ast.ClassDef, ast.Lambda)):
+            to_visit.extend(ast.iter_child_nodes(node))
+    return False
+
+
+def _names_assigned_in(node):
+    ''' Return a set of names, that are assigned or deleted in node
+    '''
+    names = set()
+    for n in ast.walk(node):
+        if isinstance(n, ast.Name) and \
+                not isinstance(n.ctx, (ast.Load, ast.Param)):
+            names.add(n.id)
+        elif isinstance(n, (ast.FunctionDef, ast.ClassDef)):
+            names.add(n.name)
+        elif isinstance(n, (ast.Import, ast.ImportFrom)):
+            names.update((alias.asname or alias.name).split('.')[0]
+                    for alias in n.names)
+    return names
+
+
+def _attrs_assigned_in(node, name):
+    ''' Return a set of attributes of name, that are assigned
+    or deleted in node
+    '''
+    return set(n.attr for n in ast.walk(node)
+            if isinstance(n, ast.Attribute) and
+            not isinstance(n.ctx, ast.Load) and
+            isinstance(n.value, ast.Name) and n.value.id == name)
+
+
+def _is_terminated(node_list):
+    ''' Control never reaches the end of node_list
+    '''
+    if not node_list:
+        return False
+    node = node_list[-1]
+    if isinstance(node, (ast.Return, ast.Raise, ast.Break, ast.Continue)):
+        return True
+    elif isinstance(node, ast.If):
+        return _is_terminated(node.body) and _is_terminated(node.orelse)
+    return False
+
+
+def _joined_constants(branches):
+    ''' Join constants, known at the end of branches: given a list
+    of (constants, is_terminated), return constants that are known
+    to have the same value in all branches that are not terminated.
+    '''
+    constants_list = [constants for constants, is_terminated in branches
+            if not is_terminated]
+    if not constants_list: # code after branches is unreachable
+        return branches[0][0]
+    joined = constants_list[0].copy()
+    for constants in constants_list[1:]:
+        # all branches are layered over the same initial constants,
+        # so only names changed in some branch can differ
+        assert joined.same_parents(constants)
+        for name in joined.changed_names() | constants.changed_names():
+            if name in joined and not (name in constants and
+                    _same_value(joined[name], constants[name])):
+                del joined[name]
+    return joined
+
+
+def _same_value(a, b):
+    return a is b or (type(a) is type(b) and is_immutable(a) and a == b)
+
+
+def _has_late_binding(node_list):
+    ''' Code in node_list creates functions or generators, that can
+    see the loop variable after it changes
+    '''
+    late_binding_types = (ast.FunctionDef, ast.ClassDef, ast.Lambda,
+            ast.GeneratorExp)
+    return any(isinstance(n, late_binding_types)
+            for n in ast.walk(ast.Module(body=node_list)))
@@ -0,0 +1,245 @@
+# -*- encoding: utf-8 -*-
+
+import __builtin__
+import ast
+import types
+
+from ast_pe.utils import fn_to_ast, get_locals
+from ast_pe.cache import LRUCache
+
+
+# statements and expressions, that make a function impure wherever
+# they are: they change globals, do IO, or return generators.
+# Nested functions and classes are not analyzed.
+IMPURE_TYPES = (ast.Global, ast.Print, ast.Exec, ast.Import, ast.ImportFrom,
+        ast.With, ast.Yield, ast.FunctionDef, ast.ClassDef)
+
+# expressions, that always evaluate to new objects, so that local variables
+# holding them can be mutated freely
+FRESH_TYPES = (ast.Num, ast.Str, ast.Tuple, ast.List, ast.Dict, ast.Set,
+        ast.ListComp, ast.DictComp, ast.SetComp, ast.GeneratorExp,
+        ast.BinOp, ast.UnaryOp, ast.Compare)
+
+# built-in functions, that return new containers
+FRESH_FUNCTIONS = (bytearray, dict, list, set, sorted)
+
+# types of global values, whose methods are resolved (and they are pure,
+# if the analyzer is told so)
+RESOLVED_TYPES = (types.ModuleType, dict, list, tuple, str, unicode,
+        frozenset)
+
+
+# summaries of function bodies, keyed by code objects (see _summary)
+_summary_cache = LRUCache(maxsize=1024)
+_impure = object() # summary of functions, that are impure by themselves
+
+
+class PurityAnalyzer(object):
+    ''' Infer that python functions are pure from their source: they do not
+    assign globals or attributes and items of their arguments, do no IO,
+    and call only pure functions. Mutation of new containers, held by
+    local variables, is fine. Attribute and item reads are assumed
+    to have no side effects.
+    Bodies are analyzed once for each code object, and the verdict
+    for a function is cached in the analyzer, as it depends on
+    the functions its globals refer to.
+    '''
+    def __init__(self, is_known_pure):
+        ''' is_known_pure(fn) should return True for functions, that are
+        known to be pure without analysis (builtins, marked functions)
+        '''
+        self._is_known_pure = is_known_pure
+        self._verdicts = {} # fn -> is it pure
+
+    def is_pure_fn(self, fn):
+        ''' Python function (or method) fn is pure, and so are all functions
+        it can call (recursive calls are fine)
+        '''
+        fn = getattr(fn, '__func__', fn)
+        if not _is_analyzable(fn):
+            return False
+        elif fn in self._verdicts:
+            return self._verdicts[fn]
+        # fn is pure, if all python functions reachable from it are pure
+        # by themselves, and all other callees are known to be pure
+        reachable, to_visit, is_pure = set([fn]), [fn], True
+        while to_visit and is_pure:
+            callee = to_visit.pop()
+            is_pure = self._verdicts.get(callee, True)
+            summary = _summary(callee) if is_pure else _impure
+            if summary is _impure:
+                is_pure = False
+                break
+            for name, attr, is_fresh in summary:
+                found, value = _resolve(callee, name, attr)
+                value = getattr(value, '__func__', value)
+                if not found:
+                    is_pure = False
+                elif is_fresh:
+                    is_pure = value in FRESH_FUNCTIONS
+                elif _is_exception_class(value) or self._is_known_pure(value):
+                    continue
+                elif _is_analyzable(value):
+                    if value not in reachable:
+                        reachable.add(value)
+                        to_visit.append(value)
+                else:
+                    is_pure = False
+                if not is_pure:
+                    break
+        # if fn is pure, so are all reachable functions
+        for callee in (reachable if is_pure else [fn]):
+            self._verdicts[callee] = is_pure
+        return is_pure
+
+
+def _is_analyzable(fn):
+    ''' fn is a python function, with the source we can analyze.
+    Wrappers can do anything, whatever the wrapped function is.
+    '''
+    return isinstance(fn, types.FunctionType) and \
+            not hasattr(fn, '__wrapped__')
+
+
+def _is_exception_class(value):
+    ''' Exceptions are created only to be raised, which is fine
+    '''
+    return isinstance(value, type) and issubclass(value, BaseException)
+
+
+def _resolve(fn, name, attr):
+    ''' Return tuple of boolean (value is found), and value of non-local
+    name in fn (and its attribute attr, unless attr is None).
+    Only attributes of values of RESOLVED_TYPES are resolved.
+    '''
+    code = fn.__code__
+    if name in code.co_freevars:
+        try:
+            value = fn.__closure__[
+                    code.co_freevars.index(name)].cell_contents
+        except ValueError: # empty cell
+            return False, None
+    elif name in fn.__globals__:
+        value = fn.__globals__[name]
+    elif hasattr(__builtin__, name):
+        value = getattr(__builtin__, name)
+    else:
+        return False, None
+    if attr is None:
+        return True, value
+    elif isinstance(value, RESOLVED_TYPES) and hasattr(value, attr):
+        return True, getattr(value, attr)
+    return False, None
+
+
+def _summary(fn):
+    ''' Return _impure if fn body is impure by itself, or a tuple
+    of functions it calls, that must be pure: tuples of (global name,
+    its attribute or None, should it be a function from FRESH_FUNCTIONS,
+    as its result is mutated)
+    '''
+    summary = _summary_cache.get(fn.__code__, None)
+    if summary is None:
+        summary = _summary_cache.put(fn.__code__, _analyze(fn))
+    return summary
+
+
+def _analyze(fn):
+    try:
+        fn_ast = fn_to_ast(fn)
+    except Exception: # no source, or it is not a def (e.g. lambda)
+        return _impure
+    fn_def = fn_ast.body[0]
+    if not isinstance(fn_def, ast.FunctionDef) or \
+            fn_def.name != fn.__name__:
+        return _impure
+    local_names = get_locals(fn_def)
+    owned_names = _owned_names(fn_def, local_names)
+    is_owned = lambda node: \
+            isinstance(node, ast.Name) and node.id in owned_names
+    callees = set()
+    mutated_names = set() # owned names, whose values are changed in place
+    for node in _walk(fn_def.body):
+        if isinstance(node, IMPURE_TYPES):
+            return _impure
+        elif isinstance(node, (ast.Attribute, ast.Subscript)) and \
+                not isinstance(node.ctx, ast.Load):
+            if not is_owned(node.value):
+                return _impure
+            mutated_names.add(node.value.id)
+        elif isinstance(node, ast.AugAssign) and \
+                isinstance(node.target, ast.Name):
+            # it can change the value in place, e.g. a list
+            if not is_owned(node.target):
+                return _impure
+            mutated_names.add(node.target.id)
+        elif isinstance(node, ast.Call):
+            func = node.func
+            if isinstance(func, ast.Name) and func.id not in local_names:
+                callees.add((func.id, None, False))
+            elif isinstance(func, ast.Attribute) and is_owned(func.value):
+                # methods of new containers
+                mutated_names.add(func.value.id)
+            elif isinstance(func, ast.Attribute) and \
+                    isinstance(func.value, ast.Str):
+                pass # methods of string literals
+            elif isinstance(func, ast.Attribute) and \
+                    isinstance(func.value, ast.Name) and \
+                    func.value.id not in local_names:
+                callees.add((func.value.id, func.attr, False))
+            else:
+                return _impure
+    # values of other owned names can be any results of pure callees
+    for name in mutated_names:
+        callees.update(_fresh_callees(fn_def, name))
+    return tuple(sorted(callees))
+
+
+def _walk(nodes):
+    for node in nodes:
+        for n in ast.walk(node):
+            yield n
+
+
+def _owned_names(fn_def, local_names):
+    ''' Return a set of local variables, that hold only new objects,
+    created in fn_def: every assignment to them assigns a value of
+    FRESH_TYPES, or a result of a function from FRESH_FUNCTIONS.
+    Augmented assignments keep values new.
+    '''
+    owned, fresh_targets = set(), set()
+    for node in _walk(fn_def.body):
+        if isinstance(node, ast.Assign) and \
+                _is_fresh(node.value, local_names):
+            fresh_targets.update(target for target in node.targets
+                    if isinstance(target, ast.Name))
+        elif isinstance(node, ast.AugAssign):
+            fresh_targets.add(node.target)
+    not_owned = set()
+    for node in ast.walk(fn_def):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            (owned if node in fresh_targets else not_owned).add(node.id)
+    not_owned.update(name for name in (fn_def.args.vararg,
+        fn_def.args.kwarg) if name)
+    return (owned - not_owned) & local_names
+
+
+def _is_fresh(node, local_names):
+    ''' node evaluates to a new object, if calls of global names
+    are calls of FRESH_FUNCTIONS (see _fresh_callees)
+    '''
+    return isinstance(node, FRESH_TYPES) or (
+            isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+            and node.func.id not in local_names)
+
+
+def _fresh_callees(fn_def, name):
+    ''' Yield callees, whose results are assigned to owned variable name,
+    that is mutated, so they must return new containers
+    '''
+    for node in _walk(fn_def.body):
+        if isinstance(node, ast.Assign) and \
+                isinstance(node.value, ast.Call) and \
+                any(isinstance(target, ast.Name) and target.id == name
+                    for target in node.targets):
+            yield node.value.func.id, None, True
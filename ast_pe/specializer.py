@@ -1,42 +1,439 @@
 # -*- encoding: utf-8 -*-
 
-from ast_pe.utils import fn_to_ast, eval_ast, ast_to_source
+import ast
+import inspect
+import functools
+
+from ast_pe.utils import fn_to_ast, compile_ast, eval_code, ast_to_source, \
+        code_names, ast_key, is_true_division
 from ast_pe.optimizer import optimized_ast
+from ast_pe.var_simplifier import simplify_function
+from ast_pe.namespace import Namespace, captured_globals
+from ast_pe.bytecode import const_globals
+from ast_pe.cache import LRUCache
+from ast_pe.tiered import TieredFunction, run_in_background
+
+
+# load globals of specialized functions (they never change) as constants
+CONST_GLOBALS = True
+
+# prefix of names, that static values of arguments are bound to,
+# when they are needed under other names
+STATIC_ALIAS_PREFIX = '__ast_pe_static_'
+
+# different static values often give the same specialized AST, so code
+# objects are shared: module code objects, keyed by ast_key of the
+# specialized AST, and code objects with globals loaded as constants,
+# keyed by module code object and identities of global values
+# (that are kept alive by the cache, so identities are not reused)
+_compiled_cache = LRUCache(maxsize=1024)
+_const_globals_cache = LRUCache(maxsize=1024)
+
+
+def code_cache_info():
+    ''' Return a dict with statistics of the cache of compiled specialized
+    code (hits are specializations, that are not compiled again)
+    '''
+    return dict(hits=_compiled_cache.hits, misses=_compiled_cache.misses,
+            size=len(_compiled_cache), maxsize=_compiled_cache.maxsize)
+
+
+def code_cache_clear():
+    _compiled_cache.clear()
+    _const_globals_cache.clear()
 
 
 def specialized_fn(fn, globals_, locals_, *args, **kwargs):
     ''' Return specialized version of fn, fixing given args and kwargs,
     just as functools.partial does, but specialized function should be faster
     '''
+    code_object, fn_globals = specialized_code(
+            fn, globals_, locals_, *args, **kwargs)
+    return eval_specialized_code(code_object, fn_globals)
+
+
+def specialized_method(method, attrs, globals_, locals_, *args, **kwargs):
+    ''' Return specialized version of bound method, fixing given args
+    and kwargs (see specialized_fn). Attributes of the object with given 
+    names (a single name or a list of names) must never change, and their
+    values must not be mutated: reads of them are replaced with their values,
+    and methods of the object marked with @inline are inlined.
+    '''
+    if isinstance(attrs, basestring):
+        attrs = [attrs]
+    obj, fn = method.__self__, method.__func__
+    if obj is None:
+        raise TypeError('%s is not a bound method' % fn.__name__)
+    self_name = inspect.getargspec(fn).args[0]
+    code_object, fn_globals = _specialized_code(
+            fn, globals_, locals_, (obj, ) + args, kwargs,
+            frozen_attrs={self_name: (obj, frozenset(attrs))})
+    return eval_specialized_code(code_object, fn_globals)
+
+
+def eval_specialized_code(code_object, fn_globals):
+    ''' Return function, defined by code_object, returned by specialized_code,
+    and evaluated with fn_globals. If CONST_GLOBALS is True,
+    globals are loaded as constants (LOAD_CONST instead of LOAD_GLOBAL),
+    except for builtins, which can still be changed.
+    '''
+    if CONST_GLOBALS:
+        values = dict(fn_globals)
+        values.pop('__builtins__', None)
+        key = code_object, tuple(sorted(
+            (name, id(value)) for name, value in values.iteritems()))
+        cached = _const_globals_cache.get(key)
+        if cached is None:
+            cached = _const_globals_cache.put(
+                    key, (values, const_globals(code_object, values)))
+        code_object = cached[1]
+    return eval_code(code_object, globals_=fn_globals)
+
+
+def specialized_code(fn, globals_, locals_, *args, **kwargs):
+    ''' Return module code object, that defines specialized version of fn 
+    (see specialized_fn), and a dict of globals it must be evaluated with.
+    globals_ and locals_ are not copied: only the names that specialized
+    code references are captured in its globals, together with bindings
+    (static arguments and values computed at compile time).
+    '''
+    return _specialized_code(fn, globals_, locals_, args, kwargs)
+
+
+def _specialized_code(fn, globals_, locals_, args, kwargs, frozen_attrs=None):
     assert isinstance(globals_, dict) and isinstance(locals_, dict)
-    globals_ = dict(globals_)
-    globals_.update(locals_)
+    env = Namespace(locals_, globals_)
     fn_ast = fn_to_ast(fn)
-    specialized_tree, bindings = specialized_ast(
-            fn_ast, globals_, *args, **kwargs)
-    if globals_.get('PRINT_AST'): # for demo
+    # decorators were already applied to fn, and should not be applied
+    # to the specialized version (e.g. specialize_on)
+    fn_ast.body[0].decorator_list = []
+    # "/" keeps its meaning in the module of fn
+    true_division = is_true_division(fn)
+    specialized_tree, bindings = _specialized_ast(
+            fn_ast, env, args, kwargs, frozen_attrs=frozen_attrs,
+            true_division=true_division)
+    if env.get('PRINT_AST'): # for demo
         print ast_to_source(specialized_tree)
-    globals_.update(bindings)
-    return eval_ast(specialized_tree, globals_=globals_) 
+    code_object = _compiled(specialized_tree, true_division)
+    return code_object, \
+            captured_globals(code_object, Namespace(bindings, env))
+
+
+def _compiled(tree, true_division):
+    ''' Return module code object, compiled from tree, or the one compiled
+    from an equal tree before (see compile_ast)
+    '''
+    key = true_division, ast_key(tree)
+    code_object = _compiled_cache.get(key)
+    if code_object is None:
+        code_object = _compiled_cache.put(
+                key, compile_ast(tree, true_division))
+    return code_object
+
+
+def code_bindings(code_object, fn_globals, globals_, locals_):
+    ''' Return a dict of bindings from fn_globals (returned by 
+    specialized_code), that code_object needs, and that are not 
+    available in globals_ and locals_
+    '''
+    env = Namespace(locals_, globals_)
+    bindings = {}
+    for name in code_names(code_object):
+        if name in fn_globals and \
+                (name not in env or env[name] is not fn_globals[name]):
+            bindings[name] = fn_globals[name]
+    return bindings
+
+
+def specialized_fn_async(fn, globals_, locals_, *args, **kwargs):
+    ''' Like specialized_fn, but return immediately. Returned callable
+    calls fn with given args and kwargs fixed (as functools.partial does),
+    while specialized version is built in background thread,
+    and than switches to it (see ast_pe.tiered.TieredFunction).
+    '''
+    return TieredFunction(
+            functools.partial(fn, *args, **kwargs),
+            lambda : specialized_fn(fn, globals_, locals_, *args, **kwargs))
 
 
 def specialized_ast(fn_ast, global_bindings, *args, **kwargs):
-    ''' Return AST of specialized function, and dict with closure bindings.
+    ''' Return AST of specialized function, and dict with closure bindings,
+    that it needs in addition to global_bindings (which are not modified).
     args and kwargs have the same meaning as in functools.partial.
     Here we just handle the args and kwargs of function defenition.
+    It is not known how "/" in fn_ast is compiled, so it is not folded.
     '''
-    constants = dict(global_bindings)
-    fn_args = fn_ast.body[0].args
-    assert not fn_args.vararg and not fn_args.kwarg # TODO
-    if args:
-        for arg, value in zip(fn_args.args[:len(args)], args):
-            constants[arg.id] = value
-        del fn_args.args[:len(args)]
-    if kwargs:
-        arg_by_id = dict((arg.id, arg) for arg in fn_args.args)
-        for kwarg_name, kwarg_value in kwargs.iteritems():
-            constants[kwarg_name] = kwarg_value
+    return _specialized_ast(fn_ast, global_bindings, args, kwargs,
+            true_division=None)
+
+
+def _specialized_ast(fn_ast, global_bindings, args, kwargs, 
+        frozen_attrs=None, true_division=None):
+    static_bindings = {}
+    constants = Namespace(static_bindings, global_bindings)
+    fn_def = fn_ast.body[0]
+    fn_args = fn_def.args
+    static_names = []
+    # defaults of parameters, that are left, must stay aligned with them
+    defaults = dict(zip(fn_args.args[::-1], fn_args.defaults[::-1]))
+    if len(args) > len(fn_args.args) and not fn_args.vararg:
+        raise TypeError('%s() takes at most %d arguments (%d given)' % (
+            fn_def.name, len(fn_args.args), len(args)))
+    for arg, value in zip(fn_args.args, args):
+        static_bindings[arg.id] = value
+        static_names.append(arg.id)
+    extra_args = tuple(args[len(fn_args.args):])
+    del fn_args.args[:len(args)]
+    arg_by_id = dict((arg.id, arg) for arg in fn_args.args)
+    extra_kwargs = {}
+    for kwarg_name, kwarg_value in kwargs.iteritems():
+        if kwarg_name in arg_by_id:
+            static_bindings[kwarg_name] = kwarg_value
+            static_names.append(kwarg_name)
             fn_args.args.remove(arg_by_id[kwarg_name])
-    return optimized_ast(fn_ast, constants)
+        elif kwarg_name in static_bindings:
+            raise TypeError('%s() got multiple values for keyword argument '
+                    '%r' % (fn_def.name, kwarg_name))
+        elif fn_args.kwarg:
+            extra_kwargs[kwarg_name] = kwarg_value
+        else:
+            raise TypeError('%s() got an unexpected keyword argument %r' % (
+                fn_def.name, kwarg_name))
+    fn_args.defaults = [defaults[arg] for arg in fn_args.args
+            if arg in defaults]
+    # static values of *args and **kwargs are merged with dynamic ones
+    # (as in functools.partial)
+    if extra_kwargs:
+        alias = STATIC_ALIAS_PREFIX + fn_args.kwarg
+        static_bindings[alias] = extra_kwargs
+        static_bindings['__ast_pe_dict'] = dict
+        fn_def.body.insert(0, ast.Assign(
+            targets=[ast.Name(id=fn_args.kwarg, ctx=ast.Store())],
+            value=ast.Call(func=ast.Name(id='__ast_pe_dict', ctx=ast.Load()),
+                args=[ast.Name(id=alias, ctx=ast.Load())], keywords=[],
+                starargs=None,
+                kwargs=ast.Name(id=fn_args.kwarg, ctx=ast.Load()))))
+    if extra_args:
+        alias = STATIC_ALIAS_PREFIX + fn_args.vararg
+        static_bindings[alias] = extra_args
+        fn_def.body.insert(0, ast.Assign(
+            targets=[ast.Name(id=fn_args.vararg, ctx=ast.Store())],
+            value=ast.BinOp(left=ast.Name(id=alias, ctx=ast.Load()),
+                op=ast.Add(),
+                right=ast.Name(id=fn_args.vararg, ctx=ast.Load()))))
+    # static arguments, that are assigned in the body, are still local
+    # variables, so they must be initialized at the start
+    assigned_names = set(n.id for n in ast.walk(fn_def)
+            if isinstance(n, ast.Name) and 
+            isinstance(n.ctx, (ast.Store, ast.Del)))
+    for name in reversed(static_names):
+        if name in assigned_names:
+            alias = STATIC_ALIAS_PREFIX + name
+            static_bindings[alias] = static_bindings[name]
+            fn_def.body.insert(0, ast.Assign(
+                targets=[ast.Name(id=name, ctx=ast.Store())],
+                value=ast.Name(id=alias, ctx=ast.Load())))
+    specialized_tree, bindings = optimized_ast(
+            fn_ast, constants, frozen_attrs=frozen_attrs,
+            true_division=true_division)
+    simplify_function(specialized_tree.body[0])
+    bindings.update(static_bindings)
+    return specialized_tree, bindings
+
+
+def specialize_hot(names, globals_, locals_, threshold=100, 
+        decay_interval=10000, cache_size=128, background=False,
+        disk_cache=None):
+    ''' Decorator, like specialize_on, but that specializes function only
+    on values of arguments that are frequent: at least threshold calls
+    with them are made (recently - counts are halved every decay_interval
+    calls). Until then, generic function is called.
+    '''
+    if isinstance(names, basestring):
+        names = [names]
+    def decorator(fn):
+        return HotSpecializingDispatcher(fn, names, globals_, locals_, 
+                threshold=threshold, decay_interval=decay_interval,
+                cache_size=cache_size, background=background,
+                disk_cache=disk_cache)
+    return decorator
+
+
+def specialize_on(names, globals_, locals_, cache_size=128, 
+        background=False, disk_cache=None):
+    ''' Decorator, that specializes function on arguments with given names
+    (a single name or a list of names), creating specialized versions
+    as needed, and keeping at most cache_size of them.
+    Values of this arguments must be hashable - if they are not, generic
+    function is called.
+    If background is True, specialized versions are built in background
+    thread, and generic function is called until they are ready.
+    disk_cache is an optional ast_pe.disk_cache.DiskCache instance,
+    used to store specialized versions between runs.
+    '''
+    if isinstance(names, basestring):
+        names = [names]
+    def decorator(fn):
+        return SpecializingDispatcher(fn, names, globals_, locals_, 
+                cache_size=cache_size, background=background,
+                disk_cache=disk_cache)
+    return decorator
+
+
+class SpecializingDispatcher(object):
+    ''' Callable that dispatches calls to the versions of fn, specialized
+    on the values of arguments with given names.
+    '''
+    def __init__(self, fn, names, globals_, locals_, cache_size=128,
+            background=False, disk_cache=None):
+        argspec = inspect.getargspec(fn)
+        for name in names:
+            if name not in argspec.args:
+                raise TypeError('%s() has no argument %r' % 
+                        (fn.__name__, name))
+        self._fn = fn
+        self._names = tuple(names)
+        self._positions = tuple(argspec.args.index(name) for name in names)
+        self._name_positions = tuple(zip(self._names, self._positions))
+        self._first_position = min(self._positions + (len(argspec.args),))
+        self._defaults = dict(zip(
+            argspec.args[len(argspec.args) - len(argspec.defaults or ()):],
+            argspec.defaults or ()))
+        self._globals = globals_
+        self._locals = locals_
+        self._cache = LRUCache(maxsize=cache_size)
+        self._background = background
+        self._disk_cache = disk_cache
+        functools.update_wrapper(self, fn)
+        self.__wrapped__ = fn
+
+    def __call__(self, *args, **kwargs):
+        key = self._get_key(args, kwargs)
+        if key is not None:
+            try:
+                specialized = self._get_specialized(key)
+            except TypeError: # unhashable static value
+                specialized = None
+            if specialized is not None:
+                return specialized(
+                        *self._dynamic_args(args), 
+                        **self._dynamic_kwargs(kwargs))
+        return self._fn(*args, **kwargs)
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return functools.partial(self, obj)
+
+    def cache_clear(self):
+        self._cache.clear()
+
+    def cache_info(self):
+        ''' Return a dict with cache statistics
+        '''
+        return dict(hits=self._cache.hits, misses=self._cache.misses,
+                size=len(self._cache), maxsize=self._cache.maxsize)
+
+    def _get_key(self, args, kwargs):
+        ''' Return a tuple of (type, value) pairs of static arguments,
+        or None if some of them are not given. Types are included, 
+        so that e.g. specialization for 1 is not used for True or 1.0.
+        '''
+        key = []
+        for name, position in self._name_positions:
+            if position < len(args):
+                value = args[position]
+            elif name in kwargs:
+                value = kwargs[name]
+            elif name in self._defaults:
+                value = self._defaults[name]
+            else:
+                return None # let the generic function raise TypeError
+            key.append((type(value), value))
+        return tuple(key)
+
+    def _get_specialized(self, key):
+        ''' Return specialized function for key, creating it if needed,
+        or None if generic function should be called.
+        '''
+        specialized = self._cache.get(key)
+        if specialized is None:
+            specialized = self._cache.put(key, self._start_specialization(key))
+        return self._get_if_ready(specialized)
+
+    def _start_specialization(self, key):
+        ''' Return specialized function, or AsyncResult of specialization
+        in background mode
+        '''
+        if self._background:
+            return run_in_background(self._specialize, key)
+        return self._specialize(key)
+
+    def _get_if_ready(self, specialized):
+        if self._background:
+            if not (specialized.ready() and specialized.successful()):
+                return None
+            return specialized.get()
+        return specialized
+
+    def _specialize(self, key):
+        static_kwargs = dict(
+                (name, value) for name, (_, value) in zip(self._names, key))
+        specialize = specialized_fn if self._disk_cache is None \
+                else self._disk_cache.specialized_fn
+        return specialize(
+                self._fn, self._globals, self._locals, **static_kwargs)
+
+    def _dynamic_args(self, args):
+        if len(args) > self._first_position:
+            return [arg for i, arg in enumerate(args) 
+                    if i not in self._positions]
+        return args
+
+    def _dynamic_kwargs(self, kwargs):
+        if kwargs:
+            for name in self._names:
+                kwargs.pop(name, None)
+        return kwargs
+
+
+class HotSpecializingDispatcher(SpecializingDispatcher):
+    ''' Dispatcher, that specializes only on values of arguments,
+    that were seen in at least threshold calls. Call counts are halved
+    every decay_interval calls with not yet specialized values, and
+    counts that drop to zero are forgotten, so only recently hot
+    values are remembered. Counting is not locked, so in multithreaded
+    code counts are approximate.
+    '''
+    def __init__(self, fn, names, globals_, locals_, threshold=100,
+            decay_interval=10000, **kwargs):
+        assert threshold > 0 and decay_interval > 0
+        super(HotSpecializingDispatcher, self).__init__(
+                fn, names, globals_, locals_, **kwargs)
+        self._threshold = threshold
+        self._decay_interval = decay_interval
+        self._counts = {}
+        self._calls_until_decay = decay_interval
 
+    def _get_specialized(self, key):
+        # values that are being counted are not in the cache,
+        # so we can skip looking there
+        count = self._counts.get(key)
+        specialized = None if count is not None else self._cache.get(key)
+        if specialized is None:
+            self._calls_until_decay -= 1
+            if self._calls_until_decay <= 0:
+                self._decay()
+                count = self._counts.get(key)
+            count = (count or 0) + 1
+            if count < self._threshold:
+                self._counts[key] = count
+                return None
+            self._counts.pop(key, None)
+            specialized = self._cache.put(key, self._start_specialization(key))
+        return self._get_if_ready(specialized)
 
+    def _decay(self):
+        self._calls_until_decay = self._decay_interval
+        self._counts = dict((key, count / 2) 
+                for key, count in self._counts.items() if count > 1)
@@ -0,0 +1,68 @@
+# -*- encoding: utf-8 -*-
+
+import threading
+from multiprocessing.pool import ThreadPool
+
+
+# number of threads in the shared pool: specialization is pure python code,
+# so more threads would only compete for the GIL
+POOL_SIZE = 1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    ''' Return a thread pool, shared by all background specializations.
+    It is created on first use.
+    '''
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(processes=POOL_SIZE)
+        return _pool
+
+
+def run_in_background(fn, *args):
+    ''' Call fn(*args) in the shared pool, return AsyncResult
+    '''
+    return get_pool().apply_async(fn, args)
+
+
+class TieredFunction(object):
+    ''' Callable, that calls generic until the specialized version, built
+    by calling specialize() in background, is ready, and than calls it.
+    If specialize fails, generic is used forever, and exception
+    is stored in error.
+    '''
+    def __init__(self, generic, specialize):
+        self._impl = generic
+        self._specialize = specialize
+        self._ready = threading.Event()
+        self.error = None
+        run_in_background(self._run)
+
+    def __call__(self, *args, **kwargs):
+        return self._impl(*args, **kwargs)
+
+    def ready(self):
+        ''' Specialization is finished (successfully or not)
+        '''
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        ''' Wait until specialization is finished.
+        Return True if specialized version is used.
+        '''
+        self._ready.wait(timeout)
+        return self.ready() and self.error is None
+
+    def _run(self):
+        try:
+            # assignment is atomic, so callers see either generic
+            # or fully built specialized function
+            self._impl = self._specialize()
+        except Exception as e:
+            self.error = e
+        finally:
+            self._ready.set()
@@ -0,0 +1,72 @@
+# -*- encoding: utf-8 -*-
+
+from ast_pe.utils import ast_to_string, get_logger
+
+
+class Tracer(object):
+    ''' Hooks, called by Optimizer during optimization.
+    All of them do nothing - override the ones you need.
+    When no tracer is given to Optimizer, hooks are not called at all.
+    '''
+    def enter_node(self, node, depth):
+        ''' Optimizer starts visiting children of node
+        '''
+
+    def exit_node(self, node, depth):
+        ''' Optimizer finished visiting children of node
+        '''
+
+    def fold(self, node, value):
+        ''' node was evaluated at compile time, giving value
+        '''
+
+    def inline(self, call_node, fn):
+        ''' fn is inlined in place of call_node
+        '''
+
+    def not_inlined(self, call_node, fn, reason):
+        ''' fn, marked with @inline, is not inlined in place of call_node,
+        because of reason (see Optimizer.get_not_inlined)
+        '''
+
+    def rollback(self, reason):
+        ''' Optimization is restarted, because of reason
+        '''
+
+
+class LoggingTracer(Tracer):
+    ''' Log all events at DEBUG level.
+    AST trees are pretty-printed only if the message is really logged.
+    '''
+    def __init__(self, logger=None):
+        self.logger = logger or get_logger('ast_pe.trace', debug=True)
+
+    def enter_node(self, node, depth):
+        self.logger.debug('%s visit:\n%s', '--' * depth, LazyAST(node))
+
+    def exit_node(self, node, depth):
+        self.logger.debug('%s result:\n%s', '--' * depth, LazyAST(node))
+
+    def fold(self, node, value):
+        self.logger.debug('fold:\n%s\nto %r', LazyAST(node), value)
+
+    def inline(self, call_node, fn):
+        self.logger.debug('inline %s:\n%s',
+                getattr(fn, '__name__', fn), LazyAST(call_node))
+
+    def not_inlined(self, call_node, fn, reason):
+        self.logger.debug('not inlined %s (%s):\n%s',
+                getattr(fn, '__name__', fn), reason, LazyAST(call_node))
+
+    def rollback(self, reason):
+        self.logger.debug('rollback: %s', reason)
+
+
+class LazyAST(object):
+    ''' Pretty-prints AST only when converted to string
+    '''
+    def __init__(self, node):
+        self.node = node
+
+    def __str__(self):
+        return ast_to_string(self.node)
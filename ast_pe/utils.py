@@ -2,6 +2,8 @@
 
 import re
 import ast
+import __future__
+import types
 import inspect
 import unittest
 import logging
@@ -9,17 +11,48 @@ import warnings
 
 import meta.asttools
 
+from ast_pe.cache import LRUCache
+
 
 # ignore warnings about missing lineno and col_offset
 warnings.filterwarnings('ignore', module='meta.asttools.visitors', lineno=47)
 
 
+# parsed AST templates, keyed by function code objects
+_fn_ast_cache = LRUCache(maxsize=1024)
+
+
 def fn_to_ast(fn):
-    ''' Return AST tree, parsed from fn
+    ''' Return AST tree, parsed from fn. 
+    Source is parsed only once for each code object, and a fresh copy
+    of the parsed tree is returned each time, so it can be mutated freely.
     '''
-    source = shift_source(inspect.getsource(fn))
-    # FIXME - more general solution, here just a quick hack for tests
-    return ast.parse(source)
+    fn = getattr(fn, '__wrapped__', fn)
+    tree = _fn_ast_cache.get(fn.__code__)
+    if tree is None:
+        source = shift_source(inspect.getsource(fn))
+        # FIXME - more general solution, here just a quick hack for tests
+        tree = _fn_ast_cache.put(fn.__code__, ast.parse(source))
+    return copy_ast(tree)
+
+
+def copy_ast(node):
+    ''' Return a deep copy of AST node (or a list of nodes).
+    Much faster than copy.deepcopy, as only AST nodes and lists are copied.
+    '''
+    if isinstance(node, ast.AST):
+        new_node = node.__class__()
+        for field in node._fields:
+            if hasattr(node, field):
+                setattr(new_node, field, copy_ast(getattr(node, field)))
+        for attr in node._attributes:
+            if hasattr(node, attr):
+                setattr(new_node, attr, getattr(node, attr))
+        return new_node
+    elif isinstance(node, list):
+        return [copy_ast(n) for n in node]
+    else:
+        return node
 
 
 def shift_source(source):
@@ -38,12 +71,74 @@ def shift_source(source):
 def eval_ast(tree, globals_=None):
     ''' Evaluate AST tree, which sould contain only one root node
     '''
+    return eval_code(compile_ast(tree), globals_=globals_)
+
+
+def compile_ast(tree, true_division=False):
+    ''' Compile AST tree, which sould contain only one root node,
+    return module code object. If true_division is True, it is compiled
+    as if with "from __future__ import division".
+    '''
     assert isinstance(tree, ast.Module) and len(tree.body) == 1
     ast.fix_missing_locations(tree)
-    code_object = compile(tree, '<nofile>', 'exec')
+    flags = __future__.division.compiler_flag if true_division else 0
+    return compile(tree, '<nofile>', 'exec', flags)
+
+
+def is_true_division(fn):
+    ''' "/" is true division in fn: it is compiled
+    with "from __future__ import division"
+    '''
+    fn = getattr(fn, '__func__', fn)
+    fn = getattr(fn, '__wrapped__', fn)
+    return bool(fn.__code__.co_flags & __future__.division.compiler_flag)
+
+
+def ast_key(tree):
+    ''' Return a hashable key of AST tree, equal for trees, that compile
+    to the same code (locations of nodes are ignored). Literals are
+    included with their types, and floats by repr, so that e.g.
+    1 and 1.0, or 0.0 and -0.0 give different keys.
+    Faster than ast.dump, as it matters when compilation is cached.
+    '''
+    parts = []
+    append = parts.append
+    stack = [tree]
+    pop, extend = stack.pop, stack.extend
+    while stack:
+        node = pop()
+        if isinstance(node, ast.AST):
+            append(node.__class__)
+            extend([getattr(node, field, None) for field in node._fields])
+        elif type(node) is list:
+            append(len(node))
+            extend(node)
+        elif type(node) in (float, complex):
+            append(repr(node))
+        else:
+            append((node.__class__, node))
+    return tuple(parts)
+
+
+def eval_code(code_object, globals_=None):
+    ''' Evaluate module code object, compiled by compile_ast,
+    and return the only object it defines
+    '''
     locals_ = {}
     eval(code_object, globals_, locals_)
-    return locals_[tree.body[0].name]
+    (value, ) = locals_.values()
+    return value
+
+
+def code_names(code_object):
+    ''' Return a set of all global and attribute names, referenced
+    in code_object and code objects nested in it
+    '''
+    names = set(code_object.co_names)
+    for const in code_object.co_consts:
+        if isinstance(const, types.CodeType):
+            names.update(code_names(const))
+    return names
 
 
 def ast_equal(tree1, tree2):
@@ -84,14 +179,17 @@ class BaseTestCase(unittest.TestCase):
 
 
 def get_logger(name, debug=False):
+    ''' Return a logger, printing messages to stderr. 
+    Handler is added only once, so it is safe to call it many times.
+    '''
     logger = logging.getLogger(name=name)
     level = logging.DEBUG if debug else logging.INFO
     logger.setLevel(level)
-    ch = logging.StreamHandler()
-    ch.setLevel(level)
-    formatter = logging.Formatter('%(message)s')
-    ch.setFormatter(formatter)
-    logger.addHandler(ch)
+    if not logger.handlers:
+        ch = logging.StreamHandler()
+        formatter = logging.Formatter('%(message)s')
+        ch.setFormatter(formatter)
+        logger.addHandler(ch)
     return logger
 
 
@@ -118,5 +216,9 @@ class LocalsVisitor(ast.NodeVisitor):
         if isinstance(node.ctx, ast.Store) or isinstance(node.ctx, ast.Param):
             self._locals.add(node.id)
 
+    def visit_arguments(self, node):
+        self.generic_visit(node)
+        self._locals.update(name for name in (node.vararg, node.kwarg) if name)
+
     def get_locals(self):
         return self._locals
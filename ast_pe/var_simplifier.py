@@ -1,75 +1,491 @@
 # -*- encoding: utf-8 -*-
 
 import ast
-from meta.asttools import get_symbols
-
-from ast_pe.utils import ast_to_string
+from collections import defaultdict
 
+from ast_pe.utils import copy_ast
 
 
 def remove_assignments(node_list):
-    ''' Remove one assigment at a time, touching only top level block (???)
-    '''
-    idx = 0
-    while idx <= len(node_list) - 1:
-        node = node_list[idx]
-        removed = _maybe_remove(node, node_list)
-        if not removed:
-            idx += 1
-
-
-def _maybe_remove(node, node_list):
-    if isinstance(node, ast.Assign):
-        can_remove, var_name, value_node = \
-                _can_remove_assignment(node, node_list)
-        if can_remove:
-            node_list.remove(node)
-            new_nodes = []
-            for n in list(node_list):
-                new_n = Replacer(var_name, value_node).visit(n)
-                if new_n is not None:
-                    new_nodes.append(new_n)
-            node_list[:] = new_nodes
-            return True
-
-
-def _can_remove_assignment(assign_node, node_list):
-    ''' Can remove it iff:
-     * it is "simple"
-     * result it not used in "Store" context elsewhere
+    ''' Remove "simple" assignments (of names, numbers and strings)
+    to variables, that are assigned only once, substituting their values
+    in all uses. Only assignments in the top level block are removed.
+    Stores are counted once, and substitutions are made in one sweep,
+    so this is linear in the size of node_list.
     '''
-    if len(assign_node.targets) == 1 and \
-            isinstance(assign_node.targets[0], ast.Name):
-        value_node = assign_node.value
-        if isinstance(value_node, ast.Name) or \
-                isinstance(value_node, ast.Num) or \
-                isinstance(value_node, ast.Str):
-            # value_node is "simple"
-            assigned_name = assign_node.targets[0].id
-            idx = node_list.index(assign_node)
-            # dummy node for get_symbols, to check no more assignments are made
-            dummy_node = ast.While(
-                    test=ast.Name(id='True', ctx=ast.Load()),
-                    body=node_list[:idx] + node_list[idx+1:],
-                    orelse=[])
-            if all(n != assigned_name 
-                    for n in get_symbols(dummy_node, (ast.Store, ))):
-                return True, assigned_name, value_node
-    return False, None, None
+    stored_names = [_stored_names(node) for node in node_list]
+    store_counts = defaultdict(int)
+    for names in stored_names:
+        for name in names:
+            store_counts[name] += 1
+    stores_after = dict(store_counts) # name -> number of stores not yet seen
+    loaded_names = set() # names loaded in already visited nodes
+    substitutions = {} # name -> node that should be used instead
+    replacer = Replacer(substitutions)
+    new_nodes = []
+    for node, names in zip(node_list, stored_names):
+        for name in names:
+            stores_after[name] -= 1
+        if substitutions:
+            node = replacer.visit(node)
+        if _is_simple_assignment(node):
+            assigned_name = node.targets[0].id
+            value_node = node.value
+            if store_counts[assigned_name] == 1 and \
+                    assigned_name not in loaded_names and \
+                    not (isinstance(value_node, ast.Name) and 
+                            stores_after.get(value_node.id, 0) != 0):
+                substitutions[assigned_name] = value_node
+                continue
+        loaded_names.update(_loaded_names(node))
+        new_nodes.append(node)
+    node_list[:] = new_nodes
+
+
+def _is_simple_assignment(node):
+    return isinstance(node, ast.Assign) and \
+            len(node.targets) == 1 and \
+            isinstance(node.targets[0], ast.Name) and \
+            isinstance(node.value, (ast.Name, ast.Num, ast.Str))
+
+
+def _loaded_names(node):
+    return [n.id for n in ast.walk(node)
+            if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Load)]
+
+
+def _stored_names(node):
+    return [n.id for n in ast.walk(node)
+            if isinstance(n, ast.Name) and not isinstance(n.ctx, ast.Load)]
 
 
 class Replacer(ast.NodeTransformer):
-    ''' Replaces uses of var_name with value_node
+    ''' Replaces uses of variables with given nodes
     '''
-    def __init__(self, var_name, value_node):
-        self.var_name = var_name
-        self.value_node = value_node
+    def __init__(self, substitutions):
+        self.substitutions = substitutions
         super(Replacer, self).__init__()
 
     def visit_Name(self, node):
         self.generic_visit(node)
-        if isinstance(node.ctx, ast.Load) and node.id == self.var_name:
-            return self.value_node
+        if isinstance(node.ctx, ast.Load) and node.id in self.substitutions:
+            return copy_ast(self.substitutions[node.id])
         else:
             return node
-        
+
+
+# statement fields, that hold nested blocks
+BLOCK_FIELDS = ('body', 'orelse', 'handlers', 'finalbody')
+# nodes with their own scope
+SCOPE_TYPES = (ast.FunctionDef, ast.ClassDef, ast.Lambda, ast.GeneratorExp,
+        ast.SetComp, ast.DictComp)
+# builtins, that can read or change local variables by name
+DYNAMIC_SCOPE_NAMES = ('locals', 'vars', 'eval', 'execfile', 'dir')
+# do not repeat propagation and elimination more times
+MAX_ROUNDS = 10
+
+
+def simplify_function(fn_def):
+    ''' Whole-function copy propagation and dead-store elimination
+    for FunctionDef node fn_def (it is modified in place):
+    - local variables, that are assigned once to literal values
+      or other local variables, are replaced by these values, if all uses
+      follow the assignment, and the value is not assigned before them
+    - temporary variables, that are used once in the next statement,
+      are replaced with their values, if this does not change the order
+      of evaluation
+    - assignments to local variables, that are never read later,
+      are removed (values are kept, if they can have side effects),
+      and so are expressions without side effects
+    Variables, visible from nested scopes, are not touched, and nothing
+    is done if the function uses exec, locals(), etc.
+    '''
+    if has_dynamic_scope(fn_def):
+        return
+    for _ in xrange(MAX_ROUNDS):
+        local_names = assignable_names(fn_def)
+        changed = _propagate_copies(fn_def, local_names)
+        changed = _eliminate_dead_stores(fn_def, local_names) or changed
+        if not changed:
+            break
+
+
+def has_dynamic_scope(fn_def):
+    ''' fn_def uses exec, or builtins that access local variables by name
+    '''
+    return any(isinstance(n, ast.Exec) or 
+            (isinstance(n, ast.Name) and n.id in DYNAMIC_SCOPE_NAMES)
+            for n in ast.walk(fn_def))
+
+
+def _scope_nodes(node_list):
+    ''' Yield all nodes in node_list, not descending into nested scopes
+    '''
+    to_visit = list(node_list)
+    while to_visit:
+        node = to_visit.pop()
+        yield node
+        if not isinstance(node, SCOPE_TYPES):
+            to_visit.extend(ast.iter_child_nodes(node))
+
+
+def assignable_names(fn_def):
+    ''' Return a set of local variables of fn_def, that are assigned only
+    by assignments and loops, and are not visible from nested scopes
+    '''
+    stored, excluded = set(), set()
+    for node in _scope_nodes(fn_def.body):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            stored.add(node.id)
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Del):
+            excluded.add(node.id)
+        elif isinstance(node, ast.Global):
+            excluded.update(node.names)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            excluded.update((alias.asname or alias.name).split('.')[0]
+                    for alias in node.names)
+        elif isinstance(node, SCOPE_TYPES):
+            if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+                excluded.add(node.name)
+            excluded.update(n.id for n in ast.walk(node) 
+                    if isinstance(n, ast.Name))
+    return stored - excluded
+
+
+def _loaded_names_in(node):
+    ''' Return a set of names, whose values can be read in node
+    (including nested scopes)
+    '''
+    names = set()
+    for n in ast.walk(node):
+        if isinstance(n, ast.Name) and \
+                not isinstance(n.ctx, (ast.Store, ast.Param)):
+            names.add(n.id)
+        elif isinstance(n, ast.AugAssign) and \
+                isinstance(n.target, ast.Name):
+            names.add(n.target.id)
+    return names
+
+
+def _count_names(fn_def):
+    ''' Return dicts of store and load counts of names in fn_def
+    '''
+    stores, loads = defaultdict(int), defaultdict(int)
+    for n in ast.walk(fn_def):
+        if isinstance(n, ast.Name):
+            if isinstance(n.ctx, ast.Load):
+                loads[n.id] += 1
+            elif not isinstance(n.ctx, ast.Param):
+                stores[n.id] += 1
+        elif isinstance(n, ast.AugAssign) and \
+                isinstance(n.target, ast.Name):
+            loads[n.target.id] += 1
+    return stores, loads
+
+
+def _name_positions(node_list):
+    ''' Return dicts of names, loaded in node_list (as in _count_names),
+    -> number of loads, and index of the first node with a load,
+    and of names, that can be assigned in node_list, -> index of the last
+    node, that assigns them.
+    Blocks are indexed once, so that checks for each node in them
+    do not walk the rest of the block.
+    '''
+    loads, first_loads, last_stores = defaultdict(int), {}, {}
+    for i, node in enumerate(node_list):
+        for n in ast.walk(node):
+            if isinstance(n, ast.Name):
+                if isinstance(n.ctx, ast.Load):
+                    loads[n.id] += 1
+                    first_loads.setdefault(n.id, i)
+                else:
+                    last_stores[n.id] = i
+            elif isinstance(n, ast.AugAssign) and \
+                    isinstance(n.target, ast.Name):
+                loads[n.target.id] += 1
+                first_loads.setdefault(n.target.id, i)
+                last_stores[n.target.id] = i
+    return loads, first_loads, last_stores
+
+
+def _is_pure(node):
+    ''' Evaluating node has no side effects
+    '''
+    if isinstance(node, (ast.Name, ast.Num, ast.Str)):
+        return True
+    elif isinstance(node, (ast.Tuple, ast.List)):
+        return all(_is_pure(elt) for elt in node.elts)
+    elif isinstance(node, ast.Dict):
+        # other keys can be unhashable
+        return all(isinstance(key, (ast.Num, ast.Str)) for key in node.keys) \
+                and all(_is_pure(value) for value in node.values)
+    return False
+
+
+def param_names(fn_def):
+    ''' Return a set of names of fn_def arguments
+    '''
+    args = fn_def.args
+    names = set(n.id for arg in args.args for n in ast.walk(arg)
+            if isinstance(n, ast.Name))
+    names.update(name for name in (args.vararg, args.kwarg) if name)
+    return names
+
+
+def _is_operator_only(node, local_names):
+    ''' Node is composed only of operators, literals and local names,
+    so evaluating it can not change anything, and other code can not
+    change its value (operators are assumed to have no side effects)
+    '''
+    return all(isinstance(n, (ast.expr_context, ast.operator, ast.unaryop,
+        ast.cmpop, ast.boolop, ast.Num, ast.Str, ast.BinOp, 
+        ast.UnaryOp, ast.Compare, ast.BoolOp, ast.Tuple)) or
+        (isinstance(n, ast.Name) and n.id in local_names)
+        for n in ast.walk(node))
+
+
+def _evaluation_order(node, is_always=True):
+    ''' Yield tuples of node and its sub-expressions in the order they are
+    evaluated (operands before operations), and booleans - are they always
+    evaluated, when node is. Operands of "and" and "or" after the first,
+    comparisons in a chain after the first, branches of "if" expressions,
+    bodies of lambdas and comprehensions (except for the first iterable)
+    are not.
+    '''
+    if isinstance(node, ast.BoolOp):
+        parts = [(node.values[0], is_always)] + \
+                [(value, False) for value in node.values[1:]]
+    elif isinstance(node, ast.Compare):
+        parts = [(node.left, is_always), (node.comparators[0], is_always)] + \
+                [(c, False) for c in node.comparators[1:]]
+    elif isinstance(node, ast.IfExp):
+        parts = [(node.test, is_always), (node.body, False),
+                (node.orelse, False)]
+    elif isinstance(node, ast.Dict):
+        # values are evaluated before their keys
+        parts = [(n, is_always) for value, key in zip(node.values, node.keys)
+                for n in (value, key)]
+    elif isinstance(node, ast.Lambda):
+        parts = [(default, is_always) for default in node.args.defaults] + \
+                [(node.body, False)]
+    elif isinstance(node, (ast.ListComp, ast.GeneratorExp, ast.SetComp,
+            ast.DictComp)):
+        parts = [(node.generators[0].iter, is_always)] + \
+                [(n, False) for n in ast.iter_child_nodes(node)]
+    else:
+        parts = [(n, is_always) for n in ast.iter_child_nodes(node)]
+    for part, is_part_always in parts:
+        for item in _evaluation_order(part, is_part_always):
+            yield item
+    yield node, is_always
+
+
+def _propagate_copies(fn_def, local_names):
+    ''' Substitute copies and single-use temporaries (see simplify_function).
+    Return True if something changed.
+    '''
+    stores, loads = _count_names(fn_def)
+    params = param_names(fn_def)
+    all_locals = local_names | params
+    changed = [False]
+
+    def is_copy(node, i, last_stores):
+        ''' node is an assignment of a literal, or a local variable that is
+        not assigned after node (at index i in its block, see
+        _name_positions), to a local variable that is assigned only here
+        '''
+        if not (_is_simple_assignment(node) and 
+                node.targets[0].id in local_names and 
+                stores[node.targets[0].id] == 1):
+            return False
+        value = node.value
+        return not isinstance(value, ast.Name) or \
+                (value.id in all_locals and 
+                 value.id != node.targets[0].id and
+                 last_stores.get(value.id, i) <= i)
+
+    def loads_in(node_list, name):
+        return sum(1 for node in node_list for n in ast.walk(node)
+                if isinstance(n, ast.Name) and n.id == name)
+
+    def top_expression(node):
+        if isinstance(node, (ast.Assign, ast.Return, ast.Expr)):
+            return node.value
+        elif isinstance(node, (ast.If, ast.While)):
+            return node.test if isinstance(node, ast.If) else None
+        elif isinstance(node, ast.For):
+            return node.iter
+
+    def is_temporary_for(node, next_node):
+        ''' node is an assignment to a variable, that is used only once,
+        in the top expression of next_node, and it is safe to substitute:
+        the use is always evaluated, and if the value is made only
+        of operators, no call or subscript is evaluated before the use
+        (they could change it), otherwise the expression must be made
+        only of operators
+        '''
+        if not (isinstance(node, ast.Assign) and len(node.targets) == 1 and
+                isinstance(node.targets[0], ast.Name)):
+            return False
+        name = node.targets[0].id
+        expr = top_expression(next_node)
+        if not (name in local_names and stores[name] == 1 and
+                loads[name] == 1 and expr is not None and
+                loads_in([expr], name) == 1):
+            return False
+        evaluated_before = []
+        for n, is_always in _evaluation_order(expr):
+            if isinstance(n, ast.Name) and n.id == name:
+                if not is_always:
+                    return False
+                break
+            evaluated_before.append(n)
+        if _is_operator_only(node.value, all_locals):
+            return not any(isinstance(n, (ast.Call, ast.Subscript))
+                    for n in evaluated_before)
+        return _is_operator_only(expr, all_locals)
+
+    def visit_block(node_list):
+        substitutions = {}
+        replacer = Replacer(substitutions)
+        new_nodes = []
+        block_loads, first_loads, last_stores = _name_positions(node_list)
+        for i, node in enumerate(node_list):
+            if substitutions:
+                node = replacer.visit(node)
+            if is_copy(node, i, last_stores) and \
+                    block_loads[node.targets[0].id] == \
+                        loads[node.targets[0].id] and \
+                    first_loads.get(node.targets[0].id, i + 1) > i:
+                # all uses are after the assignment in this block
+                substitutions[node.targets[0].id] = node.value
+                changed[0] = True
+                continue
+            if new_nodes and is_temporary_for(new_nodes[-1], node):
+                temporary = new_nodes.pop()
+                node = Replacer({temporary.targets[0].id: temporary.value})\
+                        .visit(node)
+                changed[0] = True
+            for field in BLOCK_FIELDS:
+                block = getattr(node, field, None)
+                if block:
+                    setattr(node, field, visit_block(block))
+            new_nodes.append(node)
+        return new_nodes or [ast.Pass()]
+
+    fn_def.body = visit_block(fn_def.body)
+    return changed[0]
+
+
+def _eliminate_dead_stores(fn_def, local_names):
+    ''' Remove stores to local_names, that are never read, and expressions
+    without side effects. Return True if something changed.
+    Liveness is computed backwards over the structured code: loops 
+    are iterated until live variables at their start stop changing.
+    Nothing is removed inside try and with statements.
+    '''
+    changed = [False]
+
+    def visit_block(node_list, live, loop_exits, eliminate):
+        ''' Return new node_list, and a set of names, live at its start.
+        live is a set of names live after node_list, loop_exits is a tuple
+        of sets, live after break and continue.
+        '''
+        new_nodes = []
+        for node in reversed(node_list):
+            new_node, live = visit(node, live, loop_exits, eliminate)
+            if new_node is not None:
+                new_nodes.append(new_node)
+            if eliminate and new_node is not node and \
+                    not isinstance(node, ast.Pass):
+                changed[0] = True
+        new_nodes.reverse()
+        if eliminate and not new_nodes and node_list:
+            new_nodes = [ast.Pass()]
+        return (new_nodes if eliminate else node_list), live
+
+    def dead_targets(node, live):
+        ''' Return True if node assigns only to local names,
+        that are not live, and values can be assigned without unpacking
+        '''
+        if len(node.targets) != 1:
+            return False
+        target, value = node.targets[0], node.value
+        if isinstance(target, ast.Name):
+            return target.id in local_names and target.id not in live
+        elif isinstance(target, ast.Tuple) and \
+                isinstance(value, ast.Tuple) and \
+                len(target.elts) == len(value.elts):
+            return all(isinstance(t, ast.Name) and t.id in local_names and
+                    t.id not in live for t in target.elts)
+        return False
+
+    def visit(node, live, loop_exits, eliminate):
+        ''' Return new node (or None if it is removed), and a set of names,
+        live before node
+        '''
+        if isinstance(node, ast.Assign):
+            if dead_targets(node, live):
+                if _is_pure(node.value):
+                    return None, live
+                return ast.Expr(value=node.value), \
+                        live | _loaded_names_in(node.value)
+            stored = set(n.id for target in node.targets 
+                    for n in ast.walk(target) if isinstance(n, ast.Name) and
+                    isinstance(n.ctx, ast.Store))
+            return node, (live - stored) | _loaded_names_in(node)
+        elif isinstance(node, ast.Expr):
+            if _is_pure(node.value):
+                return None, live
+            return node, live | _loaded_names_in(node)
+        elif isinstance(node, (ast.Return, ast.Raise)):
+            return node, _loaded_names_in(node)
+        elif isinstance(node, ast.Break):
+            return node, set(loop_exits[0])
+        elif isinstance(node, ast.Continue):
+            return node, set(loop_exits[1])
+        elif isinstance(node, ast.Pass):
+            return (None if eliminate else node), live
+        elif isinstance(node, ast.If):
+            node.body, body_live = visit_block(
+                    node.body, live, loop_exits, eliminate)
+            node.orelse, orelse_live = visit_block(
+                    node.orelse, live, loop_exits, eliminate)
+            return node, body_live | orelse_live | \
+                    _loaded_names_in(node.test)
+        elif isinstance(node, (ast.For, ast.While)):
+            _, orelse_live = visit_block(
+                    node.orelse, live, loop_exits, False)
+            if isinstance(node, ast.For):
+                targets = set(n.id for n in ast.walk(node.target)
+                        if isinstance(n, ast.Name))
+                target_loads = _loaded_names_in(node.target)
+            else:
+                targets, target_loads = set(), _loaded_names_in(node.test)
+            head_live = set()
+            while True:
+                _, body_live = visit_block(
+                        node.body, head_live, (live, head_live), False)
+                new_head_live = orelse_live | target_loads | \
+                        (body_live - targets)
+                if new_head_live == head_live:
+                    break
+                head_live = new_head_live
+            if eliminate:
+                node.body, _ = visit_block(
+                        node.body, head_live, (live, head_live), True)
+                node.orelse, _ = visit_block(
+                        node.orelse, live, loop_exits, True)
+            if isinstance(node, ast.For):
+                return node, head_live | _loaded_names_in(node.iter)
+            return node, head_live
+        else:
+            # try, with, nested functions, etc. - assume that they read
+            # all names they use, and do not assign anything
+            live = live | _loaded_names_in(node)
+            for exit_live in loop_exits:
+                live = live | exit_live
+            return node, live
+
+    fn_def.body, _ = visit_block(fn_def.body, set(), (set(), set()), True)
+    return changed[0]
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+''' Compare specialized functions with globals loaded as constants
+(ast_pe.specializer.CONST_GLOBALS) and with usual global lookups,
+on tight loops. Run from the repository root:
+
+    python benchmarks/const_globals.py
+'''
+
+import sys
+sys.path.append('.')
+import timeit
+
+import ast_pe.specializer
+from ast_pe import specialized_fn
+
+
+def scale(x):
+    return x * 2
+
+
+def weighted_sum(xs, weights):
+    ''' Static weights tuple is not a literal, so it is a binding
+    '''
+    total = 0
+    n = len(weights)
+    for i in xrange(len(xs)):
+        total += weights[i % n] * scale(xs[i])
+    return total
+
+
+def lookup(keys, table):
+    ''' Static table dict is a binding, loaded twice per item
+    '''
+    return [table[key] if key in table else 0 for key in keys]
+
+
+WEIGHTS = (1, 2, 3, 5, 8)
+TABLE = dict((str(i), i) for i in xrange(100))
+XS = range(1000)
+KEYS = [str(i % 150) for i in xrange(1000)]
+
+
+# name -> (function, static kwargs, dynamic args)
+CASES = {
+        'weighted_sum': (weighted_sum, dict(weights=WEIGHTS), (XS, )),
+        'lookup': (lookup, dict(table=TABLE), (KEYS, )),
+        }
+
+
+def best_times(fns, number, repeat=15):
+    ''' Measurements are interleaved, so that changes of machine load
+    affect all fns
+    '''
+    times = [[] for _ in fns]
+    for _ in xrange(repeat):
+        for fn_times, fn in zip(times, fns):
+            fn_times.append(timeit.timeit(fn, number=number) / number)
+    return [min(fn_times) for fn_times in times]
+
+
+def specialized(fn, static_kwargs, const_globals):
+    saved = ast_pe.specializer.CONST_GLOBALS
+    ast_pe.specializer.CONST_GLOBALS = const_globals
+    try:
+        return specialized_fn(fn, globals(), {}, **static_kwargs)
+    finally:
+        ast_pe.specializer.CONST_GLOBALS = saved
+
+
+def main():
+    print '%15s %12s %12s %8s' % (
+            'case', 'globals, us', 'consts, us', 'speedup')
+    for name, (fn, static_kwargs, args) in sorted(CASES.items()):
+        with_globals = specialized(fn, static_kwargs, False)
+        with_consts = specialized(fn, static_kwargs, True)
+        assert with_globals(*args) == with_consts(*args)
+        globals_time, consts_time = best_times([
+            lambda : with_globals(*args),
+            lambda : with_consts(*args)], number=200)
+        print '%15s %12.2f %12.2f %8.2f' % (name, globals_time * 1e6,
+                consts_time * 1e6, globals_time / consts_time)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+''' Measure time to specialize, size of specialized AST and speedup
+of specialized functions over generic ones on representative cases.
+Results are compared with the stored baseline, and the script exits
+with non-zero status on regressions. Run from the repository root:
+
+    python benchmarks/suite.py [--output results.json] [--update-baseline]
+
+Specialization time is divided by the time of a fixed calibration loop,
+so that baselines are roughly comparable between machines.
+'''
+
+import sys
+sys.path.append('.')
+import os
+import ast
+import json
+import time
+import timeit
+import argparse
+
+from ast_pe import specialized_fn
+from ast_pe.specializer import specialized_ast
+from ast_pe.decorators import inline
+from ast_pe.utils import fn_to_ast
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# relative changes, that are considered regressions
+TOLERANCE = dict(
+        speedup=0.25, ast_nodes=0.1, specialize_time=1.0)
+
+
+@inline
+def power(x, n):
+    if not isinstance(n, int) or n < 0:
+        raise ValueError('Base should be a positive integer')
+    elif n == 0:
+        return 1
+    elif n % 2 == 0:
+        v = power(x, n / 2)
+        return v * v
+    else:
+        return x * power(x, n - 1)
+
+
+def stupid_power(x, n):
+    # the same as in tests/test_optimizer.py
+    if not isinstance(n, int) or n < 0:
+        raise ValueError('Base should be a positive integer')
+    else:
+        if n == 0:
+            return 1
+        if n == 1:
+            return x
+        v = 1
+        for _ in range(n):
+            v *= x
+        return v
+
+
+def interpret(x, program):
+    ''' Stack machine: program is a tuple of (opcode, argument) pairs
+    '''
+    stack = [x]
+    for opcode, arg in program:
+        if opcode == 'push':
+            stack.append(arg)
+        elif opcode == 'dup':
+            stack.append(stack[-1])
+        elif opcode == 'add':
+            b, a = stack.pop(), stack.pop()
+            stack.append(a + b)
+        elif opcode == 'mul':
+            b, a = stack.pop(), stack.pop()
+            stack.append(a * b)
+    return stack.pop()
+
+
+PROGRAM = (('dup', None), ('mul', None), ('push', 3), ('add', None),
+        ('dup', None), ('push', 2), ('mul', None), ('add', None))
+
+
+def render(row, columns):
+    ''' Render row according to a table of (name, width, align) columns
+    '''
+    parts = []
+    for name, width, align in columns:
+        value = str(row[name])
+        if align == 'left':
+            parts.append(value.ljust(width))
+        elif align == 'right':
+            parts.append(value.rjust(width))
+        else:
+            parts.append(value.center(width))
+    return '|'.join(parts)
+
+
+COLUMNS = (('id', 6, 'right'), ('name', 12, 'left'),
+        ('score', 8, 'right'), ('status', 10, 'center'))
+
+
+def run_bytecode(x, code):
+    ''' Bytecode interpreter with a program counter, code is a tuple
+    of (opcode, argument) pairs
+    '''
+    pc = 0
+    while pc < len(code):
+        op, arg = code[pc]
+        pc += 1
+        if op == 'add':
+            x = x + arg
+        elif op == 'mul':
+            x = x * arg
+        elif op == 'jmp':
+            pc = arg
+        elif op == 'ret':
+            return x
+    return x
+
+
+BYTECODE = (('add', 1), ('mul', 3), ('jmp', 4), ('mul', 100),
+        ('add', 2), ('mul', 2), ('add', 7), ('ret', None))
+
+
+# name -> (function, static kwargs, dynamic args)
+CASES = {
+        'power': (power, dict(n=27), (1.0001, )),
+        'stupid_power': (stupid_power, dict(n=10), (1.0001, )),
+        'interpreter': (interpret, dict(program=PROGRAM), (7, )),
+        'bytecode': (run_bytecode, dict(code=BYTECODE), (7, )),
+        'table': (render, dict(columns=COLUMNS),
+            (dict(id=1, name='foo', score=2.5, status='ok'), )),
+        }
+
+
+def calibrate():
+    ''' Time of a fixed pure python workload
+    '''
+    def workload():
+        d = {}
+        for i in xrange(10000):
+            d[i % 100] = d.get(i % 100, 0) + i
+        return d
+    return min(timeit.repeat(workload, number=10, repeat=5))
+
+
+def best_time(fn, number, repeat=5):
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+
+def best_times(fns, number, repeat=15):
+    ''' Like best_time for each of fns, but measurements are interleaved,
+    so that changes of machine load affect all of them
+    '''
+    times = [[] for _ in fns]
+    for _ in xrange(repeat):
+        for fn_times, fn in zip(times, fns):
+            fn_times.append(timeit.timeit(fn, number=number) / number)
+    return [min(fn_times) for fn_times in times]
+
+
+def measure(fn, static_kwargs, args):
+    env = globals()
+    specialize_time = best_time(
+            lambda : specialized_fn(fn, env, {}, **static_kwargs), number=3)
+    tree, _ = specialized_ast(fn_to_ast(fn), dict(env), **static_kwargs)
+    specialized = specialized_fn(fn, env, {}, **static_kwargs)
+    assert specialized(*args) == fn(*args, **static_kwargs)
+    generic_time, specialized_time = best_times([
+        lambda : fn(*args, **static_kwargs),
+        lambda : specialized(*args)], number=5000)
+    return dict(
+            specialize_time=specialize_time,
+            ast_nodes=sum(1 for _ in ast.walk(tree)),
+            generic_time=generic_time,
+            specialized_time=specialized_time,
+            speedup=generic_time / specialized_time)
+
+
+def run():
+    calibration = calibrate()
+    results = {}
+    for name, (fn, static_kwargs, args) in sorted(CASES.items()):
+        result = measure(fn, static_kwargs, args)
+        result['specialize_time'] /= calibration
+        results[name] = result
+    return dict(python=sys.version.split()[0], time=time.time(),
+            calibration=calibration, results=results)
+
+
+def regressions(results, baseline):
+    ''' Return a list of messages about regressions
+    '''
+    messages = []
+    for name, expected in sorted(baseline['results'].items()):
+        got = results['results'].get(name)
+        if got is None:
+            messages.append('%s: missing' % name)
+            continue
+        for key, tolerance in sorted(TOLERANCE.items()):
+            if key == 'speedup':
+                regressed = got[key] < expected[key] * (1 - tolerance)
+            else:
+                regressed = got[key] > expected[key] * (1 + tolerance)
+            if regressed:
+                messages.append('%s: %s %.3g, baseline %.3g' % (
+                    name, key, got[key], expected[key]))
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--output', help='save results as JSON')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+
+    results = run()
+    print '%15s %12s %10s %12s %12s %8s' % ('case', 'specialize',
+            'ast nodes', 'generic, us', 'special, us', 'speedup')
+    for name, r in sorted(results['results'].items()):
+        print '%15s %12.3f %10d %12.2f %12.2f %8.2f' % (name,
+                r['specialize_time'], r['ast_nodes'],
+                r['generic_time'] * 1e6, r['specialized_time'] * 1e6,
+                r['speedup'])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            messages = regressions(results, json.load(f))
+        if messages:
+            print '\nREGRESSIONS:\n' + '\n'.join(messages)
+            sys.exit(1)
+        print '\nno regressions against %s' % args.baseline
+
+
+if __name__ == '__main__':
+    main()
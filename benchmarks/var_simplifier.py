@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+''' Time remove_assignments and simplify_function on inlined-like bodies
+of growing size, time per statement should stay roughly constant.
+'''
+
+import sys
+sys.path.append('.')
+import ast
+import timeit
+
+from ast_pe.utils import copy_ast
+from ast_pe.var_simplifier import remove_assignments, simplify_function
+
+
+def inlined_body(n):
+    ''' A body of n * 3 statements, similar to what inlining produces:
+    argument copies, temporaries and their uses.
+    '''
+    lines = []
+    for i in xrange(n):
+        lines.append('__ast_pe_var_%d = x' % (3 * i))
+        lines.append('__ast_pe_var_%d = __ast_pe_var_%d * %d' % 
+                (3 * i + 1, 3 * i, i))
+        lines.append('__ast_pe_var_%d = __ast_pe_var_%d' % 
+                (3 * i + 2, 3 * i + 1))
+    return ast.parse('\n'.join(lines)).body
+
+
+def inlined_fn(n):
+    ''' A function with inlined_body(n), returning the last variable
+    '''
+    fn_def = ast.parse('def f(x):\n    return __ast_pe_var_%d' % (3 * n - 1)
+            ).body[0]
+    fn_def.body[:0] = inlined_body(n)
+    return fn_def
+
+
+def main():
+    print 'remove_assignments'
+    print '%10s %12s %16s' % ('statements', 'total, ms', 'per stmt, us')
+    for n in (300, 1000, 3000, 10000):
+        body = inlined_body(n)
+        t = min(timeit.repeat(
+            lambda : remove_assignments(list(body)), number=1, repeat=3))
+        print '%10d %12.1f %16.2f' % (len(body), t * 1e3, t * 1e6 / len(body))
+    print 'simplify_function'
+    print '%10s %12s %16s' % ('statements', 'total, ms', 'per stmt, us')
+    for n in (300, 1000, 3000):
+        fn_def = inlined_fn(n)
+        copies = [copy_ast(fn_def) for _ in xrange(3)]
+        t = min(timeit.repeat(
+            lambda : simplify_function(copies.pop()), number=1, repeat=3))
+        print '%10d %12.1f %16.2f' % (len(fn_def.body), t * 1e3, 
+                t * 1e6 / len(fn_def.body))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# -*- encoding: utf-8 -*-
+
+import unittest
+
+from ast_pe.batch import specialize_many
+
+
+def power(x, n):
+    v = 1
+    for _ in xrange(n):
+        v *= x
+    return v
+
+
+def scaled(items, x, scale):
+    if scale:
+        return [item * x * scale for item in items]
+
+
+def apply_fn(f, x):
+    return f(x)
+
+
+def ident(x, cfg):
+    return cfg
+
+
+def first(x, table):
+    return table[0]
+
+
+class Config(object):
+    pass
+
+
+class BadBool(object):
+    def __nonzero__(self):
+        raise ValueError('no truth value')
+
+
+class TestSpecializeMany(unittest.TestCase):
+    def test_pool(self):
+        result = specialize_many(power, globals(), locals(), 'n', range(10),
+                processes=2)
+        self.assertEqual(sorted(result), range(10))
+        self.assertEqual(sorted(result.timings), range(10))
+        self.assertEqual(result.errors, {})
+        for n, fn in result.items():
+            self.assertEqual(fn(3), 3 ** n)
+
+    def test_names_and_errors(self):
+        bad = BadBool()
+        result = specialize_many(scaled, globals(), locals(), 
+                ['items', 'scale'], [((1, 2), 2), ((3, ), 0), ((), bad)])
+        self.assertEqual(result[(1, 2), 2](3), [6, 12])
+        self.assertEqual(result[(3, ), 0](3), None)
+        self.assertNotIn(((), bad), result)
+        self.assertIsInstance(result.errors[(), bad], ValueError)
+        self.assertEqual(len(result.timings), 3)
+
+    def test_not_picklable(self):
+        neg = lambda x: -x
+        result = specialize_many(apply_fn, globals(), locals(),
+                'f', [abs, neg], processes=2)
+        self.assertEqual(result[abs](-1), 1)
+        self.assertEqual(result[neg](1), -1)
+
+    def test_identity(self):
+        # specialized functions use static values, not their copies
+        configs = [Config(), Config()]
+        result = specialize_many(ident, globals(), locals(), 'cfg', configs,
+                processes=2)
+        for cfg in configs:
+            self.assertIs(result[cfg](0), cfg)
+        tables = [(Config(), ), (Config(), )]
+        result = specialize_many(first, globals(), locals(), 'table', tables,
+                processes=2)
+        for table in tables:
+            self.assertIs(result[table](0), table[0])
+
+    def test_unhashable(self):
+        # results are keyed by indices of values
+        result = specialize_many(scaled, globals(), locals(),
+                ['items', 'scale'], [([1, 2], 2), ([3], BadBool())],
+                processes=2)
+        self.assertEqual(result[0](3), [6, 12])
+        self.assertNotIn(1, result)
+        self.assertIsInstance(result.errors[1], ValueError)
+        self.assertEqual(sorted(result.timings), [0, 1])
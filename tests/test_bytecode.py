@@ -0,0 +1,46 @@
+# -*- encoding: utf-8 -*-
+
+import ast
+import unittest
+
+from ast_pe.bytecode import const_globals, LOAD_GLOBAL, _code_objects, \
+        _instructions
+from ast_pe.utils import compile_ast, eval_code
+
+
+class TestConstGlobals(unittest.TestCase):
+    def _fn(self, source, fn_globals, values):
+        code_object = compile_ast(ast.parse(source))
+        return eval_code(const_globals(code_object, values), fn_globals)
+
+    def _loaded_globals(self, fn):
+        return set(code.co_names[arg]
+                for code in _code_objects(fn.__code__)
+                for op, arg in _instructions(code) if op == LOAD_GLOBAL)
+
+    def test_const_globals(self):
+        fn_globals = dict(a=[1, 2], b=10)
+        fn = self._fn('def f(x):\n    return len(a) + b + x',
+                fn_globals, fn_globals)
+        self.assertEqual(fn(1), 13)
+        self.assertEqual(self._loaded_globals(fn), set(['len']))
+        # values are bound, globals are not looked up any more
+        fn_globals['b'] = 20
+        self.assertEqual(fn(1), 13)
+
+    def test_nested(self):
+        fn_globals = dict(a=2, b=3)
+        fn = self._fn(
+                'def f(x):\n    return lambda : [x * a for _ in range(b)]',
+                fn_globals, dict(a=2))
+        self.assertEqual(fn(2)(), [4, 4, 4])
+        self.assertEqual(self._loaded_globals(fn), set(['b', 'range']))
+
+    def test_assigned_globals(self):
+        fn_globals = dict(a=1)
+        fn = self._fn(
+                'def f():\n    global a\n    a += 1\n    return a',
+                fn_globals, fn_globals)
+        self.assertEqual(fn(), 2)
+        self.assertEqual(fn(), 3)
+        self.assertEqual(self._loaded_globals(fn), set(['a']))
@@ -0,0 +1,27 @@
+# -*- encoding: utf-8 -*-
+
+import unittest
+
+from ast_pe.cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1) # 'b' is now least recently used
+        cache.put('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_put_keeps_existing(self):
+        cache = LRUCache()
+        self.assertEqual(cache.put('a', 1), 1)
+        self.assertEqual(cache.put('a', 2), 1)
+
+    def test_unhashable(self):
+        cache = LRUCache()
+        self.assertRaises(TypeError, cache.get, [1])
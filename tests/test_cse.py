@@ -0,0 +1,182 @@
+# -*- encoding: utf-8 -*-
+
+import ast
+
+from ast_pe.utils import BaseTestCase, shift_source
+from ast_pe.cse import eliminate_common_subexpressions
+from ast_pe.optimizer import optimized_ast
+from ast_pe.specializer import specialized_fn
+from ast_pe.decorators import inline
+
+
+class TestEliminateCommonSubexpressions(BaseTestCase):
+    def _test_cse(self, source, expected_source, pure_names=('len', )):
+        tree = ast.parse(shift_source(source))
+        var_names = ('tmp_%d' % i for i in xrange(1, 100))
+        eliminate_common_subexpressions(tree.body[0],
+                lambda node: node.func.id in pure_names, var_names.next,
+                lambda node: node.func.id == 'len')
+        self.assertASTEqual(tree, ast.parse(shift_source(expected_source)))
+
+    def test_assigned(self):
+        self._test_cse(
+                '''
+                def f(x, y):
+                    a = x * y + 1
+                    b = len(x) * 2 + 1
+                    return (x * y + 1, len(x) * 2 + 1)
+                ''',
+                '''
+                def f(x, y):
+                    a = x * y + 1
+                    b = len(x) * 2 + 1
+                    return (x * y + 1, b)
+                ''')
+
+    def test_hoisted(self):
+        self._test_cse(
+                '''
+                def f(p, xs):
+                    a = (len(xs) + p.x, p.x)
+                    if len(xs) > 2:
+                        return p.x * 2
+                ''',
+                '''
+                def f(p, xs):
+                    tmp_1 = len(xs)
+                    tmp_2 = p.x
+                    a = (tmp_1 + tmp_2, tmp_2)
+                    if tmp_1 > 2:
+                        return tmp_2 * 2
+                ''')
+
+    def test_reassigned(self):
+        self._test_cse(
+                '''
+                def f(x, y):
+                    a = x in y
+                    x = 2
+                    b = x in y
+                    a = a in y
+                    return x in y, a in y
+                ''',
+                '''
+                def f(x, y):
+                    a = x in y
+                    x = 2
+                    b = x in y
+                    a = a in y
+                    return b, a in y
+                ''')
+
+    def test_side_effects(self):
+        # foo can change p.x and globals, and objects held by locals
+        source = '''
+                def f(p, x):
+                    a = len(p.x) + 1
+                    b = len(x) + g
+                    c = x is None
+                    foo(p)
+                    return len(p.x) + 1, len(x) + g, x is None
+                '''
+        self._test_cse(source, source)
+        # and values are not reused in statements with side effects
+        source = '''
+                def f(x):
+                    a = len(x) + 1
+                    return foo(len(x) + 1)
+                '''
+        self._test_cse(source, source)
+
+    def test_mutable_results(self):
+        # results of operators and slices can be new mutable objects
+        source = '''
+                def f(xs, ys):
+                    a = xs + ys
+                    b = xs + ys
+                    c = xs[1:]
+                    d = xs[1:]
+                    return a, b, c, d
+                '''
+        self._test_cse(source, source)
+
+    def test_specialized(self):
+        def appended_arg(xs, ys, k):
+            a = xs + ys
+            xs.append(k)
+            return a, xs + ys
+        def appended_result(xs, ys, k):
+            a = xs + ys
+            a.append(k)
+            b = xs + ys
+            return b
+        for fn in (appended_arg, appended_result):
+            self.assertEqual(
+                    specialized_fn(fn, globals(), locals(), k=3)([1], [2]),
+                    fn([1], [2], 3))
+
+    def test_impure_call(self):
+        self._test_cse(
+                '''
+                def f(xs):
+                    a = foo(xs)
+                    return foo(xs)
+                ''',
+                '''
+                def f(xs):
+                    a = foo(xs)
+                    return foo(xs)
+                ''')
+
+    def test_conditional(self):
+        # expressions are not moved out of conditions and branches
+        self._test_cse(
+                '''
+                def f(x, y):
+                    if y and x * x:
+                        a = x + y
+                    else:
+                        a = x + y
+                    return x * x + (x + y)
+                ''',
+                '''
+                def f(x, y):
+                    if y and x * x:
+                        a = x + y
+                    else:
+                        a = x + y
+                    return x * x + (x + y)
+                ''')
+
+    def test_branches(self):
+        self._test_cse(
+                '''
+                def f(x, y):
+                    a = len(x) * 2
+                    if y:
+                        return len(x) * 2 + 1
+                    while x:
+                        x -= len(x) * 2
+                ''',
+                '''
+                def f(x, y):
+                    a = len(x) * 2
+                    if y:
+                        return a + 1
+                    while x:
+                        x -= len(x) * 2
+                ''')
+
+    def test_optimizer(self):
+        # common work of inlined calls is shared
+        @inline
+        def norm(p):
+            return p.x * p.x + p.y * p.y
+        source = '''
+                def f(p):
+                    return norm(p) - norm(p)
+                '''
+        tree, _ = optimized_ast(
+                ast.parse(shift_source(source)), dict(norm=norm))
+        self.assertEqual(1, sum(1 for n in ast.walk(tree.body[0])
+            if isinstance(n, ast.Attribute) and n.attr == 'x'))
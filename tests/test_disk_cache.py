@@ -0,0 +1,72 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ast_pe.disk_cache import DiskCache
+
+
+SCALE = 2
+
+
+def scaled_sum(items, x):
+    s = 0
+    for item in sorted(items):
+        s += item * x * SCALE
+    return s, sorted(items)
+
+
+def apply_fn(fn, x):
+    return fn(x)
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_load(self):
+        cache = DiskCache(self.path)
+        fn = cache.specialized_fn(scaled_sum, globals(), locals(), (3, 1, 2))
+        self.assertEqual(fn(10), (120, [1, 2, 3]))
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        # new cache instance in the same directory, as after restart
+        cache = DiskCache(self.path)
+        fn = cache.specialized_fn(scaled_sum, globals(), locals(), (3, 1, 2))
+        self.assertEqual(fn(10), (120, [1, 2, 3]))
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+    def test_key(self):
+        global SCALE
+        cache = DiskCache(self.path)
+        cache.specialized_fn(scaled_sum, globals(), locals(), (1, ))
+        cache.specialized_fn(scaled_sum, globals(), locals(), (2, ))
+        cache.specialized_fn(scaled_sum, globals(), locals(), items=(2, ))
+        SCALE = 3
+        try:
+            fn = cache.specialized_fn(scaled_sum, globals(), locals(), (1, ))
+            self.assertEqual(fn(1), (3, [1]))
+        finally:
+            SCALE = 2
+        self.assertEqual(cache.misses, 4)
+
+    def test_fallback(self):
+        cache = DiskCache(self.path)
+        # lambda can not be pickled
+        fn = cache.specialized_fn(apply_fn, globals(), locals(), lambda x: -x)
+        self.assertEqual(fn(1), -1)
+        self.assertEqual(os.listdir(self.path), [])
+        # broken cache entry
+        cache.specialized_fn(scaled_sum, globals(), locals(), (1, ))
+        (filename, ) = os.listdir(self.path)
+        with open(os.path.join(self.path, filename), 'wb') as f:
+            f.write('garbage')
+        fn = cache.specialized_fn(scaled_sum, globals(), locals(), (1, ))
+        self.assertEqual(fn(1), (2, [1]))
+        self.assertEqual(cache.misses, 3)
+        cache.clear()
+        self.assertEqual(os.listdir(self.path), [])
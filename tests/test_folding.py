@@ -0,0 +1,62 @@
+# -*- encoding: utf-8 -*-
+
+import ast
+import unittest
+
+from ast_pe.folding import fold_unary, fold_binary, fold_compare, \
+        fold_subscript, MAX_SIZE, MAX_INT_BITS
+
+
+class TestFolding(unittest.TestCase):
+    def test_unary(self):
+        self.assertEqual(fold_unary(ast.USub(), 2), (True, -2))
+        self.assertEqual(fold_unary(ast.Invert(), 2), (True, -3))
+        self.assertEqual(fold_unary(ast.Not(), []), (True, True))
+        self.assertEqual(fold_unary(ast.USub(), 'a'), (False, None))
+
+    def test_binary(self):
+        self.assertEqual(fold_binary(ast.Add(), 'a', 'b'), (True, 'ab'))
+        self.assertEqual(fold_binary(ast.Add(), (1,), (2,)), (True, (1, 2)))
+        self.assertEqual(fold_binary(ast.Mod(), '%s!', 'a'), (True, 'a!'))
+        self.assertEqual(fold_binary(ast.BitOr(), frozenset([1]), 
+            frozenset([2])), (True, frozenset([1, 2])))
+        # mutable values and exceptions are left to run time
+        self.assertEqual(fold_binary(ast.Add(), [1], [2]), (False, None))
+        self.assertEqual(fold_binary(ast.Div(), 1, 0, False), (False, None))
+
+    def test_division(self):
+        self.assertEqual(fold_binary(ast.Div(), 1, 2, False), (True, 0))
+        self.assertEqual(fold_binary(ast.Div(), 1, 2, True), (True, 0.5))
+        self.assertEqual(fold_binary(ast.Div(), 1, 2), (False, None))
+        self.assertEqual(fold_binary(ast.FloorDiv(), 1, 2), (True, 0))
+
+    def test_size_caps(self):
+        self.assertFalse(fold_binary(ast.Mult(), 'ab', MAX_SIZE)[0])
+        self.assertFalse(fold_binary(ast.Pow(), 2, MAX_INT_BITS + 1)[0])
+        self.assertFalse(fold_binary(ast.LShift(), 1, MAX_INT_BITS)[0])
+        self.assertFalse(fold_binary(ast.Mod(), '%10000d', 1)[0])
+        self.assertEqual(fold_binary(ast.Pow(), -1, 10 ** 10), (True, 1))
+
+    def test_compare(self):
+        self.assertEqual(fold_compare(ast.In(), 'a', 'abc'), (True, True))
+        self.assertEqual(fold_compare(ast.NotIn(), 2, (1, 2)), (True, False))
+        self.assertEqual(fold_compare(ast.In(), 'a', {'a': 1}), (True, True))
+        self.assertEqual(fold_compare(ast.Is(), None, None), (True, True))
+        self.assertEqual(fold_compare(ast.IsNot(), 1, None), (True, True))
+        self.assertEqual(fold_compare(ast.Eq(), int, int), (True, True))
+        # identity of equal immutable values is not known
+        self.assertEqual(fold_compare(ast.Is(), 1000, 1000), (False, None))
+        # user code can be run
+        class Foo(object): pass
+        self.assertEqual(fold_compare(ast.Eq(), Foo(), 1), (False, None))
+        self.assertEqual(fold_compare(ast.In(), 1, [Foo()]), (False, None))
+
+    def test_subscript(self):
+        self.assertEqual(fold_subscript('abc', 1), (True, 'b'))
+        self.assertEqual(fold_subscript({'a': [1]}, 'a'), (True, [1]))
+        self.assertEqual(fold_subscript((1, 2), 2), (False, None))
+        class Foo(object):
+            def __getitem__(self, key):
+                return key
+        self.assertEqual(fold_subscript(Foo(), 1), (False, None))
+        self.assertEqual(fold_subscript({}, Foo()), (False, None))
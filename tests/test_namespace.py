@@ -0,0 +1,55 @@
+# -*- encoding: utf-8 -*-
+
+import ast
+import unittest
+
+from ast_pe.namespace import Namespace, captured_globals
+from ast_pe.utils import compile_ast
+
+
+class TestNamespace(unittest.TestCase):
+    def test_lookup(self):
+        base = dict(a=1, b=2)
+        ns = Namespace(dict(b=3), base)
+        self.assertEqual((ns['a'], ns['b']), (1, 3))
+        self.assertIn('a', ns)
+        self.assertNotIn('c', ns)
+        self.assertRaises(KeyError, lambda : ns['c'])
+        self.assertEqual(ns.get('c', 4), 4)
+
+    def test_changes(self):
+        base = dict(a=1, b=2)
+        ns = Namespace(base)
+        ns['a'] = 10
+        ns['c'] = 3
+        del ns['b']
+        self.assertEqual(ns['a'], 10)
+        self.assertEqual(ns['c'], 3)
+        self.assertNotIn('b', ns)
+        self.assertRaises(KeyError, ns.__delitem__, 'b')
+        self.assertEqual(ns.pop('a'), 10)
+        self.assertEqual(ns.pop('a', None), None)
+        self.assertEqual(ns.changed_names(), set(['a', 'b', 'c']))
+        ns['b'] = 5
+        self.assertEqual(ns['b'], 5)
+        # parents are never modified
+        self.assertEqual(base, dict(a=1, b=2))
+
+    def test_copy(self):
+        base = dict(a=1)
+        ns = Namespace(base)
+        ns['b'] = 2
+        ns_copy = ns.copy()
+        ns_copy['b'] = 3
+        del ns_copy['a']
+        self.assertEqual((ns['a'], ns['b']), (1, 2))
+        self.assertEqual(ns_copy['b'], 3)
+        self.assertNotIn('a', ns_copy)
+        self.assertTrue(ns.same_parents(ns_copy))
+        self.assertFalse(ns.same_parents(Namespace(dict(base))))
+
+    def test_captured_globals(self):
+        code_object = compile_ast(ast.parse('def f(x): return g(x) + a.b'))
+        ns = Namespace(dict(g=len, a=1, c=2, __builtins__={}))
+        self.assertEqual(captured_globals(code_object, ns),
+                dict(g=len, a=1, __builtins__={}))
@@ -1,11 +1,14 @@
 # -*- encoding: utf-8 -*-
 
 import ast
+import time
 
 from ast_pe.utils import BaseTestCase, shift_source, ast_to_string, \
         ast_to_source, fn_to_ast
-from ast_pe.optimizer import optimized_ast
+from ast_pe.optimizer import optimized_ast, pure_call_cache_info, \
+        pure_call_cache_clear, Optimizer
 from ast_pe.decorators import pure_function, inline
+from tests import true_division
 
 
 class BaseOptimizerTestCase(BaseTestCase):
@@ -203,10 +206,21 @@ class TestFnEvaluation(BaseOptimizerTestCase):
                 dict(__ast_pe_var_1=[10, 20.0]))
 
     def test_call_with_starargs(self):
-        pass # TODO
-    
+        @pure_function
+        def fn(x, *args):
+            return x + sum(args)
+        self._test_opt('z = fn(*args)', dict(fn=fn, args=(1, 2, 3)), 'z = 6')
+        self._test_opt('z = fn(1, *args)', dict(fn=fn, args=[2, 3]), 'z = 6')
+        self._test_opt('z = fn(1, *args)', dict(fn=fn), 'z = fn(1, *args)')
+
     def test_call_with_kwargs(self):
-        pass #TODO
+        @pure_function
+        def fn(x, y=2, **kwargs):
+            return x * y + len(kwargs)
+        self._test_opt('z = fn(1, y=3)', dict(fn=fn), 'z = 3')
+        self._test_opt('z = fn(y=3, x=2, w=0)', dict(fn=fn), 'z = 7')
+        self._test_opt('z = fn(1, **kw)', dict(fn=fn, kw=dict(y=5)), 'z = 5')
+        self._test_opt('z = fn(1, y=a)', dict(fn=fn), 'z = fn(1, y=a)')
 
     def test_exception(self):
         ''' Test when called function raises an exception - 
@@ -218,6 +232,62 @@ class TestFnEvaluation(BaseOptimizerTestCase):
         self._test_opt('x = fn()', dict(fn=fn), 'x = fn()')
 
 
+class TestPureCallCache(BaseOptimizerTestCase):
+    ''' Test that results of pure functions are shared by specializations
+    '''
+    def setUp(self):
+        pure_call_cache_clear()
+        self.calls = []
+
+    def _counted(self, result_fn):
+        @pure_function
+        def fn(*args):
+            self.calls.append(args)
+            return result_fn(*args)
+        return fn
+
+    def test_shared(self):
+        fn = self._counted(lambda x, y: x * y)
+        for _ in xrange(3):
+            self._test_opt('z = fn(x, y)', dict(fn=fn, x=2, y=(1, 2)),
+                    'z = __ast_pe_var_1', dict(__ast_pe_var_1=(1, 2, 1, 2)))
+        self.assertEqual(len(self.calls), 1)
+        info = pure_call_cache_info()
+        self.assertEqual((info['hits'], info['misses'], info['size']),
+                (2, 1, 1))
+
+    def test_types_differ(self):
+        fn = self._counted(repr)
+        self._test_opt('z = fn(x)', dict(fn=fn, x=1), 'z = "1"')
+        self._test_opt('z = fn(x)', dict(fn=fn, x=1.0), 'z = "1.0"')
+        self._test_opt('z = fn(x)', dict(fn=fn, x=-0.0), 'z = "-0.0"')
+        self._test_opt('z = fn(x)', dict(fn=fn, x=True), 'z = "True"')
+        self._test_opt('z = fn(x)', dict(fn=fn, x=(1, 2)), 'z = "(1, 2)"')
+        self._test_opt('z = fn(x)', dict(fn=fn, x=(1L, 2L)),
+                'z = "(1L, 2L)"')
+        self._test_opt('z = fn(x)', dict(fn=fn, x=(1, 2.0)),
+                'z = "(1, 2.0)"')
+        self.assertEqual(len(self.calls), 7)
+
+    def test_not_cached(self):
+        fn = self._counted(lambda x: [x])
+        for _ in xrange(2):
+            self._test_opt('z = fn(1)', dict(fn=fn), 'z = __ast_pe_var_1')
+        fn = self._counted(len)
+        for _ in xrange(2):
+            self._test_opt('z = fn(x)', dict(fn=fn, x=[1]), 'z = 1')
+        self.assertEqual(len(self.calls), 4)
+        self.assertEqual(pure_call_cache_info()['size'], 0)
+
+    def test_identity(self):
+        # equal values can be different objects
+        a, b = (1, 2, 3000), tuple([1, 2, 3000])
+        for value in (a, b):
+            new_ast, _ = optimized_ast(ast.parse('id(v)'), dict(v=value))
+            self.assertEqual(new_ast.body[0].value.n, id(value))
+        self.assertEqual(pure_call_cache_info()['size'], 0)
+
+
 class TestBuiltinsEvaluation(BaseOptimizerTestCase):
     ''' Test that we can evaluate builtins
     '''
@@ -232,6 +302,11 @@ class TestUnaryOp(BaseOptimizerTestCase):
         self._test_opt('not 1', dict(), 'False')
         self._test_opt('not False', dict(), 'True')
 
+    def test_arithmetic(self):
+        self._test_opt('-x', dict(x=2), '-2')
+        self._test_opt('~x', dict(x=2), '-3')
+        self._test_opt('-x', dict(x='a'), '-"a"')
+
 
 class TestBoolOp(BaseOptimizerTestCase):
     def test_and(self):
@@ -309,6 +384,18 @@ class Testcompare(BaseOptimizerTestCase):
         self._test_opt('a < b >= c', dict(a=0, b=1, c=1), 'True')
         self._test_opt('a <= b > c', dict(a=0, b=1, c=1), 'False')
 
+    def test_partially_known(self):
+        self._test_opt('a < b < c', dict(a=0, b=1), '1 < c')
+        self._test_opt('a > b < c', dict(a=0, b=1), 'False')
+
+    def test_in_is(self):
+        self._test_opt('x in (1, 2)', dict(x=2), 'True')
+        self._test_opt('x not in "abc"', dict(x='d'), 'True')
+        self._test_opt('x in d', dict(x='a', d={'a': 1}), 'True')
+        self._test_opt('x is None', dict(x=None), 'True')
+        self._test_opt('x is not None', dict(x=object()), 'True')
+        self._test_opt('x is y', dict(x=1000, y=1000), '1000 is 1000')
+
 
 class TestRemoveDeadCode(BaseOptimizerTestCase):
     def test_remove_pass(self):
@@ -412,11 +499,452 @@ class TestFunctional(BaseOptimizerTestCase):
         self._test_opt(source, dict(n=2), '''
         def fn(x, n):
             v = 1
-            for _ in __ast_pe_var_1:
-                v *= x
+            v *= x
+            v *= x
+            _ = 1
             return v
-            ''',
-            dict(__ast_pe_var_1=range(2)))
+            ''')
+
+
+class TestLoopUnrolling(BaseOptimizerTestCase):
+    def test_unroll(self):
+        self._test_opt(
+                '''
+                for i in range(n):
+                    x = f(x, i * 2)
+                ''',
+                dict(n=3),
+                '''
+                x = f(x, 0)
+                x = f(x, 2)
+                x = f(x, 4)
+                i = 2
+                ''')
+        self._test_opt(
+                '''
+                for fn in fns:
+                    x = fn(x)
+                ''',
+                dict(fns=(), x=1),
+                'pass')
+
+    def test_unroll_items(self):
+        self._test_opt(
+                '''
+                for name, (a, b) in sorted(d.items()):
+                    print name, a + b
+                ''',
+                dict(d={'x': (1, 2), 'y': (3, 4)}),
+                '''
+                print 'x', 3
+                print 'y', 7
+                name, (a, b) = 'y', (3, 4)
+                ''')
+
+    def test_unroll_iterator(self):
+        self._test_opt(
+                '''
+                for i, c in enumerate(s):
+                    print i, c
+                ''',
+                dict(s='ab'),
+                '''
+                print 0, 'a'
+                print 1, 'b'
+                i, c = 1, 'b'
+                ''')
+
+    def test_break_continue(self):
+        self._test_opt(
+                '''
+                for i in l:
+                    if i == 2:
+                        continue
+                    if i > 3:
+                        break
+                    foo(i)
+                else:
+                    bar()
+                ''',
+                dict(l=[1, 2, 3, 4, 5]),
+                '''
+                foo(1)
+                foo(3)
+                i = 4
+                ''')
+        self._test_opt(
+                '''
+                for i in l:
+                    if i > 3:
+                        break
+                    foo(i)
+                else:
+                    bar()
+                ''',
+                dict(l=[1, 2]),
+                '''
+                foo(1)
+                foo(2)
+                i = 2
+                bar()
+                ''')
+
+    def test_no_unroll(self):
+        # conditional break
+        self._test_opt(
+                '''
+                for i in l:
+                    if x:
+                        break
+                ''',
+                dict(l=[1, 2]),
+                '''
+                for i in l:
+                    if x:
+                        break
+                ''')
+        # late binding of loop variable
+        self._test_opt(
+                '''
+                for i in l:
+                    fns.append(lambda : i)
+                ''',
+                dict(l=(1, 2)))
+        # too many iterations
+        self._test_opt(
+                '''
+                for i in l:
+                    foo(i)
+                ''',
+                dict(l=tuple(range(1000))))
+        # loop variable is reassigned
+        self._test_opt(
+                '''
+                for i in l:
+                    i += 1
+                ''',
+                dict(l=(1, 2)))
+
+
+class TestWhileUnrolling(BaseOptimizerTestCase):
+    def test_interpreter(self):
+        self._test_opt(
+                '''
+                def run(x):
+                    pc = 0
+                    while pc < len(code):
+                        op, arg = code[pc]
+                        pc += 1
+                        if op == 'add':
+                            x = x + arg
+                        elif op == 'jmp':
+                            pc = arg
+                        elif op == 'ret':
+                            return x
+                    return -x
+                ''',
+                dict(code=(('add', 1), ('jmp', 3), ('add', 2), ('ret', 0))),
+                '''
+                def run(x):
+                    pc = 0
+                    (op, arg) = ('add', 1)
+                    pc = 1
+                    x = x + 1
+                    (op, arg) = ('jmp', 3)
+                    pc = 2
+                    pc = 3
+                    (op, arg) = ('ret', 0)
+                    pc = 4
+                    return x
+                ''')
+
+    def test_break_else(self):
+        self._test_opt(
+                '''
+                i = 0
+                while i < 5:
+                    i += 1
+                    if i == n:
+                        break
+                    foo(i)
+                else:
+                    bar()
+                ''',
+                dict(n=2),
+                '''
+                i = 0
+                i = 1
+                foo(1)
+                i = 2
+                ''')
+        self._test_opt(
+                '''
+                while i < 2:
+                    i += 1
+                else:
+                    bar()
+                ''',
+                dict(i=0),
+                '''
+                i = 1
+                i = 2
+                bar()
+                ''')
+
+    def test_no_unroll(self):
+        # unknown test
+        self._test_opt(
+                '''
+                i = 0
+                while i < n:
+                    i += 1
+                ''',
+                {})
+        # state is not known after an iteration
+        self._test_opt(
+                '''
+                i = 0
+                while i < 5:
+                    i = foo(i)
+                ''',
+                {})
+        # conditional break
+        self._test_opt(
+                '''
+                i = 0
+                while i < 5:
+                    i += 1
+                    if x:
+                        break
+                ''',
+                {})
+        # too many iterations
+        self._test_opt(
+                '''
+                i = 0
+                while True:
+                    i += 1
+                ''',
+                {})
+
+    def test_conditional_return(self):
+        ''' Loop, that can exit only by returning, is not unrolled
+        further than the first iteration
+        '''
+        calls = []
+        @pure_function
+        def step(i):
+            calls.append(i)
+            return i + 1
+        pure_call_cache_clear()
+        source = '''
+                def f(x):
+                    i = 0
+                    while True:
+                        i = step(i)
+                        if x[i]:
+                            return i
+                '''
+        self._test_opt(source, dict(step=step), source)
+        self.assertEqual(calls, [0])
+
+    def test_state_restored(self):
+        ''' Nothing is left from iterations of a loop, that is not unrolled
+        '''
+        @inline
+        def double(x):
+            return x * 2
+        report = {}
+        source = '''
+                i = 0
+                while i < 3:
+                    y = double(*x)
+                    i += 1
+                    if y:
+                        break
+                '''
+        new_ast, _ = optimized_ast(ast.parse(shift_source(source)),
+                dict(double=double), report=report)
+        self.assertASTEqual(new_ast, ast.parse(shift_source(source)))
+        self.assertEqual(len(report['not_inlined']), 1)
+
+    def test_unreachable_code(self):
+        ''' Code after break does not change what is known
+        '''
+        self._test_opt(
+                '''
+                i = 0
+                while True:
+                    i = 1
+                    break
+                    i = 2
+                foo(i)
+                ''',
+                {},
+                '''
+                i = 0
+                i = 1
+                foo(1)
+                ''')
+
+
+class TestFlowSensitivity(BaseOptimizerTestCase):
+    ''' Test that values of variables are known only where 
+    they really hold
+    '''
+    def test_assignment(self):
+        self._test_opt(
+                '''
+                x = 1
+                y = x + n
+                x = z
+                foo(x, y)
+                ''',
+                dict(n=2),
+                '''
+                x = 1
+                y = 3
+                x = z
+                foo(x, 3)
+                ''')
+        self._test_opt(
+                '''
+                def fn(x, n):
+                    n -= 1
+                    return x * n
+                ''',
+                dict(n=3),
+                '''
+                def fn(x, n):
+                    n = 2
+                    return x * 2
+                ''')
+
+    def test_if_join(self):
+        self._test_opt(
+                '''
+                if a:
+                    x = 1
+                else:
+                    x = n
+                foo(x)
+                ''',
+                dict(n=1),
+                '''
+                if a:
+                    x = 1
+                else:
+                    x = 1
+                foo(1)
+                ''')
+        self._test_opt(
+                '''
+                if a:
+                    x = 2
+                foo(x)
+                ''',
+                dict(x=1))
+        # terminated branches do not reach the code after "if"
+        self._test_opt(
+                '''
+                if a:
+                    x = 2
+                    return x
+                foo(x)
+                ''',
+                dict(x=1),
+                '''
+                if a:
+                    x = 2
+                    return 2
+                foo(1)
+                ''')
+
+    def test_loops(self):
+        self._test_opt(
+                '''
+                while a:
+                    foo(x)
+                    x = 2
+                    foo(x)
+                foo(x)
+                ''',
+                dict(x=1),
+                '''
+                while a:
+                    foo(x)
+                    x = 2
+                    foo(2)
+                foo(x)
+                ''')
+        self._test_opt(
+                '''
+                for i in l:
+                    x += i
+                foo(x)
+                ''',
+                dict(x=1))
+
+    def test_nested_scopes(self):
+        self._test_opt(
+                '''
+                x = 1
+                fn = lambda : x + y
+                x = 2
+                foo(x, fn)
+                ''',
+                dict(y=1),
+                '''
+                x = 1
+                fn = lambda : x + 1
+                x = 2
+                foo(2, fn)
+                ''')
+        self._test_opt(
+                '''
+                def outer(y):
+                    def fn(x):
+                        return x + y
+                    return fn
+                ''',
+                dict(x=1, y=2),
+                '''
+                def outer(y):
+                    def fn(x):
+                        return x + 2
+                    return fn
+                ''')
+
+    def test_shadowed_builtins(self):
+        self._test_opt(
+                '''
+                len = foo
+                len(s)
+                ''',
+                dict(s='ab'),
+                '''
+                len = foo
+                len('ab')
+                ''')
+
+    def test_dead_code(self):
+        self._test_opt(
+                '''
+                def fn(x):
+                    if x:
+                        return 1
+                    else:
+                        raise ValueError
+                    foo()
+                ''',
+                dict(),
+                '''
+                def fn(x):
+                    if x:
+                        return 1
+                    else:
+                        raise ValueError
+                ''')
 
 
 class TestSimpleMutation(BaseOptimizerTestCase):
@@ -455,10 +983,157 @@ class TestSimpleMutation(BaseOptimizerTestCase):
                 ''',
                 dict(x=object()))
 
+    def test_mutation_via_alias(self):
+        self._test_opt(
+                '''
+                a = x
+                a.foo()
+                if x:
+                    bar()
+                ''',
+                dict(x=object()))
+        self._test_opt(
+                '''
+                a = x[0]
+                a[1] = 2
+                if x:
+                    bar()
+                ''',
+                dict(x=[[1]]))
+
+    def test_mutation_via_store(self):
+        self._test_opt(
+                '''
+                x.foo = 1
+                if x:
+                    bar()
+                ''',
+                dict(x=object()))
+        self._test_opt(
+                '''
+                x += [1]
+                if x:
+                    bar()
+                ''',
+                dict(x=[]))
+
+    def test_immutable_not_mutated(self):
+        self._test_opt(
+                '''
+                foo(x)
+                if x:
+                    bar()
+                ''',
+                dict(x=(1, 'a')),
+                '''
+                foo(x)
+                bar()
+                ''')
+
+    def test_mutation_in_inlined_fn(self):
+        @inline
+        def inlined(y):
+            y.append(1)
+            return y
+        self._test_opt(
+                '''
+                def fn():
+                    a = inlined(x)
+                    if x:
+                        bar()
+                ''',
+                dict(x=[], inlined=inlined),
+                '''
+                def fn():
+                    x.append(1)
+                    a = x
+                    if x:
+                        bar()
+                ''')
+
+    def test_single_pass(self):
+        report = {}
+        optimized_ast(ast.parse(shift_source('''
+            x.foo()
+            y.bar(z)
+            if x or y or z:
+                bar()
+            ''')), dict(x=object(), y=object(), z=object()), report=report)
+        self.assertEqual(report['passes'], 1)
+
     def test_leave_fn(self):
         pass # TODO
 
 
+class TestSubscript(BaseOptimizerTestCase):
+    def test_subscript(self):
+        self._test_opt('x[1] + y["a"]', dict(x=(1, 2), y={'a': 3}), '5')
+        self._test_opt('x[i]', dict(x=(1, 2)))
+        self._test_opt('x[5]', dict(x=(1, 2)))
+        self._test_opt(
+                'x[0]', dict(x=[(1, [2])]),
+                '__ast_pe_var_1',
+                dict(__ast_pe_var_1=(1, [2])))
+
+
+class TestFrozenAttrs(BaseOptimizerTestCase):
+    def _test_frozen(self, source, obj, attrs, expected_source):
+        new_ast, _ = optimized_ast(ast.parse(shift_source(source)), {},
+                frozen_attrs=dict(self=(obj, frozenset(attrs))))
+        self.assertASTEqual(new_ast, ast.parse(shift_source(expected_source)))
+
+    def test_attributes(self):
+        class Rule(object):
+            def __init__(self):
+                self.op, self.threshold, self.count = 'gt', 10, 0
+        self._test_frozen(
+                '''
+                def check(self, x):
+                    self.count += 1
+                    if self.op == 'gt':
+                        return x > self.threshold
+                    return x < self.threshold
+                ''', Rule(), ['op', 'threshold', 'count'],
+                '''
+                def check(self, x):
+                    self.count += 1
+                    return x > 10
+                ''')
+
+    def test_reassigned(self):
+        class Rule(object):
+            threshold = 10
+        self._test_frozen(
+                '''
+                def check(self, x):
+                    self = other
+                    return x > self.threshold
+                ''', Rule(), ['threshold'],
+                '''
+                def check(self, x):
+                    self = other
+                    return x > self.threshold
+                ''')
+
+    def test_inline_methods(self):
+        class Rule(object):
+            threshold = 10
+            @inline
+            def limit(self):
+                return self.threshold * 2
+            def other(self):
+                return 1
+        self._test_frozen(
+                '''
+                def check(self, x):
+                    return x > self.limit() + self.other()
+                ''', Rule(), ['threshold'],
+                '''
+                def check(self, x):
+                    return x > 20 + self.other()
+                ''')
+
+
 class TestBinaryArithmetic(BaseOptimizerTestCase):
     def test_opt(self):
         self._test_opt('1 + 1', {}, '2')
@@ -467,6 +1142,25 @@ class TestBinaryArithmetic(BaseOptimizerTestCase):
         self._test_opt('1 / 2.0', {}, '0.5')
         self._test_opt('3 % 2', {}, '1')
         self._test_opt('x / y', dict(x=1, y=2.0), '0.5')
+        self._test_opt('1 / 0', {})
+
+    def test_division(self):
+        self._test_opt('from __future__ import division\nx = 1 / 2', {},
+                'from __future__ import division\nx = 0.5')
+        for true_division, expected_source in (
+                (True, 'x = 0.5'), (None, 'x = 1 / 2')):
+            new_ast, _ = optimized_ast(ast.parse('x = 1 / 2'), {},
+                    true_division=true_division)
+            self.assertASTEqual(new_ast, ast.parse(expected_source))
+
+    def test_strings_and_tuples(self):
+        self._test_opt('x + "b" * 2', dict(x='a'), '"abb"')
+        self._test_opt('"%s-%d" % (x, n)', dict(x='a', n=1), '"a-1"')
+        self._test_opt(
+                'x + (n,)', dict(x=(1,), n=2),
+                '__ast_pe_var_1',
+                dict(__ast_pe_var_1=(1, 2)))
+        self._test_opt('x * n', dict(x='ab', n=10 ** 6), '"ab" * 1000000')
 
     def test_no_opt(self):
         class NaN(object):
@@ -535,24 +1229,303 @@ class TestInlining(BaseOptimizerTestCase):
                     if a:
                         b = a * 10
                         __ast_pe_var_1 = x - 3
-                        __ast_pe_var_5 = True
-                        while __ast_pe_var_5:
-                            __ast_pe_var_5 = False
-                            __ast_pe_var_2 = []
-                            for __ast_pe_var_3 in iter(__ast_pe_var_1):
-                                __ast_pe_var_2.append(__ast_pe_var_3.do_stuff())
-                            if __ast_pe_var_2:
-                                __ast_pe_var_4 = __ast_pe_var_2
-                                break
-                            else:
-                                __ast_pe_var_4 = None
-                                break
+                        __ast_pe_var_2 = []
+                        for __ast_pe_var_3 in iter(__ast_pe_var_1):
+                            __ast_pe_var_2.append(__ast_pe_var_3.do_stuff())
+                        if __ast_pe_var_2:
+                            __ast_pe_var_4 = __ast_pe_var_2
+                        else:
+                            __ast_pe_var_4 = None
                         a = __ast_pe_var_4 + b
                     return a
                 '''
                 )
 
 
+    def test_early_return(self):
+        @inline
+        def inlined(y):
+            if y is None:
+                return 0
+            y = y + 1
+            if y > 10:
+                raise ValueError
+            return y * 2
+        self._test_opt(
+                '''
+                def outer(x):
+                    return inlined(x)
+                ''',
+                dict(inlined=inlined),
+                '''
+                def outer(x):
+                    __ast_pe_var_1 = x
+                    if __ast_pe_var_1 is None:
+                        __ast_pe_var_2 = 0
+                    else:
+                        __ast_pe_var_1 = __ast_pe_var_1 + 1
+                        if __ast_pe_var_1 > 10:
+                            raise ValueError
+                        __ast_pe_var_2 = __ast_pe_var_1 * 2
+                    return __ast_pe_var_2
+                ''')
+
+    def test_implicit_return(self):
+        @inline
+        def inlined(y):
+            if y:
+                return 1
+        @inline
+        def log(y):
+            y.append(1)
+        self._test_opt(
+                '''
+                def outer(x):
+                    log(x)
+                    return inlined(x)
+                ''',
+                dict(inlined=inlined, log=log),
+                '''
+                def outer(x):
+                    x.append(1)
+                    None
+                    if x:
+                        __ast_pe_var_4 = 1
+                    else:
+                        __ast_pe_var_4 = None
+                    return __ast_pe_var_4
+                ''')
+
+    def test_while_fallback(self):
+        @inline
+        def inlined(y):
+            if y:
+                if y > 1:
+                    return 2
+            else:
+                foo()
+            return 1
+        self._test_opt(
+                '''
+                def outer(x):
+                    return inlined(x)
+                ''',
+                dict(inlined=inlined),
+                '''
+                def outer(x):
+                    __ast_pe_var_3 = True
+                    while __ast_pe_var_3:
+                        __ast_pe_var_3 = False
+                        if x:
+                            if x > 1:
+                                __ast_pe_var_2 = 2
+                                break
+                        else:
+                            foo()
+                        __ast_pe_var_2 = 1
+                        break
+                    return __ast_pe_var_2
+                ''')
+
+    def test_return_from_loop(self):
+        @inline
+        def inlined(y):
+            for i in y:
+                if i:
+                    return i
+            return None
+        self._test_opt(
+                '''
+                def outer(x):
+                    return inlined(x)
+                ''',
+                dict(inlined=inlined))
+
+
+class TestInliningArguments(BaseOptimizerTestCase):
+    ''' Test binding of keyword, default and star arguments when inlining
+    '''
+    def test_keywords_and_defaults(self):
+        @inline
+        def inlined(x, y=2, z=3):
+            return x * y + z
+        self._test_opt(
+                '''
+                def outer(a):
+                    return inlined(a, z=4)
+                ''',
+                dict(inlined=inlined),
+                '''
+                def outer(a):
+                    __ast_pe_var_4 = a * 2 + 4
+                    return __ast_pe_var_4
+                ''')
+        self._test_opt(
+                '''
+                def outer(a, b):
+                    return inlined(z=b, x=a)
+                ''',
+                dict(inlined=inlined),
+                '''
+                def outer(a, b):
+                    __ast_pe_var_4 = a * 2 + b
+                    return __ast_pe_var_4
+                ''')
+
+    def test_star_args(self):
+        @inline
+        def inlined(x, *args, **kwargs):
+            return x + len(args) + len(kwargs)
+        self._test_opt(
+                '''
+                def outer(a, b):
+                    return inlined(a, b, 1, c=b)
+                ''',
+                dict(inlined=inlined),
+                '''
+                def outer(a, b):
+                    __ast_pe_var_2 = (b, 1)
+                    __ast_pe_var_3 = {'c': b}
+                    __ast_pe_var_4 = a + len(__ast_pe_var_2) + \
+                            len(__ast_pe_var_3)
+                    return __ast_pe_var_4
+                ''')
+
+    def test_known_star_args(self):
+        @inline
+        def inlined(x, y):
+            return x - y
+        self._test_opt(
+                '''
+                def outer(a):
+                    return inlined(a, *args) + inlined(**kwargs)
+                ''',
+                dict(inlined=inlined, args=(1, ), kwargs=dict(x=3, y=2)),
+                '''
+                def outer(a):
+                    __ast_pe_var_3 = a - 1
+                    return __ast_pe_var_3 + 1
+                ''')
+
+    def test_unknown_star_args(self):
+        @inline
+        def inlined(x, y):
+            return x - y
+        self._test_opt(
+                '''
+                def outer(a):
+                    return inlined(a, *a)
+                ''',
+                dict(inlined=inlined))
+
+
+class TestInliningBudgets(BaseOptimizerTestCase):
+    ''' Test that calls are left as they are, when inlining budgets
+    are exceeded, and that such calls are reported
+    '''
+    def setUp(self):
+        @inline
+        def count(x, n):
+            if n == 0:
+                return x
+            return count(x + 1, n - 1)
+        self.count = count
+        self.budgets = Optimizer.MAX_INLINE_DEPTH, Optimizer.MAX_INLINED_NODES
+
+    def tearDown(self):
+        Optimizer.MAX_INLINE_DEPTH, Optimizer.MAX_INLINED_NODES = self.budgets
+
+    def _test_report(self, source, constants, expected_source, not_inlined):
+        report = {}
+        new_ast, _ = optimized_ast(ast.parse(shift_source(source)),
+                constants, report=report)
+        self.assertASTEqual(new_ast, ast.parse(shift_source(expected_source)))
+        self.assertEqual(
+                [(r['fn'], r['call'], r['reason'])
+                    for r in report['not_inlined']],
+                not_inlined)
+
+    def test_depth(self):
+        Optimizer.MAX_INLINE_DEPTH = 2
+        self._test_report(
+                '''
+                def f(x):
+                    return count(x, 3)
+                ''',
+                dict(count=self.count),
+                '''
+                def f(x):
+                    __ast_pe_var_4 = x + 1
+                    __ast_pe_var_6 = count(__ast_pe_var_4 + 1, 1)
+                    return __ast_pe_var_6
+                ''',
+                [('count', 'count((__ast_pe_var_4 + 1), 1)', 'depth')])
+
+    def test_size(self):
+        # body of count has 23 nodes before folding
+        Optimizer.MAX_INLINED_NODES = 50
+        self._test_report(
+                '''
+                def f(x):
+                    return count(x, 1) + count(x, 1)
+                ''',
+                dict(count=self.count),
+                '''
+                def f(x):
+                    __ast_pe_var_4 = x + 1
+                    return __ast_pe_var_4 + count(x, 1)
+                ''',
+                [('count', 'count(x, 1)', 'size')])
+
+    def test_exponential_recursion(self):
+        # each inlined call folds to a constant, but there are too many
+        @inline
+        def fib(n):
+            if n < 2:
+                return n
+            return fib(n - 1) + fib(n - 2)
+        report = {}
+        start = time.time()
+        new_ast, bindings = optimized_ast(ast.parse('x = fib(25)'),
+                dict(fib=fib), report=report)
+        self.assertLess(time.time() - start, 5)
+        self.assertTrue(report['not_inlined'])
+        self.assertEqual(set(r['reason'] for r in report['not_inlined']),
+                set(['size']))
+        namespace = dict(bindings, fib=fib)
+        exec compile(ast.fix_missing_locations(new_ast), '<test>', 'exec') \
+                in namespace
+        self.assertEqual(namespace['x'], 75025)
+
+    def test_unknown_recursion(self):
+        # recursion does not stop without known arguments
+        report = {}
+        optimized_ast(ast.parse('count(x, n)'), dict(count=self.count),
+                report=report)
+        self.assertEqual(set(r['reason'] for r in report['not_inlined']),
+                set(['depth']))
+
+    def test_not_inlined(self):
+        @inline
+        def first(items):
+            for item in items:
+                return item
+        self._test_report(
+                'first(x) + count(*x)',
+                dict(first=first, count=self.count),
+                'first(x) + count(*x)',
+                [('first', 'first(x)', 'loop return'),
+                    ('count', 'count(*x)', 'arguments')])
+
+    def test_division(self):
+        # "/" in half is true division, and here it is not
+        self._test_report('y = half(x) + half(1)',
+                dict(half=true_division.half),
+                'y = half(x) + half(1)',
+                [('half', 'half(x)', 'division'),
+                    ('half', 'half(1)', 'division')])
+
+
 class TestRecursionInlining(BaseOptimizerTestCase):
     ''' Recursion inlining test
     '''
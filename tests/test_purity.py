@@ -0,0 +1,186 @@
+# -*- encoding: utf-8 -*-
+
+import ast
+import math
+
+from ast_pe.utils import BaseTestCase, shift_source
+from ast_pe.purity import PurityAnalyzer
+from ast_pe.optimizer import Optimizer, optimized_ast
+from ast_pe.decorators import pure_function
+
+
+COUNTER = [0]
+TABLE = {'a': 1}
+
+
+def square(x):
+    return x * x
+
+
+def hypot(a, b):
+    return math.sqrt(square(a) + square(b))
+
+
+def factorial(n):
+    if n < 0:
+        raise ValueError('negative n')
+    return 1 if n == 0 else n * factorial(n - 1)
+
+
+def squares(n):
+    result = []
+    for i in xrange(n):
+        result.append(square(i))
+    counts = dict()
+    counts[n] = len(result)
+    return result
+
+
+def joined(items):
+    return ', '.join(str(x) for x in sorted(items, key=lambda x: -x))
+
+
+def lookup(key):
+    return TABLE.get(key, 0)
+
+
+def doubled_len(xs):
+    n = len(xs)
+    return n * 2
+
+
+def squared_plus(x):
+    s = square(x)
+    return s + 1
+
+
+def table():
+    return TABLE
+
+
+def updated(key):
+    result = table()
+    result[key] = 1
+    return result
+
+
+def appended(items):
+    items.append(1)
+    return items
+
+
+def increment():
+    global COUNTER
+    COUNTER = [COUNTER[0] + 1]
+
+
+def count():
+    COUNTER[0] += 1
+    return COUNTER[0]
+
+
+def aliased(items):
+    result = items
+    result.append(1)
+
+
+def calls_impure(x):
+    return square(x) + count()
+
+
+def calls_arg(fn, x):
+    return fn(x)
+
+
+def prints(x):
+    print x
+
+
+def generator(n):
+    yield n
+
+
+@pure_function
+def marked(x):
+    print x
+    return x
+
+
+def calls_marked(x):
+    return marked(x) + 1
+
+
+class TestPurityAnalyzer(BaseTestCase):
+    def setUp(self):
+        self.analyzer = PurityAnalyzer(
+                lambda fn: fn in Optimizer.PURE_FUNCTIONS or
+                    getattr(fn, '_ast_pe_is_pure', False) or
+                    fn in (math.sqrt, TABLE.get))
+
+    def test_pure(self):
+        for fn in (square, hypot, factorial, squares, joined, lookup,
+                calls_marked, doubled_len, squared_plus, table):
+            self.assertTrue(self.analyzer.is_pure_fn(fn), fn.__name__)
+
+    def test_impure(self):
+        # results of callees can be mutated only if they are new containers
+        for fn in (appended, increment, count, aliased, calls_impure,
+                calls_arg, prints, generator, updated):
+            self.assertFalse(self.analyzer.is_pure_fn(fn), fn.__name__)
+
+    def test_not_analyzed(self):
+        self.assertFalse(self.analyzer.is_pure_fn(lambda x: x))
+        self.assertFalse(self.analyzer.is_pure_fn(len))
+
+    def test_unknown_callee(self):
+        self.assertFalse(
+                PurityAnalyzer(lambda fn: False).is_pure_fn(hypot))
+
+    def test_closure(self):
+        def outer(impure):
+            def fn(x):
+                return square(x) + impure(x)
+            return fn
+        self.assertTrue(self.analyzer.is_pure_fn(outer(square)))
+        self.assertFalse(self.analyzer.is_pure_fn(outer(appended)))
+
+
+class TestInferredFolding(BaseTestCase):
+    def setUp(self):
+        Optimizer.INFER_PURITY = True
+
+    def tearDown(self):
+        Optimizer.INFER_PURITY = False
+
+    def _test_opt(self, source, constants, expected_source):
+        new_ast, _ = optimized_ast(ast.parse(shift_source(source)), constants)
+        self.assertASTEqual(new_ast, ast.parse(shift_source(expected_source)))
+
+    def test_fold(self):
+        constants = dict(factorial=factorial, joined=joined, n=5)
+        self._test_opt(
+                'x = factorial(n) + len(joined((1, 2)))',
+                constants, 'x = 124')
+
+    def test_mutable_result(self):
+        # a new list for each call can not be shared
+        self._test_opt('x = squares(3)', dict(squares=squares),
+                'x = squares(3)')
+
+    def test_impure(self):
+        self._test_opt('x = calls_impure(2)',
+                dict(calls_impure=calls_impure), 'x = calls_impure(2)')
+
+    def test_disabled(self):
+        Optimizer.INFER_PURITY = False
+        self._test_opt('x = factorial(3)', dict(factorial=factorial),
+                'x = factorial(3)')
+
+
+class TestNotInferredByDefault(BaseTestCase):
+    def test_not_folded(self):
+        # inferred pure functions are not called at specialization time,
+        # unless Optimizer.INFER_PURITY is set
+        new_ast, _ = optimized_ast(ast.parse('x = factorial(3)'),
+                dict(factorial=factorial))
+        self.assertASTEqual(new_ast, ast.parse('x = factorial(3)'))
@@ -3,8 +3,12 @@
 import functools
 
 from ast_pe.utils import BaseTestCase
-from ast_pe.specializer import specialized_fn
+from ast_pe.specializer import specialized_fn, specialized_fn_async, \
+        specialized_method, specialize_on, specialize_hot, code_cache_info, \
+        code_cache_clear
 from ast_pe.decorators import inline
+from ast_pe.bytecode import LOAD_GLOBAL, _instructions
+from tests import true_division
 
 
 class TestSpecializer(BaseTestCase):
@@ -28,6 +32,34 @@ class TestSpecializer(BaseTestCase):
                 specialized_fn(args_kwargs, globals(), locals(), 2, c=4)(6),
                 2.0 / 6 * 4)
 
+    def test_defaults_handling(self):
+        def with_defaults(a, b=2, c=3):
+            return a * b + c
+        self.assertEqual(
+                specialized_fn(with_defaults, globals(), locals(), b=5)(1),
+                8)
+        self.assertEqual(specialized_fn(
+            with_defaults, globals(), locals(), b=5)(1, c=0), 5)
+
+    def test_star_args_handling(self):
+        def star_args(a, *args, **kwargs):
+            return a, args, kwargs
+        fn = specialized_fn(star_args, globals(), locals(), 1, 2, x=3)
+        self.assertEqual(fn(), (1, (2, ), dict(x=3)))
+        self.assertEqual(fn(4, y=5), (1, (2, 4), dict(x=3, y=5)))
+        fn = specialized_fn(star_args, globals(), locals(), a=1)
+        self.assertEqual(fn(2), (1, (2, ), {}))
+
+    def test_bad_static_args(self):
+        def fn(a, b=1):
+            return a + b
+        self.assertRaises(TypeError, specialized_fn,
+                fn, globals(), locals(), 1, 2, 3)
+        self.assertRaises(TypeError, specialized_fn,
+                fn, globals(), locals(), 1, a=2)
+        self.assertRaises(TypeError, specialized_fn,
+                fn, globals(), locals(), c=2)
+
     def test_if_on_stupid_power(self):
         def stupid_power(n, x):
             if not isinstance(n, int) or n < 0:
@@ -63,6 +95,41 @@ class TestSpecializer(BaseTestCase):
                 self._test_partial_fn(power, globals(), locals(),
                         lambda : dict(n=n), lambda : {'x': x })
 
+    def test_deep_recursion(self):
+        @inline
+        def count(x, n):
+            if n == 0:
+                return x
+            return count(x + 1, n - 1)
+        def fn(x, n):
+            return count(x, n)
+        # inlining stops at MAX_INLINE_DEPTH, leaving a regular call
+        self.assertEqual(specialized_fn(fn, globals(), locals(), n=500)(1),
+                501)
+
+    def test_true_division(self):
+        ratio = true_division.ratio
+        self.assertEqual(specialized_fn(ratio, globals(), locals(), 1)(2), 0.5)
+        self.assertEqual(
+                specialized_fn(ratio, globals(), locals(), 1, 2)(), 0.5)
+        half = true_division.half
+        def quarter(x):
+            return half(half(x))
+        self.assertEqual(
+                specialized_fn(quarter, globals(), locals(), 1)(), 0.25)
+
+    def test_reassigned_static_arg(self):
+        def countdown(n, x):
+            n = n + 1
+            while n > 0:
+                x *= 2
+                n -= 1
+            return x, n
+        for n in (0, 1, 3):
+            for x in (0, 1, 2.5):
+                self._test_partial_fn(countdown, globals(), locals(),
+                        lambda : dict(n=n), lambda : {'x': x })
+
     def test_mutation_via_method(self):
         def mutty(x, y):
             x.append('foo')
@@ -70,6 +137,169 @@ class TestSpecializer(BaseTestCase):
         self._test_partial_fn(mutty, globals(), locals(),
                 lambda : dict(x=[1]), lambda : {'y': 2 })
 
+    def test_captured_globals(self):
+        def fn(n, x):
+            return smart_power(n, x) + sum(range(n))
+        globals_ = dict(globals())
+        globals_['unrelated'] = object()
+        specialized = specialized_fn(fn, globals_, {}, n=3)
+        self.assertEqual(specialized(2), 8 + 3)
+        self.assertIs(specialized.func_globals['smart_power'], smart_power)
+        self.assertNotIn('unrelated', specialized.func_globals)
+        self.assertNotIn('BaseTestCase', specialized.func_globals)
+        # bindings of the specialized function do not leak to globals
+        self.assertEqual(set(globals_), set(globals()) | set(['unrelated']))
+
+    def test_shared_code(self):
+        def classify(x, limit):
+            if limit > 10:
+                return x * 2
+            return x + limit
+        code_cache_clear()
+        big = [specialized_fn(classify, globals(), locals(), limit=limit)
+                for limit in (11, 12, 13)]
+        self.assertEqual([fn(1) for fn in big], [2, 2, 2])
+        # the same AST and the same globals
+        self.assertIs(big[0].__code__, big[1].__code__)
+        self.assertIs(big[0].__code__, big[2].__code__)
+        # limit is folded, so the AST is different
+        small = specialized_fn(classify, globals(), locals(), limit=1)
+        self.assertEqual(small(1), 2)
+        self.assertIsNot(small.__code__, big[0].__code__)
+        def tagged(x, tag):
+            return x, tag
+        tags = [object(), object()]
+        fns = [specialized_fn(tagged, globals(), locals(), tag=tag)
+                for tag in tags]
+        self.assertEqual([fn(1) for fn in fns], [(1, tag) for tag in tags])
+        # tag is a different global, so only compiled code is shared
+        self.assertIsNot(fns[0].__code__, fns[1].__code__)
+        info = code_cache_info()
+        self.assertEqual((info['hits'], info['misses'], info['size']),
+                (3, 3, 3))
+
+    def test_const_globals(self):
+        def fn(n, x):
+            return smart_power(n, x) + sum(n * [x])
+        specialized = specialized_fn(fn, globals(), {}, n=3)
+        self.assertEqual(specialized(2), 8 + 6)
+        code = specialized.__code__
+        loaded_globals = set(code.co_names[arg]
+                for op, arg in _instructions(code) if op == LOAD_GLOBAL)
+        # builtins can be changed, so they are still looked up
+        self.assertEqual(loaded_globals, set(['sum']))
+        self.assertIn(smart_power, code.co_consts)
+
+    def test_specialized_method(self):
+        machine = StackMachine((('push', 2), ('mul', None), ('push', 3),
+            ('add', None)), dict(push=1, mul=2, add=3))
+        run = specialized_method(machine.run, ['program', 'opcodes'],
+                globals(), locals())
+        for x in (0, 1, 5):
+            self.assertEqual(run(x), machine.run(x))
+        # program is unrolled, and methods are inlined
+        names = run.__code__.co_names
+        self.assertNotIn('program', names)
+        self.assertNotIn('execute', names)
+        # other attributes are not frozen
+        machine.calls = 10
+        run(1)
+        self.assertEqual(machine.calls, 11)
+        self.assertRaises(TypeError, specialized_method, 
+                StackMachine.run, 'program', globals(), locals())
+
+    def test_specialized_method_assigned_attr(self):
+        class Counter(object):
+            def __init__(self):
+                self.n = 0
+            def incr(self, x):
+                self.n += x
+                return self.n
+        counter = Counter()
+        incr = specialized_method(counter.incr, 'n', globals(), locals())
+        self.assertEqual([incr(1), incr(2)], [1, 3])
+
+    def test_specialize_on(self):
+        for n in (0, 1, 2, 3, 27):
+            self.assertEqual(dispatched_power(2, n), 2 ** n)
+            self.assertEqual(dispatched_power(n=n, x=3), 3 ** n)
+        info = dispatched_power.cache_info()
+        self.assertGreaterEqual(info['hits'], 5)
+        # specialization for 3 must not be used for 3.0
+        self.assertRaises(ValueError, dispatched_power, 2, 3.0)
+        self.assertRaises(ValueError, dispatched_power, 2, -1)
+
+    def test_specialized_fn_async(self):
+        def power(n, x):
+            v = 1
+            for _ in xrange(n):
+                v *= x
+            return v
+        fn = specialized_fn_async(power, globals(), locals(), 3)
+        self.assertEqual(fn(2), 8) # generic or specialized - we don't know
+        self.assertTrue(fn.wait(timeout=10))
+        self.assertEqual(fn(2), 8)
+        self.assertEqual(fn(x=3), 27)
+
+    def test_specialize_on_background(self):
+        @specialize_on('n', globals(), locals(), background=True)
+        def mul(n, x):
+            return x * n
+        self.assertEqual(mul(2, 3), 6)
+        self.assertEqual(mul(x=4, n=2), 8)
+        mul._cache.get(((int, 2),)).wait(timeout=10)
+        self.assertEqual(mul(2, 3), 6)
+        self.assertEqual(mul(x=4, n=2), 8)
+
+    def test_specialize_hot(self):
+        @specialize_hot('n', globals(), locals(), threshold=3)
+        def mul(x, n):
+            return x * n
+        for _ in xrange(2):
+            self.assertEqual(mul(3, 2), 6)
+            self.assertEqual(mul(3, n=4), 12)
+        self.assertEqual(mul.cache_info()['size'], 0)
+        self.assertEqual(mul(3, 2), 6)
+        self.assertEqual(mul.cache_info()['size'], 1)
+        self.assertEqual(mul(3, 2), 6)
+        self.assertEqual(mul.cache_info()['hits'], 1)
+
+    def test_specialize_hot_decay(self):
+        @specialize_hot('n', globals(), locals(), threshold=3,
+                decay_interval=4)
+        def mul(x, n):
+            return x * n
+        for n in xrange(100):
+            self.assertEqual(mul(3, n), 3 * n)
+        self.assertLessEqual(len(mul._counts), 4)
+        for n in [1, 1, 2, 1]: # count of 1 is halved before the last call
+            mul(3, n)
+        self.assertEqual(mul.cache_info()['size'], 0)
+        for _ in xrange(2):
+            mul(3, 1)
+        self.assertEqual(mul.cache_info()['size'], 1)
+
+    def test_specialize_on_cache_size(self):
+        @specialize_on('n', globals(), locals(), cache_size=2)
+        def mul(x, n):
+            return x * n
+        for n in range(5):
+            self.assertEqual(mul(3, n), 3 * n)
+            self.assertEqual(mul(3, n), 3 * n)
+        info = mul.cache_info()
+        self.assertEqual((info['hits'], info['misses'], info['size']), 
+                (5, 5, 2))
+        mul(3, 0)
+        self.assertEqual(mul.cache_info()['misses'], 6)
+
+    def test_specialize_on_unhashable(self):
+        @specialize_on(['items', 'sep'], globals(), locals())
+        def join(items, x, sep=', '):
+            return sep.join(items) + x
+        self.assertEqual(join(('a', 'b'), '!'), 'a, b!')
+        self.assertEqual(join(['a', 'b'], '!', sep='-'), 'a-b!')
+        self.assertEqual(join.cache_info()['size'], 1)
+
     # Utility methods
 
     def _test_partial_fn(self, base_fn, globals_, locals_,
@@ -122,3 +352,42 @@ def smart_power(n, x):
     else:
         return x * smart_power(n - 1, x)
 
+
+@specialize_on('n', globals(), locals())
+@inline
+def dispatched_power(x, n):
+    if not isinstance(n, int) or n < 0:
+        raise ValueError('Base should be a positive integer')
+    elif n == 0:
+        return 1
+    elif n % 2 == 0:
+        v = dispatched_power(x, n / 2)
+        return v * v
+    else:
+        return x * dispatched_power(x, n - 1)
+
+
+class StackMachine(object):
+    def __init__(self, program, opcodes):
+        self.program = program
+        self.opcodes = opcodes
+        self.calls = 0
+
+    def run(self, x):
+        self.calls += 1
+        stack = [x]
+        for opcode, arg in self.program:
+            self.execute(stack, self.opcodes[opcode], arg)
+        return stack.pop()
+
+    @inline
+    def execute(self, stack, opcode, arg):
+        if opcode == 1:
+            stack.append(arg)
+        elif opcode == 2:
+            stack.append(stack.pop() * stack.pop())
+        elif opcode == 3:
+            stack.append(stack.pop() + stack.pop())
+        else:
+            raise ValueError(opcode)
+        return stack
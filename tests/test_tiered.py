@@ -0,0 +1,29 @@
+# -*- encoding: utf-8 -*-
+
+import threading
+import unittest
+
+from ast_pe.tiered import TieredFunction
+
+
+class TestTieredFunction(unittest.TestCase):
+    def test_switch(self):
+        can_finish = threading.Event()
+        def specialize():
+            can_finish.wait()
+            return lambda x: 'fast'
+        fn = TieredFunction(lambda x: 'generic', specialize)
+        self.assertEqual(fn(1), 'generic')
+        self.assertFalse(fn.ready())
+        can_finish.set()
+        self.assertTrue(fn.wait(timeout=10))
+        self.assertEqual(fn(1), 'fast')
+
+    def test_error(self):
+        def specialize():
+            raise ValueError
+        fn = TieredFunction(lambda x: 'generic', specialize)
+        self.assertFalse(fn.wait(timeout=10))
+        self.assertTrue(fn.ready())
+        self.assertIsInstance(fn.error, ValueError)
+        self.assertEqual(fn(1), 'generic')
@@ -0,0 +1,88 @@
+# -*- encoding: utf-8 -*-
+
+import ast
+import logging
+
+from ast_pe.utils import BaseTestCase, shift_source, get_logger
+from ast_pe.optimizer import optimized_ast
+from ast_pe.decorators import inline
+from ast_pe.tracing import Tracer, LoggingTracer, LazyAST
+
+
+class RecordingTracer(Tracer):
+    def __init__(self):
+        self.events = []
+
+    def enter_node(self, node, depth):
+        self.events.append(('enter', type(node).__name__, depth))
+
+    def fold(self, node, value):
+        self.events.append(('fold', type(node).__name__, value))
+
+    def inline(self, call_node, fn):
+        self.events.append(('inline', fn.__name__))
+
+    def not_inlined(self, call_node, fn, reason):
+        self.events.append(('not_inlined', fn.__name__, reason))
+
+
+class TestTracing(BaseTestCase):
+    def test_events(self):
+        @inline
+        def double(x):
+            return x * 2
+        tracer = RecordingTracer()
+        optimized_ast(
+                ast.parse(shift_source('y = double(a) + (1 + n)')),
+                dict(n=1, double=double), tracer=tracer)
+        self.assertEqual(tracer.events[0], ('enter', 'Module', 0))
+        self.assertIn(('enter', 'Assign', 1), tracer.events)
+        self.assertIn(('fold', 'BinOp', 2), tracer.events)
+        self.assertIn(('inline', 'double'), tracer.events)
+
+    def test_not_inlined(self):
+        @inline
+        def double(x):
+            return x * 2
+        tracer = RecordingTracer()
+        optimized_ast(ast.parse('double(*a)'), dict(double=double),
+                tracer=tracer)
+        self.assertIn(('not_inlined', 'double', 'arguments'), tracer.events)
+
+    def test_lazy_formatting(self):
+        formatted = []
+        class CountingAST(LazyAST):
+            def __str__(self):
+                formatted.append(self.node)
+                return super(CountingAST, self).__str__()
+        logger = get_logger('ast_pe.test_tracing', debug=False)
+        logger.debug('%s', CountingAST(ast.parse('a + 1')))
+        self.assertEqual(formatted, [])
+        # events of LoggingTracer are logged, but not formatted
+        messages = []
+        class CountingLogger(logging.Logger):
+            def debug(self, msg, *args, **kwargs):
+                messages.append(msg)
+                super(CountingLogger, self).debug(msg, *args, **kwargs)
+        logger = CountingLogger('ast_pe.test_tracing.counting')
+        logger.setLevel(logging.INFO)
+        original_str = LazyAST.__str__
+        def counting_str(lazy_ast):
+            formatted.append(lazy_ast.node)
+            return original_str(lazy_ast)
+        LazyAST.__str__ = counting_str
+        try:
+            @inline
+            def double(x):
+                return x * 2
+            optimized_ast(ast.parse('y = double(a) + (1 + 1)'),
+                    dict(double=double), tracer=LoggingTracer(logger))
+        finally:
+            LazyAST.__str__ = original_str
+        self.assertTrue(messages)
+        self.assertEqual(formatted, [])
+
+    def test_get_logger_handlers(self):
+        get_logger('ast_pe.test_tracing')
+        logger = get_logger('ast_pe.test_tracing')
+        self.assertEqual(len(logger.handlers), 1)
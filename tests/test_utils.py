@@ -1,6 +1,7 @@
 # -*- encoding: utf-8 -*-
 
 import ast
+import inspect
 from ast import Module, FunctionDef, arguments, Name, Param, If, Compare, \
         Return, BinOp, Load, Add, Subscript, Index, Str, Eq
 import unittest
@@ -21,6 +22,25 @@ class TestCase(unittest.TestCase):
                 "[Return(Subscript(Name('kw', Load()), "
                 "Index(Str('zzz')), Load()))])], [])])")
 
+    def test_fn_to_ast_cache(self):
+        tree = ast_pe.utils.fn_to_ast(sample_fn)
+        tree.body[0].body = []
+        getsource = inspect.getsource
+        inspect.getsource = None # must not be called any more
+        try:
+            fresh_tree = ast_pe.utils.fn_to_ast(sample_fn)
+        finally:
+            inspect.getsource = getsource
+        self.assertIsNot(fresh_tree, tree)
+        self.assertEqual(len(fresh_tree.body[0].body), 1)
+
+    def test_copy_ast(self):
+        tree = ast_pe.utils.fn_to_ast(sample_fn)
+        tree_copy = ast_pe.utils.copy_ast(tree)
+        self.assertTrue(ast_pe.utils.ast_equal(tree, tree_copy))
+        self.assertIsNot(tree.body[0].args, tree_copy.body[0].args)
+        self.assertEqual(tree.body[0].lineno, tree_copy.body[0].lineno)
+
     def test_compare_ast(self):
         tree = ast_pe.utils.fn_to_ast(sample_fn)
         expected_tree = Module([FunctionDef('sample_fn', 
@@ -44,6 +64,15 @@ class TestCase(unittest.TestCase):
                 compiled_fn(3, -9, 'z', zzz=map), 
                 sample_fn(3, -9, 'z', zzz=map))
     
+    def test_ast_key(self):
+        key = lambda source: ast_pe.utils.ast_key(ast.parse(source))
+        self.assertEqual(key('x = (a + 1)'), key('x = a+1\n'))
+        self.assertNotEqual(key('x = a + 1'), key('x = a + 1.0'))
+        self.assertNotEqual(key('x = 0.0'), key('x = -0.0'))
+        self.assertNotEqual(key('x = "a"'), key('x = u"a"'))
+        self.assertNotEqual(key('f(a, b)'), key('f(a)(b)'))
+        self.assertNotEqual(key('[[a], b]'), key('[[a, b]]'))
+
     def test_get_source(self):
         tree = ast_pe.utils.fn_to_ast(sample_fn)
         source = ast_pe.utils.ast_to_source(tree)
@@ -0,0 +1,295 @@
+# -*- encoding: utf-8 -*-
+
+import ast
+
+from ast_pe.utils import BaseTestCase, shift_source
+from ast_pe.var_simplifier import remove_assignments, simplify_function
+
+
+class TestRemoveAssignments(BaseTestCase):
+    def _test_remove(self, source, expected_source):
+        node_list = ast.parse(shift_source(source)).body
+        remove_assignments(node_list)
+        self.assertASTEqual(ast.Module(body=node_list), 
+                ast.parse(shift_source(expected_source)))
+
+    def test_simple(self):
+        self._test_remove(
+                '''
+                a = x
+                b = 1
+                c = a
+                foo(a, b, c)
+                ''',
+                'foo(x, 1, x)')
+
+    def test_not_simple_value(self):
+        self._test_remove(
+                '''
+                a = x + 1
+                b = a
+                foo(b)
+                ''',
+                '''
+                a = x + 1
+                foo(a)
+                ''')
+
+    def test_reassigned(self):
+        self._test_remove(
+                '''
+                a = x
+                if y:
+                    a = 2
+                foo(a)
+                ''',
+                '''
+                a = x
+                if y:
+                    a = 2
+                foo(a)
+                ''')
+
+    def test_value_reassigned(self):
+        self._test_remove(
+                '''
+                a = x
+                x = 2
+                foo(a, x)
+                ''',
+                '''
+                a = x
+                x = 2
+                foo(a, x)
+                ''')
+
+    def test_used_before_assignment(self):
+        self._test_remove(
+                '''
+                foo(a)
+                a = x
+                foo(a)
+                ''',
+                '''
+                foo(a)
+                a = x
+                foo(a)
+                ''')
+
+
+class TestSimplifyFunction(BaseTestCase):
+    def _test_simplify(self, source, expected_source):
+        tree = ast.parse(shift_source(source))
+        simplify_function(tree.body[0])
+        self.assertASTEqual(tree, ast.parse(shift_source(expected_source)))
+
+    def test_copies(self):
+        self._test_simplify(
+                '''
+                def f(x):
+                    a = x
+                    b = 'foo'
+                    if x:
+                        return foo(a, b)
+                    return a
+                ''',
+                '''
+                def f(x):
+                    if x:
+                        return foo(x, 'foo')
+                    return x
+                ''')
+
+    def test_argument_reassigned(self):
+        self._test_simplify(
+                '''
+                def f(x):
+                    a = x
+                    x = foo()
+                    return a, x
+                ''',
+                '''
+                def f(x):
+                    a = x
+                    x = foo()
+                    return a, x
+                ''')
+
+    def test_temporaries(self):
+        self._test_simplify(
+                '''
+                def f(x):
+                    a = x * x
+                    b = x + a
+                    return foo(b)
+                ''',
+                '''
+                def f(x):
+                    return foo(x + x * x)
+                ''')
+
+    def test_temporary_order(self):
+        # bar() can change y, so its value is read before the call
+        self._test_simplify(
+                '''
+                def f(x):
+                    a = y[0]
+                    return bar() + a
+                ''',
+                '''
+                def f(x):
+                    a = y[0]
+                    return bar() + a
+                ''')
+
+    def test_temporary_conditional(self):
+        # foo() must be called, and x / y must raise, whatever flag is
+        for value in ('foo(x)', 'x / y'):
+            for expr in ('flag or a', 'flag and a', 'b if flag else a',
+                    '[a for _ in x]', 'x < flag < a'):
+                source = '''
+                        def f(x, y, flag):
+                            a = %s
+                            return %s
+                        ''' % (value, expr)
+                self._test_simplify(source, source)
+        self._test_simplify(
+                '''
+                def f(x, flag):
+                    a = foo(x)
+                    return a or flag
+                ''',
+                '''
+                def f(x, flag):
+                    return foo(x) or flag
+                ''')
+
+    def test_temporary_after_call(self):
+        # xs.pop() changes the value of xs * 1
+        source = '''
+                def f(xs):
+                    a = xs * 1
+                    return xs.pop(), a
+                '''
+        self._test_simplify(source, source)
+        self._test_simplify(
+                '''
+                def f(xs):
+                    a = xs * 1
+                    return a, xs.pop()
+                ''',
+                '''
+                def f(xs):
+                    return xs * 1, xs.pop()
+                ''')
+
+    def test_dead_stores(self):
+        self._test_simplify(
+                '''
+                def f(x):
+                    pc = 0
+                    (op, arg) = ('add', 1)
+                    pc = 1
+                    x = x + 1
+                    y = foo(x)
+                    'docstring'
+                    return x
+                ''',
+                '''
+                def f(x):
+                    x = x + 1
+                    foo(x)
+                    return x
+                ''')
+
+    def test_loops(self):
+        self._test_simplify(
+                '''
+                def f(x):
+                    total = 0
+                    unused = 0
+                    while x:
+                        if x > 10:
+                            unused = x
+                            break
+                        unused = 1
+                        total += x
+                        x -= 1
+                    else:
+                        return total
+                    return -total
+                ''',
+                '''
+                def f(x):
+                    total = 0
+                    while x:
+                        if x > 10:
+                            break
+                        total += x
+                        x -= 1
+                    else:
+                        return total
+                    return -total
+                ''')
+
+    def test_loop_carried(self):
+        self._test_simplify(
+                '''
+                def f(xs):
+                    last = None
+                    for x in xs:
+                        foo(last)
+                        last = x
+                ''',
+                '''
+                def f(xs):
+                    last = None
+                    for x in xs:
+                        foo(last)
+                        last = x
+                ''')
+
+    def test_nested_scopes(self):
+        self._test_simplify(
+                '''
+                def f(x):
+                    a = x
+                    b = 1
+                    return lambda : a
+                ''',
+                '''
+                def f(x):
+                    a = x
+                    return lambda : a
+                ''')
+
+    def test_locals(self):
+        source = '''
+                def f(x):
+                    a = x
+                    b = 1
+                    return locals()
+                '''
+        self._test_simplify(source, source)
+
+    def test_try(self):
+        self._test_simplify(
+                '''
+                def f(x):
+                    a = 1
+                    try:
+                        b = 2
+                        foo()
+                    except Exception:
+                        return a
+                    return b
+                ''',
+                '''
+                def f(x):
+                    try:
+                        b = 2
+                        foo()
+                    except Exception:
+                        return 1
+                    return b
+                ''')
@@ -0,0 +1,14 @@
+# -*- encoding: utf-8 -*-
+
+from __future__ import division
+
+from ast_pe.decorators import inline
+
+
+def ratio(a, b):
+    return a / b
+
+
+@inline
+def half(x):
+    return x / 2